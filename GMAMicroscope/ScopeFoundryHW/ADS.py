@@ -1,21 +1,124 @@
+import time
+
+import numpy as np
 from ScopeFoundry import HardwareComponent
+from ScopeFoundryHW.acquisition_source import AcquisitionSource, RecordGapCounter, StreamConfig
 from WF_SDK import device
 from WF_SDK import scope
 from WF_SDK import wavegen
 
-class ADSHardware(HardwareComponent):
+class WavegenSession:
+    """Remembers what was last sent to one wavegen channel and only sends changes.
+
+    The first configure() programs every parameter and starts the channel,
+    the ones not given get generate()'s defaults (DEFAULTS) so nothing is left
+    over from an earlier use of the channel. Later calls only send the
+    parameters that differ and apply them to the running channel, e.g.
+    stepping the amplitude of a test pulse costs a single call instead of
+    reprogramming the whole node.
+    """
+
+    # parameter name -> wavegen setter, in the order generate() sends them
+    SETTERS = {
+        "function": wavegen.set_function,
+        "data": wavegen.set_data,
+        "frequency": wavegen.set_frequency,
+        "amplitude": wavegen.set_amplitude,
+        "offset": wavegen.set_offset,
+        "symmetry": wavegen.set_symmetry,
+        "run_time": wavegen.set_run_time,
+        "wait": wavegen.set_wait,
+        "repeat": wavegen.set_repeat,
+    }
+
+    # what wavegen.generate() sends for parameters it is not given
+    DEFAULTS = {
+        "offset": 0,
+        "frequency": 1e3,
+        "amplitude": 1,
+        "symmetry": 50,
+        "run_time": 0,
+        "wait": 0,
+        "repeat": 0,
+    }
+
+    def __init__(self, handle, channel=1):
+        self.handle = handle
+        self.channel = channel
+        self.state = {}
+        self.running = False
+
+    def changed(self, name, value):
+        if name not in self.state:
+            return True
+        if name == "data":
+            return not np.array_equal(self.state[name], value)
+        # wavegen.function members are ctypes values, compare what they hold
+        return getattr(self.state[name], "value", self.state[name]) != getattr(value, "value", value)
+
+    def configure(self, **params):
+        """Sends the parameters that changed since the last call.
+
+        Args:
+            **params: Any of SETTERS, e.g. amplitude=0.5. 'data' is a custom
+            waveform (numpy array), only used with function=wavegen.function.custom.
+
+        Returns:
+            list: Names of the parameters that were sent.
+        """
+        # parameters never sent on this channel (first call, or after forget())
+        params = {**{k: v for k, v in self.DEFAULTS.items() if k not in self.state}, **params}
+        sent = []
+        for name, setter in self.SETTERS.items():
+            if name not in params:
+                continue
+            value = params[name]
+            if name == "data":
+                value = np.array(value, dtype=np.float64)
+            if self.changed(name, value):
+                setter(self.handle, self.channel, value)
+                self.state[name] = value
+                sent.append(name)
+
+        if not self.running:
+            wavegen.set_enabled(self.handle, self.channel, True)
+            wavegen.enable(self.handle, self.channel)
+            self.running = True
+        elif sent:
+            wavegen.apply(self.handle, self.channel)
+        return sent
+
+    def stop(self):
+        wavegen.disable(self.handle, self.channel)
+        self.running = False
+
+    def forget(self):
+        """Drops the cached state, e.g. after the channel was reset."""
+        self.state = {}
+        self.running = False
+
+
+class ADSHardware(HardwareComponent, AcquisitionSource):
     """Class of functions for interfacing with the ADS.
+
+    As an AcquisitionSource it records one buffer per chunk (no streaming), so
+    the samples between chunks are reported as lost. Raw chunks are the 16 bit
+    ADC values.
     """
 
+    max_sample_rate = 100e6
+
     def setup(self):
         self.name = 'ads'
         self.handle = None
+        self.wavegen_sessions = {}
 
     def connect(self):
         """Connects to the ADS. Defines 'handle', the address to the ADS.
         Must be run at the beginning of every program using the ADS.
         """
         self.handle = device.open()
+        self.wavegen_sessions = {}
 
     def open_scope(self, buffer_size=1000, sample_freq=1e6):
         """Opens connection to the scope.
@@ -61,6 +164,26 @@ class ADSHardware(HardwareComponent):
         """
         scope.close(self.handle)
 
+    def _open_stream(self, buffer_size, sample_freq, channel):
+        self.open_scope(buffer_size=buffer_size, sample_freq=sample_freq)
+        self.stream_channel = channel
+        # open() reads back what the device accepted, the buffer is capped by its memory
+        buffer_size, sample_freq = scope.data.buffer_size, scope.data.sampling_frequency
+        self.record_gaps = RecordGapCounter(sample_freq, buffer_size)
+        scale, offset = scope.raw_scale(self.handle, channel)
+        return StreamConfig(buffer_size, sample_freq, np.int16, scale, offset, continuous=False)
+
+    def _read_into(self, out, raw):
+        timestamp = time.time()
+        if raw:
+            scope.record_raw(self.handle, self.stream_channel, out)
+        else:
+            scope.record_into(self.handle, self.stream_channel, out)
+        return timestamp, self.record_gaps.record_started(timestamp)
+
+    def _close_stream(self):
+        self.close_scope()
+
     def use_wavegen(self, channel=1, function=wavegen.function.sine, offset_v=0, freq_hz=1e3, amp_v=1):
         """Runs the wavegen producing function with given parameters.
 
@@ -72,13 +195,38 @@ class ADSHardware(HardwareComponent):
             freq (int, optional): Frequency (Hz). Defaults to 1e3.
             amp (int, optional): Amplitude (V). Defaults to 1.
         """
-        wavegen.generate(self.handle, channel=channel, function=function, offset=offset_v,
-                         frequency=freq_hz, amplitude=amp_v)
+        self.wavegen_session(channel).configure(function=function, offset=offset_v,
+                                                frequency=freq_hz, amplitude=amp_v)
+
+    def set_pulser(self, amp_v, channel=1, freq_hz=1e3, width_percent=1.0):
+        """Outputs a pulse train of the given amplitude, e.g. as test pulses for
+        calibration. Only the parameters that changed since the last call are sent,
+        so stepping amp_v through a sweep is cheap.
+
+        Args:
+            amp_v (float): Pulse amplitude (V).
+            channel (int, optional): Which channel output is at. Defaults to 1.
+            freq_hz (float, optional): Pulse repetition rate (Hz). Defaults to 1e3.
+            width_percent (float, optional): Pulse width as percentage of the period. Defaults to 1.
+        """
+        self.wavegen_session(channel).configure(function=wavegen.function.pulse, offset=0,
+                                                frequency=freq_hz, amplitude=amp_v,
+                                                symmetry=width_percent)
+
+    def wavegen_session(self, channel=1):
+        """Returns the WavegenSession of a channel. Repeated configure() calls on it
+        only send the parameters that changed, e.g. for amplitude sweeps.
+        """
+        if channel not in self.wavegen_sessions:
+            self.wavegen_sessions[channel] = WavegenSession(self.handle, channel)
+        return self.wavegen_sessions[channel]
 
     def close_wavegen(self):
         """Closes wavegen.
         """
         wavegen.close(self.handle)
+        for session in self.wavegen_sessions.values():
+            session.forget()
 
     def disconnect(self):
         """Closes ADS connection. Must be run at the end of every program.
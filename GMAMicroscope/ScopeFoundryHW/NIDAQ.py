@@ -1,8 +1,14 @@
+import time
+
 from ScopeFoundry import HardwareComponent
 #from ni_dac_task import NI_DacTask
 import PyDAQmx as mx
 import numpy as np
 import logging
+
+from ScopeFoundryHW.acquisition_source import AcquisitionSource, StreamConfig
+from ScopeFoundryHW.ni_dac_task import NI_DacTask as NI_AOTask
+from ScopeFoundryHW.sample_ring import SampleRing
 logger = logging.getLogger(__name__)
 
 class NamedTask(mx.Task):
@@ -156,20 +162,20 @@ class NI_DacTask(NI_TaskWrap): #NEED TO MODIFY THIS TASK ##
             self.error(err)
 
     def read(self):
-        value = mx.float64()
-        # if not isinstance( data, np.ndarray ) or data.dtype != np.float64:
-        #     data = np.asarray(data, dtype = np.float64 )
-        # if self._mode != 'single':
-        #     self.set_single()
-        #     self.start()
-        # writeCount = mx.int32(0)
-        # auto_start = mx.bool32(1)
-        
-        #self.task.ReadAnalogF64(timeout=10.0, value = mx.byref(value),reserved=None)
-        #self.task.ReadAnalogF64(timeout=10.0, value = mx.byref(value),reserved=None)
-        return value.value
-    
-    
+        ''' reads one sample per channel in immediate (non buffered) mode, returns a float
+            for a single channel and an array otherwise'''
+        data = np.zeros(max(self._chan_count, 1), dtype=np.float64)
+        readCount = mx.int32(0)
+        try:
+            #  ReadAnalogF64 (int32 numSampsPerChan, float64 timeout, bool32 fillMode,
+            #    float64 readArray[], uInt32 arraySizeInSamps, int32 *sampsPerChanRead, bool32 *reserved)
+            self.task.ReadAnalogF64(1, 1.0, mx.DAQmx_Val_GroupByChannel,
+                                    data, mx.uInt32(data.size), mx.byref(readCount), None)
+        except mx.DAQError as err:
+            self.error(err)
+        if data.size == 1:
+            return data[0]
+        return data
 
     def set_rate(self, rate = 1e4, count = 1000, finite = True, clk_source=""):
         """
@@ -266,7 +272,7 @@ class NI_DacTask(NI_TaskWrap): #NEED TO MODIFY THIS TASK ##
                                     1.0, #Float64 timeout 0 indicates to try once to read the requested samples 1.0 works
                                     mx.DAQmx_Val_GroupByChannel, #bool32fillMode
                                     data,  #float64 readArray[]
-                                    100, #uInt32 arraySizeInSamps QUESTION MARK??
+                                    mx.uInt32(data.size), #uInt32 arraySizeInSamps, size of readArray
                                     mx.byref(writeCount), #int32 *sampsPerChanRead
                                     None) # bool32 *reserved
         except mx.DAQError as err:
@@ -295,7 +301,7 @@ class NI_DacTask(NI_TaskWrap): #NEED TO MODIFY THIS TASK ##
                                     1.0, #Float64 timeout 0 indicates to try once to read the requested samples 1.0 works
                                     mx.DAQmx_Val_GroupByChannel, #bool32fillMode
                                     data,  #float64 readArray[]
-                                    10, #uInt32 arraySizeInSamps QUESTION MARK??
+                                    mx.uInt32(data.size), #uInt32 arraySizeInSamps, size of readArray
                                     mx.byref(writeCount), #int32 *sampsPerChanRead
                                     None) # bool32 *reserved
                                            
@@ -329,7 +335,146 @@ class NI_DacTask(NI_TaskWrap): #NEED TO MODIFY THIS TASK ##
             nSamples=self.cb_nSamples,
             options=0)
 
-class NIDAQHardware(HardwareComponent):
+class NI_AITask(NI_TaskWrap):
+    '''
+    Buffered continuous analog input task, inherits from abstract NI_TaskWrap task
+
+    Samples are clocked by the sample clock at *rate* on all *channels*. Every
+    *n_samples* samples per channel the DAQmx EveryNSamples callback reads them
+    into a preallocated block and copies it into a SampleRing, from which the
+    consumer reads with read_block(). Nothing is allocated per callback.
+    '''
+    def __init__(self, channels, rate=1e5, n_samples=1000, ring_samples=None,
+                 v_range=10.0, name=''):
+        ''' creates AI task, channels is a list or a comma separated string like "Dev1/ai0, Dev1/ai1"'''
+        NI_TaskWrap.__init__(self, name)
+        if isinstance(channels, str):
+            channels = [c.strip() for c in channels.split(',') if c.strip()]
+        self._channels = list(channels)
+        self._n_samples = int(n_samples)
+        # at least a second of data or 16 callbacks, whichever is more
+        if ring_samples is None:
+            ring_samples = max(16 * self._n_samples, int(rate))
+        self.ring = None  # stays None if the task could not be set up, see start()
+        if self.task:
+            self.set_channels(self._channels, v_range)
+            self.set_rate(rate, ring_samples)
+        if self.task and self._chan_count and not self._error_list:
+            self.ring = SampleRing(self._chan_count, ring_samples)
+            self._block = np.zeros((self._chan_count, self._n_samples), dtype=np.float64)
+            self.set_n_sample_callback(self._n_samples)
+
+    def set_channels(self, channels, v_range=10.0):
+        ''' adds input channels to existing task, voltage range +/- v_range, no scaling'''
+        try:
+            for channel in channels:
+                #  CreateAIVoltageChan ( const char physicalChannel[], const char nameToAssignToChannel[],
+                #    int32 terminalConfig, float64 minVal, float64 maxVal, int32 units, const char customScaleName[]);
+                self.task.CreateAIVoltageChan(channel, '', mx.DAQmx_Val_Cfg_Default,
+                                              -v_range, v_range, mx.DAQmx_Val_Volts, None)
+            chan_count = mx.uInt32(0)
+            self.task.GetTaskNumChans(mx.byref(chan_count))
+            self._chan_count = chan_count.value
+            self._channel = ','.join(channels)
+        except mx.DAQError as err:
+            self._chan_count = 0
+            self.error(err)
+
+    def set_rate(self, rate=1e5, buffer_samples=100000, clk_source=""):
+        ''' continuous sampling at *rate* (Hz), the driver buffer holds *buffer_samples* per channel'''
+        try:
+            self.stop()
+            #  in continuous mode sampsPerChan only sizes the input buffer
+            self.task.CfgSampClkTiming(clk_source, mx.float64(rate), mx.DAQmx_Val_Rising,
+                                       mx.DAQmx_Val_ContSamps, mx.uInt64(int(buffer_samples)))
+            self.task.CfgInputBuffer(mx.uInt32(int(buffer_samples)))
+            ai_rate = mx.float64(0)
+            #exact rate depends on hardware timer properties, may be slightly different from requested rate
+            self.task.GetSampClkRate(mx.byref(ai_rate))
+            self._rate = ai_rate.value
+            self._mode = 'buffered'
+        except mx.DAQError as err:
+            self.error(err)
+            self._rate = 0
+
+    def set_n_sample_callback(self, n_samples):
+        ''' registers EveryNCallback for every *n_samples* acquired into the driver buffer'''
+        self.task.EveryNCallback = self.EveryNCallback
+        try:
+            self.task.AutoRegisterEveryNSamplesEvent(mx.DAQmx_Val_Acquired_Into_Buffer, n_samples, 0)
+        except mx.DAQError as err:
+            self.error(err)
+
+    def EveryNCallback(self):
+        readCount = mx.int32(0)
+        try:
+            self.task.ReadAnalogF64(self._n_samples, 0.0, mx.DAQmx_Val_GroupByChannel,
+                                    self._block, mx.uInt32(self._block.size),
+                                    mx.byref(readCount), None)
+        except mx.DAQError as err:
+            self.error(err)
+            return 0
+        self.ring.write(self._block[:, :readCount.value])
+        return 0 # The function should return an integer
+
+    def start(self):
+        if self.ring is None:
+            errors = '; '.join(getattr(err, 'message', str(err)) for err in self._error_list)
+            raise RuntimeError('AI task {} on {} could not be set up: {}'.format(
+                self._task_name, ','.join(self._channels), errors or 'DAQmx not available'))
+        self.ring.reset()
+        NI_TaskWrap.start(self)
+
+    def read_block(self, n, channel=None, timeout=10.0, out=None):
+        ''' waits for the next *n* samples per channel, *channel* is an index into the
+            task's channels (all channels if None), copied into *out* if given'''
+        return self.ring.read(n, channel, timeout, out)
+
+class NI_SyncAITask(NI_TaskWrap):
+    '''
+    Finite analog input task clocked by another task's sample clock, e.g. the
+    AO sample clock of a scan waveform, so input sample k is taken on the same
+    edge as output sample k
+    '''
+    def __init__(self, channels, clk_source, rate, count, v_range=10.0, name=''):
+        NI_TaskWrap.__init__(self, name)
+        if isinstance(channels, str):
+            channels = [c.strip() for c in channels.split(',') if c.strip()]
+        self._count = int(count)
+        if self.task:
+            try:
+                for channel in channels:
+                    self.task.CreateAIVoltageChan(channel, '', mx.DAQmx_Val_Cfg_Default,
+                                                  -v_range, v_range, mx.DAQmx_Val_Volts, None)
+                chan_count = mx.uInt32(0)
+                self.task.GetTaskNumChans(mx.byref(chan_count))
+                self._chan_count = chan_count.value
+                #  rate is the expected rate of the external clock, used for buffer sizing
+                self.task.CfgSampClkTiming(clk_source, mx.float64(rate), mx.DAQmx_Val_Rising,
+                                           mx.DAQmx_Val_FiniteSamps, mx.uInt64(self._count))
+                self._rate = rate
+                self._mode = 'buffered'
+            except mx.DAQError as err:
+                self.error(err)
+
+    def read_all(self, out, timeout=10.0):
+        ''' waits for all count samples per channel, out is (chan_count, count) float64'''
+        readCount = mx.int32(0)
+        try:
+            self.task.ReadAnalogF64(self._count, timeout, mx.DAQmx_Val_GroupByChannel,
+                                    out, mx.uInt32(out.size), mx.byref(readCount), None)
+        except mx.DAQError as err:
+            self.error(err)
+        return out
+
+class NIDAQHardware(HardwareComponent, AcquisitionSource):
+    '''
+    NI DAQ board: single point dac_val readback and, as an AcquisitionSource, a
+    gapless hardware-clocked AI stream (native dtype float64, driver-scaled volts)
+    '''
+
+    # aggregate AI rate of a typical multifunction board
+    max_sample_rate = 1.25e6
     
     def __init__(self, app, name='ni_dac', debug=False):
         self.name = name
@@ -340,6 +485,19 @@ class NIDAQHardware(HardwareComponent):
         #self.settings.New('channel', dtype=str, initial='/Dev1/ao0') #################### ORIGINAL ###################################################################
         #AO_00, Ao_00, AO_0, 
         self.settings.New('channel', dtype=str, initial='/Dev1/0')  ######New one######### /Dev1/0 or Dev1/0
+        # buffered AI stream, used through open_scope/read_scope like the ADS
+        self.settings.New('ai_channels', dtype=str, initial='Dev1/ai0',
+                          description='comma separated physical channels, read_scope(channel=k) reads the k-th')
+        self.settings.New('ai_range', dtype=float, initial=10.0, unit='V', vmin=0.1)
+        self.settings.New('ai_rate', dtype=float, initial=0.0, unit='Hz', ro=True,
+                          description='actual sample clock rate of the open stream')
+        self.settings.New('ai_overruns', dtype=int, initial=0, ro=True,
+                          description='samples lost because the reader fell behind')
+        # hardware timed line scans: AO trajectory and AI on the AO sample clock
+        self.settings.New('ao_channels', dtype=str, initial='Dev1/ao0, Dev1/ao1',
+                          description='scan axes in order (h, v[, z])')
+        self.ai_task = None
+        self.line_scan = None
     def connect(self):
         S = self.settings
         
@@ -355,8 +513,125 @@ class NIDAQHardware(HardwareComponent):
         self.settings.dac_val.connect_to_hardware(read_func=self.dac_task.read) #changed from write_func OG
         #self.dac_task.set(self.settings["dac_val"]) #This one works
         
+    def open_scope(self, buffer_size=1000, sample_freq=1e6):
+        """Starts continuous buffered acquisition on the ai_channels, same interface as
+        ADSHardware.open_scope.
+
+        Args:
+            buffer_size (int, optional): Samples per channel returned by each read_scope call. Defaults to 1000.
+            sample_freq (float, optional): Sample clock rate (Hz). Defaults to 1e6.
+        """
+        self.close_scope()
+        self.buffer_size = int(buffer_size)
+        self.ai_task = NI_AITask(self.settings['ai_channels'], rate=sample_freq,
+                                 n_samples=self.buffer_size, v_range=self.settings['ai_range'],
+                                 name=self.name + ' ai')
+        try:
+            self.ai_task.start()
+        except RuntimeError:
+            self.close_scope()
+            raise
+        self.settings['ai_rate'] = self.ai_task.get_rate()
+        self.ai_start_time = time.time()
+        # one acquisition of all channels, see read_scope
+        self.scope_block = np.zeros((self.ai_task.get_chan_count(), self.buffer_size))
+        self.scope_block_read = set(range(1, self.ai_task.get_chan_count() + 1))
+
+    def read_scope(self, channel=1):
+        """Returns buffer_size samples of a channel, waiting for them if needed.
+
+        Like on the ADS, the channels of one acquisition cover the same time:
+        the next block of all channels is read when *channel* was already
+        returned from the current one, so read_scope(1), read_scope(2) gives
+        simultaneous samples and repeated read_scope(1) consecutive ones.
+
+        Args:
+            channel (int, optional): 1-based index into ai_channels. Defaults to 1.
+
+        Returns:
+            buffer (array): buffer_size samples (V).
+        """
+        if channel in self.scope_block_read:
+            self.ai_task.read_block(self.buffer_size, out=self.scope_block)
+            self.scope_block_read = set()
+            self.settings['ai_overruns'] = self.ai_task.ring.overruns
+        self.scope_block_read.add(channel)
+        return self.scope_block[channel - 1].copy()
+
+    def close_scope(self):
+        """Stops and clears the AI stream."""
+        if self.ai_task is not None:
+            if self.ai_task.task is not None:
+                self.ai_task.stop()
+                self.ai_task.clear()
+            self.ai_task = None
+
+    def _open_stream(self, buffer_size, sample_freq, channel):
+        self.open_scope(buffer_size=buffer_size, sample_freq=sample_freq)
+        self.stream_channel = channel
+        return StreamConfig(buffer_size, self.ai_task.get_rate(), np.float64, continuous=True)
+
+    def _read_into(self, out, raw):
+        # a stream follows one channel, the reads move past the samples of the others
+        ring = self.ai_task.ring
+        overruns = ring.overruns
+        self.ai_task.read_block(out.size, self.stream_channel - 1, out=out)
+        self.settings['ai_overruns'] = ring.overruns
+        # hardware clocked, the sample index gives the time
+        timestamp = self.ai_start_time + ring.last_read_start / self.ai_task.get_rate()
+        return timestamp, ring.overruns - overruns
+
+    def _close_stream(self):
+        self.close_scope()
+
+    def setup_line_scan(self, n_samples, rate):
+        """Prepares AO and synchronously clocked AI tasks for scan lines of *n_samples*
+        samples at *rate* (Hz). Returns the actual rate."""
+        self.end_line_scan()
+        ao_channels = self.settings['ao_channels']
+        ao = NI_AOTask(ao_channels, name=self.name + ' scan ao')
+        ao.set_rate(rate, n_samples, finite=True)
+        # AI samples on the AO sample clock of the same device
+        device = ao_channels.split(',')[0].strip().strip('/').split('/')[0]
+        ai = NI_SyncAITask(self.settings['ai_channels'], '/%s/ao/SampleClock' % device,
+                           ao.get_rate(), n_samples, self.settings['ai_range'], name=self.name + ' scan ai')
+        self.line_scan = (ao, ai)
+        return ao.get_rate()
+
+    def scan_line(self, trajectory, out=None):
+        """Outputs one line and reads the AI channels on the same clock.
+
+        Args:
+            trajectory (array): (n_samples, n_ao_channels) output waveform (V).
+            out (array, optional): (n_ai_channels, n_samples) float64 array to read into,
+            reuse it between lines to avoid allocations.
+
+        Returns:
+            array: (n_ai_channels, n_samples) input samples (V).
+        """
+        ao, ai = self.line_scan
+        if out is None:
+            out = np.zeros((ai.get_chan_count(), len(trajectory)))
+        ao.stop()
+        ai.stop()
+        ao.load_buffer(np.ascontiguousarray(trajectory, dtype=np.float64).ravel())
+        ai.start()  # armed, waits for the AO clock
+        ao.start()
+        ai.read_all(out, timeout=10.0 + len(trajectory) / ao.get_rate())
+        ao.wait()
+        return out
+
+    def end_line_scan(self):
+        if self.line_scan is not None:
+            for task in self.line_scan:
+                task.stop()
+                task.clear()
+            self.line_scan = None
+
     def disconnect(self):
         self.settings.disconnect_all_from_hardware()
+        self.close_scope()
+        self.end_line_scan()
 
         #enable channel and terminal_config 
         
@@ -1,6 +1,8 @@
-""" LOGIC ANALYZER CONTROL FUNCTIONS: open, trigger, record, close """
+""" LOGIC ANALYZER CONTROL FUNCTIONS: open, trigger, record, record_raw, close
+    DATA HELPERS: unpack_lines, edge_indices, edge_times """
 
 import ctypes                     # import the C compatible data types
+import numpy as np                # sample arrays and vectorized bit operations
 from sys import platform, path    # this is needed to check the OS type and get the PATH
 from os import sep                # OS specific file path separators
 
@@ -137,6 +139,21 @@ def record(device_data, channel):
 
         returns:    - a list with the recorded logic values
     """
+    return unpack_lines(record_raw(device_data), channel).tolist()
+
+"""-----------------------------------------------------------------------"""
+
+def record_raw(device_data, out=None):
+    """
+        record all 16 DIO lines at once
+
+        parameters: - device data
+                    - out - optional uint16 numpy array of length data.buffer_size to record into,
+                      reuse it between calls to avoid allocations
+
+        returns:    - uint16 numpy array with one sample per element, bit n is DIO line n
+                      (the library writes directly into the array, no copies are made)
+    """
     # set up the instrument
     if dwf.FDwfDigitalInConfigure(device_data.handle, ctypes.c_bool(False), ctypes.c_bool(True)) == 0:
         check_error()
@@ -152,16 +169,71 @@ def record(device_data, channel):
             break
     
     # get samples
-    buffer = (ctypes.c_uint16 * data.buffer_size)()
-    if dwf.FDwfDigitalInStatusData(device_data.handle, buffer, ctypes.c_int(2 * data.buffer_size)) == 0:
+    if out is None:
+        out = np.empty(data.buffer_size, dtype=np.uint16)
+    elif out.dtype != np.uint16 or out.size < data.buffer_size or not out.flags.c_contiguous:
+        raise ValueError("out must be a contiguous uint16 array of at least " + str(data.buffer_size) + " samples")
+    if dwf.FDwfDigitalInStatusData(device_data.handle, out.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)), ctypes.c_int(2 * data.buffer_size)) == 0:
         check_error()
-    
-    # convert buffer to list of lists of integers
-    result = []
-    for point in buffer:
-        result.append((int(point) & (1 << channel)) >> channel)
-    
-    return result
+    return out[:data.buffer_size]
+
+"""-----------------------------------------------------------------------"""
+
+def unpack_lines(samples, lines=None):
+    """
+        split recorded samples into logic levels per DIO line
+
+        parameters: - samples - uint16 array from record_raw
+                    - lines - a DIO line number or a list of them, default is all 16 lines
+
+        returns:    - uint8 array of 0/1 values, 1D for a single line number,
+                      otherwise shape (number of lines, number of samples)
+    """
+    samples = np.ascontiguousarray(samples, dtype="<u2")
+    # each sample becomes 16 bits, bit n in column n
+    bits = np.unpackbits(samples.view(np.uint8).reshape(-1, 2), axis=1, bitorder="little")
+    if lines is None:
+        lines = range(16)
+    if np.ndim(lines) == 0:
+        return bits[:, lines]
+    return bits[:, list(lines)].T
+
+"""-----------------------------------------------------------------------"""
+
+def edge_indices(levels, edge="rising"):
+    """
+        find the transitions of one line
+
+        parameters: - levels - 0/1 array of a single line (see unpack_lines)
+                    - edge - "rising", "falling" or "both"
+
+        returns:    - indices of the first sample after each transition
+    """
+    change = np.diff(levels.astype(np.int8))
+    if edge == "rising":
+        return np.flatnonzero(change > 0) + 1
+    if edge == "falling":
+        return np.flatnonzero(change < 0) + 1
+    return np.flatnonzero(change) + 1
+
+"""-----------------------------------------------------------------------"""
+
+def edge_times(samples, line, edge="rising", sampling_frequency=None):
+    """
+        timestamps of the transitions of one DIO line
+
+        parameters: - samples - uint16 array from record_raw
+                    - line - the selected DIO line number
+                    - edge - "rising", "falling" or "both"
+                    - sampling frequency in Hz, default is the one set in open()
+
+        returns:    - numpy array of edge times in seconds from the first sample
+    """
+    if sampling_frequency is None:
+        sampling_frequency = data.sampling_frequency
+    # a shift and mask is cheaper than unpacking all lines when only one is needed
+    levels = (np.asarray(samples) >> line) & 1
+    return edge_indices(levels, edge) / sampling_frequency
 
 """-----------------------------------------------------------------------"""
 
@@ -1,6 +1,7 @@
 """ OSCILLOSCOPE CONTROL FUNCTIONS: open, measure, trigger, record, close """
 
 import ctypes                     # import the C compatible data types
+import numpy as np                # sample arrays for record_into/record_raw
 from sys import platform, path    # this is needed to check the OS type and get the PATH
 from os import sep                # OS specific file path separators
 
@@ -84,6 +85,16 @@ def open(device_data, sampling_frequency=20e06, buffer_size=0, offset=0, amplitu
     # disable averaging (for more info check the documentation)
     if dwf.FDwfAnalogInChannelFilterSet(device_data.handle, ctypes.c_int(-1), constants.filterDecimate) == 0:
         check_error()
+
+    # the device rounds to what it supports, keep the values it actually uses
+    actual_size = ctypes.c_int()
+    if dwf.FDwfAnalogInBufferSizeGet(device_data.handle, ctypes.byref(actual_size)) == 0:
+        check_error()
+    data.buffer_size = actual_size.value
+    actual_frequency = ctypes.c_double()
+    if dwf.FDwfAnalogInFrequencyGet(device_data.handle, ctypes.byref(actual_frequency)) == 0:
+        check_error()
+    data.sampling_frequency = actual_frequency.value
     return
 
 """-----------------------------------------------------------------------"""
@@ -177,6 +188,12 @@ def record(device_data, channel):
 
         returns:    - a list with the recorded voltages
     """
+    buffer = record_into(device_data, channel)
+    # convert into list
+    return buffer.tolist()
+
+def _acquire(device_data):
+    """ start a recording and wait until the internal buffer is full """
     # set up the instrument
     if dwf.FDwfAnalogInConfigure(device_data.handle, ctypes.c_bool(False), ctypes.c_bool(True)) == 0:
         check_error()
@@ -191,15 +208,61 @@ def record(device_data, channel):
         if status.value == constants.DwfStateDone.value:
                 # exit loop when ready
                 break
-    
-    # copy buffer
-    buffer = (ctypes.c_double * data.buffer_size)()   # create an empty buffer
-    if dwf.FDwfAnalogInStatusData(device_data.handle, ctypes.c_int(channel - 1), buffer, ctypes.c_int(data.buffer_size)) == 0:
+
+def _check_out(out, dtype):
+    if out is None:
+        return np.empty(data.buffer_size, dtype=dtype)
+    if out.dtype != dtype or out.size < data.buffer_size or not out.flags.c_contiguous:
+        raise ValueError("out must be a contiguous " + np.dtype(dtype).name + " array of at least " + str(data.buffer_size) + " samples")
+    return out
+
+def record_into(device_data, channel, out=None):
+    """
+        record an analog signal into a numpy array
+
+        parameters: - device data
+                    - the selected oscilloscope channel (1-2, or 1-4)
+                    - out - optional float64 numpy array of length data.buffer_size to record into,
+                      reuse it between calls to avoid allocations
+
+        returns:    - float64 numpy array with the recorded voltages (written by the library, no copies)
+    """
+    _acquire(device_data)
+    out = _check_out(out, np.float64)
+    if dwf.FDwfAnalogInStatusData(device_data.handle, ctypes.c_int(channel - 1), out.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), ctypes.c_int(data.buffer_size)) == 0:
         check_error()
-    
-    # convert into list
-    buffer = [float(element) for element in buffer]
-    return buffer
+    return out[:data.buffer_size]
+
+def record_raw(device_data, channel, out=None):
+    """
+        record an analog signal as raw 16 bit ADC values
+
+        parameters: - device data
+                    - the selected oscilloscope channel (1-2, or 1-4)
+                    - out - optional int16 numpy array of length data.buffer_size to record into
+
+        returns:    - int16 numpy array, volts = raw * raw_scale(...) + offset of the channel
+    """
+    _acquire(device_data)
+    out = _check_out(out, np.int16)
+    if dwf.FDwfAnalogInStatusData16(device_data.handle, ctypes.c_int(channel - 1), out.ctypes.data_as(ctypes.POINTER(ctypes.c_short)), ctypes.c_int(0), ctypes.c_int(data.buffer_size)) == 0:
+        check_error()
+    return out[:data.buffer_size]
+
+def raw_scale(device_data, channel):
+    """
+        conversion of record_raw values to volts
+
+        returns:    - (scale, offset) so that volts = raw * scale + offset
+    """
+    amplitude_range = ctypes.c_double()
+    offset = ctypes.c_double()
+    if dwf.FDwfAnalogInChannelRangeGet(device_data.handle, ctypes.c_int(channel - 1), ctypes.byref(amplitude_range)) == 0:
+        check_error()
+    if dwf.FDwfAnalogInChannelOffsetGet(device_data.handle, ctypes.c_int(channel - 1), ctypes.byref(offset)) == 0:
+        check_error()
+    # the full range is spread over the 16 bit signed values
+    return amplitude_range.value / 65536, offset.value
 
 """-----------------------------------------------------------------------"""
 
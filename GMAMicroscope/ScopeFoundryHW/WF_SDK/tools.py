@@ -3,7 +3,8 @@
 import ctypes                     # import the C compatible data types
 from sys import platform, path    # this is needed to check the OS type and get the PATH
 from os import sep                # OS specific file path separators
-from math import log10, sqrt      # import necessary math functions
+from functools import lru_cache  # cache window arrays between calls
+import numpy as np                # vectorized window and log10
 
 # load the dynamic library, get constants path (the path is OS specific)
 if platform.startswith("win"):
@@ -43,29 +44,38 @@ def spectrum(buffer, window, sample_rate, frequency_start, frequency_stop):
     """
         calculates the spectrum of a signal
 
-        parameters: - buffer: list of data points in the signal
+        parameters: - buffer: list or numpy array of data points in the signal (not modified)
                     - window type: rectangular, triangular, hamming, hann, cosine, blackman_harris, flat_top, kaiser
                     - sample rate of the signal in Hz
                     - starting frequency of the spectrum in Hz
                     - end frequency of the spectrum in Hz
+
+        returns:    - numpy array of the spectrum in dB
     """
     # get and apply window
+    buffer = np.asarray(buffer, dtype=np.float64)
     buffer_length = len(buffer)
-    window_buffer = (ctypes.c_double * buffer_length)()   # create an empty buffer
-    dwf.FDwfSpectrumWindow(window_buffer, ctypes.c_int(buffer_length), window, ctypes.c_double(1), ctypes.c_double(0))
-    for index in range(buffer_length):
-        buffer[index] *= float(window_buffer[index])
+    # ctypes ints are not hashable, the cache is keyed on the window number
+    c_buffer = np.ascontiguousarray(buffer * _window(getattr(window, "value", window), buffer_length))
 
     # get the spectrum
     spectrum_length = int(buffer_length / 2 + 1)
-    c_spectrum = (ctypes.c_double * spectrum_length)()   # create an empty buffer
-    c_buffer = (ctypes.c_double * buffer_length)()
-    for index in range(0, len(buffer)):
-        c_buffer[index] = ctypes.c_double(buffer[index])
+    c_spectrum = np.empty(spectrum_length, dtype=np.float64)   # create an empty buffer
     frequency_start = max(frequency_start * 2.0 / sample_rate, 0.0)
     frequency_stop = min(frequency_stop * 2.0 / sample_rate, 1.0)
-    dwf.FDwfSpectrumTransform(c_buffer, ctypes.c_int(buffer_length), c_spectrum, ctypes.c_int(0), ctypes.c_int(spectrum_length), ctypes.c_double(frequency_start), ctypes.c_double(frequency_stop))
-    spectrum = []
-    for index in range(spectrum_length):
-        spectrum.append(20.0 * log10(float(c_spectrum[index]) / sqrt(2)))
-    return spectrum
+    dwf.FDwfSpectrumTransform(_as_c_double(c_buffer), ctypes.c_int(buffer_length), _as_c_double(c_spectrum), ctypes.c_int(0), ctypes.c_int(spectrum_length), ctypes.c_double(frequency_start), ctypes.c_double(frequency_stop))
+    return 20.0 * np.log10(c_spectrum / np.sqrt(2))
+
+"""-----------------------------------------------------------------------"""
+
+def _as_c_double(array):
+    """ pointer to the data of a contiguous float64 numpy array """
+    return array.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+
+@lru_cache(maxsize=16)
+def _window(window, buffer_length):
+    """ window array from the library, cached per window type (int) and length """
+    window_buffer = np.empty(buffer_length, dtype=np.float64)   # create an empty buffer
+    dwf.FDwfSpectrumWindow(_as_c_double(window_buffer), ctypes.c_int(buffer_length), ctypes.c_int(window), ctypes.c_double(1), ctypes.c_double(0))
+    window_buffer.flags.writeable = False
+    return window_buffer
@@ -1,6 +1,9 @@
-""" WAVEFORM GENERATOR CONTROL FUNCTIONS: generate, close, enable, disable """
+""" WAVEFORM GENERATOR CONTROL FUNCTIONS: generate, close, enable, disable, apply
+    PARAMETER SETTERS: set_function, set_data, set_frequency, set_amplitude, set_offset,
+                       set_symmetry, set_run_time, set_wait, set_repeat """
 
 import ctypes                     # import the C compatible data types
+import numpy as np                # custom waveform buffers
 from sys import platform, path    # this is needed to check the OS type and get the PATH
 from os import sep                # OS specific file path separators
 
@@ -56,56 +59,101 @@ def generate(device_data, channel, function, offset, frequency=1e03, amplitude=1
                     - wait time in seconds, default is 0s
                     - run time in seconds, default is infinite (0)
                     - repeat count, default is infinite (0)
-                    - data - list of voltages, used only if function=custom, default is empty
+                    - data - list or numpy array of samples, used only if function=custom, default is empty
     """
     # enable channel
-    channel = ctypes.c_int(channel - 1)
-    if dwf.FDwfAnalogOutNodeEnableSet(device_data.handle, channel, constants.AnalogOutNodeCarrier, ctypes.c_bool(True)) == 0:
-        check_error()
+    set_enabled(device_data, channel, True)
     
     # set function type
-    if dwf.FDwfAnalogOutNodeFunctionSet(device_data.handle, channel, constants.AnalogOutNodeCarrier, function) == 0:
-        check_error()
+    set_function(device_data, channel, function)
     
     # load data if the function type is custom
     if function == constants.funcCustom:
-        data_length = len(data)
-        buffer = (ctypes.c_double * data_length)()
-        for index in range(0, len(buffer)):
-            buffer[index] = ctypes.c_double(data[index])
-        if dwf.FDwfAnalogOutNodeDataSet(device_data.handle, channel, constants.AnalogOutNodeCarrier, buffer, ctypes.c_int(data_length)) == 0:
-            check_error()
+        set_data(device_data, channel, data)
     
-    # set frequency
-    if dwf.FDwfAnalogOutNodeFrequencySet(device_data.handle, channel, constants.AnalogOutNodeCarrier, ctypes.c_double(frequency)) == 0:
-        check_error()
+    # set frequency, amplitude or DC voltage, offset, symmetry
+    set_frequency(device_data, channel, frequency)
+    set_amplitude(device_data, channel, amplitude)
+    set_offset(device_data, channel, offset)
+    set_symmetry(device_data, channel, symmetry)
     
-    # set amplitude or DC voltage
-    if dwf.FDwfAnalogOutNodeAmplitudeSet(device_data.handle, channel, constants.AnalogOutNodeCarrier, ctypes.c_double(amplitude)) == 0:
-        check_error()
+    # set running time limit, wait time before start, number of repeating cycles
+    set_run_time(device_data, channel, run_time)
+    set_wait(device_data, channel, wait)
+    set_repeat(device_data, channel, repeat)
     
-    # set offset
-    if dwf.FDwfAnalogOutNodeOffsetSet(device_data.handle, channel, constants.AnalogOutNodeCarrier, ctypes.c_double(offset)) == 0:
+    # start
+    enable(device_data, channel)
+    return
+
+"""-----------------------------------------------------------------------"""
+
+def set_enabled(device_data, channel, state):
+    """ enables or disables the carrier node of a channel """
+    if dwf.FDwfAnalogOutNodeEnableSet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, ctypes.c_bool(state)) == 0:
         check_error()
-    
-    # set symmetry
-    if dwf.FDwfAnalogOutNodeSymmetrySet(device_data.handle, channel, constants.AnalogOutNodeCarrier, ctypes.c_double(symmetry)) == 0:
+    return
+
+def set_function(device_data, channel, function):
+    """ sets the function type (see the function class) """
+    if dwf.FDwfAnalogOutNodeFunctionSet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, function) == 0:
         check_error()
-    
-    # set running time limit
-    if dwf.FDwfAnalogOutRunSet(device_data.handle, channel, ctypes.c_double(run_time)) == 0:
+    return
+
+def set_data(device_data, channel, data):
+    """
+        uploads a custom waveform
+
+        parameters: - device data
+                    - the selected wavegen channel (1-2)
+                    - data - list or numpy array of samples, normalized to -1..1
+                      (a contiguous float64 array is passed to the library without copying)
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    buffer = data.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+    if dwf.FDwfAnalogOutNodeDataSet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, buffer, ctypes.c_int(data.size)) == 0:
         check_error()
-    
-    # set wait time before start
-    if dwf.FDwfAnalogOutWaitSet(device_data.handle, channel, ctypes.c_double(wait)) == 0:
+    return
+
+def set_frequency(device_data, channel, frequency):
+    """ sets the frequency in Hz """
+    if dwf.FDwfAnalogOutNodeFrequencySet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, ctypes.c_double(frequency)) == 0:
         check_error()
-    
-    # set number of repeating cycles
-    if dwf.FDwfAnalogOutRepeatSet(device_data.handle, channel, ctypes.c_int(repeat)) == 0:
+    return
+
+def set_amplitude(device_data, channel, amplitude):
+    """ sets the amplitude (or DC voltage) in Volts """
+    if dwf.FDwfAnalogOutNodeAmplitudeSet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, ctypes.c_double(amplitude)) == 0:
         check_error()
-    
-    # start
-    if dwf.FDwfAnalogOutConfigure(device_data.handle, channel, ctypes.c_bool(True)) == 0:
+    return
+
+def set_offset(device_data, channel, offset):
+    """ sets the offset voltage in Volts """
+    if dwf.FDwfAnalogOutNodeOffsetSet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, ctypes.c_double(offset)) == 0:
+        check_error()
+    return
+
+def set_symmetry(device_data, channel, symmetry):
+    """ sets the signal symmetry in percentage """
+    if dwf.FDwfAnalogOutNodeSymmetrySet(device_data.handle, ctypes.c_int(channel - 1), constants.AnalogOutNodeCarrier, ctypes.c_double(symmetry)) == 0:
+        check_error()
+    return
+
+def set_run_time(device_data, channel, run_time):
+    """ sets the running time limit in seconds, 0 is infinite """
+    if dwf.FDwfAnalogOutRunSet(device_data.handle, ctypes.c_int(channel - 1), ctypes.c_double(run_time)) == 0:
+        check_error()
+    return
+
+def set_wait(device_data, channel, wait):
+    """ sets the wait time before start in seconds """
+    if dwf.FDwfAnalogOutWaitSet(device_data.handle, ctypes.c_int(channel - 1), ctypes.c_double(wait)) == 0:
+        check_error()
+    return
+
+def set_repeat(device_data, channel, repeat):
+    """ sets the number of repeating cycles, 0 is infinite """
+    if dwf.FDwfAnalogOutRepeatSet(device_data.handle, ctypes.c_int(channel - 1), ctypes.c_int(repeat)) == 0:
         check_error()
     return
 
@@ -137,3 +185,12 @@ def disable(device_data, channel):
     if dwf.FDwfAnalogOutConfigure(device_data.handle, channel, ctypes.c_bool(False)) == 0:
         check_error()
     return
+
+"""-----------------------------------------------------------------------"""
+
+def apply(device_data, channel):
+    """ applies changed parameters to a running channel without restarting it """
+    channel = ctypes.c_int(channel - 1)
+    if dwf.FDwfAnalogOutConfigure(device_data.handle, channel, ctypes.c_int(3)) == 0:
+        check_error()
+    return
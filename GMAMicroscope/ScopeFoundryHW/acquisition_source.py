@@ -0,0 +1,173 @@
+"""Common streaming interface of the digitizers (ADS, NI DAQ, simulator).
+
+Measurements talk to any of them the same way:
+
+    source = pick_source(self.app, self.settings["source"])
+    config = source.open_stream(buffer_size, sample_freq)
+    buffer = source.new_chunk_buffer()
+    while ...:
+        buffer, info = source.read_chunk(out=buffer)
+    source.close_stream()
+"""
+import numpy as np
+
+
+class StreamConfig:
+    """What a source actually delivers, after open_stream negotiated the request.
+
+    Raw (native dtype) samples convert to volts as raw * scale + offset.
+    continuous is True for gapless sources (sample clock plus buffer), False for
+    ones that record buffer by buffer and miss the samples in between.
+    """
+
+    def __init__(self, buffer_size, sample_freq, native_dtype=np.float64, scale=1.0, offset=0.0,
+                 continuous=True):
+        self.buffer_size = int(buffer_size)
+        self.sample_freq = float(sample_freq)
+        self.native_dtype = np.dtype(native_dtype)
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.continuous = continuous
+
+    def to_volts(self, raw, out=None):
+        """Converts raw samples to volts, into *out* if given."""
+        if out is None:
+            out = np.empty(raw.shape)
+        np.multiply(raw, self.scale, out=out)
+        out += self.offset
+        return out
+
+    def __repr__(self):
+        return (f"StreamConfig(buffer_size={self.buffer_size}, sample_freq={self.sample_freq:g}, "
+                f"native_dtype={self.native_dtype}, continuous={self.continuous})")
+
+
+class ChunkInfo:
+    """Bookkeeping of one delivered chunk.
+
+    Attributes:
+        index (int): Chunk number since open_stream.
+        first_sample (int): Stream index of the chunk's first sample, lost samples included.
+        timestamp (float): time.time() of the first sample.
+        lost_samples (int): Samples dropped (or never recorded) since the previous chunk.
+    """
+
+    __slots__ = ("index", "first_sample", "timestamp", "lost_samples")
+
+    def __init__(self, index, first_sample, timestamp, lost_samples):
+        self.index = index
+        self.first_sample = first_sample
+        self.timestamp = timestamp
+        self.lost_samples = lost_samples
+
+
+class AcquisitionSource:
+    """Mixin for HardwareComponents that stream sample buffers.
+
+    Subclasses implement
+        _open_stream(buffer_size, sample_freq, channel) -> StreamConfig
+        _read_into(out, raw) -> (timestamp of the first sample, lost samples)
+        _close_stream()
+    and set max_sample_rate (samples/s) so pick_source() can rank them. The
+    mixin does the chunk bookkeeping and buffer allocation, out arrays are
+    filled in place so steady-state reading allocates nothing.
+    """
+
+    max_sample_rate = 0.0
+    simulated = False
+
+    def open_stream(self, buffer_size=1000, sample_freq=1e6, channel=1):
+        """Starts streaming one channel.
+
+        Args:
+            buffer_size (int, optional): Requested samples per chunk. Defaults to 1000.
+            sample_freq (float, optional): Requested sample rate (Hz). Defaults to 1e6.
+            channel (int, optional): 1-based input channel. Defaults to 1.
+
+        Returns:
+            StreamConfig: The buffer size and rate the source will actually deliver.
+        """
+        self.stream_config = self._open_stream(int(buffer_size), float(sample_freq), channel)
+        self.stream_chunks = 0
+        self.stream_samples = 0  # stream index of the next sample
+        self.stream_lost = 0
+        return self.stream_config
+
+    def new_chunk_buffer(self, raw=False):
+        """Preallocated array for read_chunk, native dtype if *raw*, float64 volts otherwise."""
+        config = self.stream_config
+        return np.empty(config.buffer_size, dtype=config.native_dtype if raw else np.float64)
+
+    def read_chunk(self, out=None, raw=False):
+        """Reads the next chunk into *out* (allocated if None).
+
+        Args:
+            out (array, optional): buffer_size array of float64 (volts) or, with raw, of the native dtype.
+            raw (bool, optional): Deliver native samples without conversion. Defaults to False.
+
+        Returns:
+            (array, ChunkInfo): out and the chunk's timestamp/lost-sample record.
+        """
+        if out is None:
+            out = self.new_chunk_buffer(raw)
+        timestamp, lost = self._read_into(out, raw)
+        info = ChunkInfo(self.stream_chunks, self.stream_samples + lost, timestamp, lost)
+        self.stream_chunks += 1
+        self.stream_samples += lost + out.size
+        self.stream_lost += lost
+        return out, info
+
+    def close_stream(self):
+        self._close_stream()
+
+    def _open_stream(self, buffer_size, sample_freq, channel):
+        raise NotImplementedError
+
+    def _read_into(self, out, raw):
+        raise NotImplementedError
+
+    def _close_stream(self):
+        raise NotImplementedError
+
+
+class RecordGapCounter:
+    """Lost-sample estimate for sources that record one buffer at a time: the
+    samples that would have fallen between the end of one record and the start
+    of the next."""
+
+    def __init__(self, sample_freq, buffer_size):
+        self.sample_freq = sample_freq
+        self.buffer_size = buffer_size
+        self.last_start = None
+
+    def record_started(self, timestamp):
+        """Returns the samples missed before a record started at *timestamp*."""
+        lost = 0
+        if self.last_start is not None:
+            gap = timestamp - self.last_start - self.buffer_size / self.sample_freq
+            lost = max(0, int(round(gap * self.sample_freq)))
+        self.last_start = timestamp
+        return lost
+
+
+def source_names(app):
+    """Names of the app's hardware components that are acquisition sources."""
+    return [name for name, hw in app.hardware.items() if isinstance(hw, AcquisitionSource)]
+
+
+def pick_source(app, name="auto"):
+    """Returns the acquisition source *name*, or for 'auto' the connected source
+    with the highest max_sample_rate, real hardware before simulators.
+
+    Raises:
+        ValueError: No such source, or none connected for 'auto'.
+    """
+    if name != "auto":
+        hw = app.hardware.get(name)
+        if not isinstance(hw, AcquisitionSource):
+            raise ValueError(f"{name!r} is not an acquisition source, choose from {source_names(app)}")
+        return hw
+    connected = [app.hardware[n] for n in source_names(app) if app.hardware[n].settings["connected"]]
+    if not connected:
+        raise ValueError("no acquisition source connected")
+    return max(connected, key=lambda hw: (not hw.simulated, hw.max_sample_rate))
@@ -1,4 +1,7 @@
 import random
+import time
+
+import numpy as np
 
 
 class Noiser200Dev:
@@ -6,12 +9,19 @@ class Noiser200Dev:
 
     def __init__(self, port) -> None:
         self.port = port
+        self.rng = np.random.default_rng()
         # establishing a connection to hardware
 
     # some awesome value read
     def read_signal(self):
         return random.uniform(0, 1)
 
+    # block read: n samples at sample_rate in one transfer, written into out
+    def read_signals(self, out, sample_rate):
+        time.sleep(out.size / sample_rate)  # the device takes this long to acquire them
+        self.rng.random(out=out)
+        return out
+
     # some awesome value read
     def write_voltage(self, voltage):
         print("wrote a voltage", voltage)
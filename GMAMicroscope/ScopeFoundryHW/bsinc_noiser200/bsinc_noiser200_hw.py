@@ -19,6 +19,10 @@ class Noiser200HW(HardwareComponent):
             si=True,
             protected=True,  # do not want to write a voltage from a file
         )
+        # block reads for integration, e.g. by Noiser200Collector
+        self.settings.New("sample_rate", float, initial=1000.0, unit="Hz", vmin=1)
+        self.settings.New("int_time", float, initial=0.1, unit="s", vmin=0,
+                          description="integration time per point of block reads")
 
     def connect(self):
         self.dev = Noiser200Dev(self.settings["port"])
@@ -26,6 +30,10 @@ class Noiser200HW(HardwareComponent):
         self.signal.connect_to_hardware(read_func=self.dev.read_signal)
         self.voltage.connect_to_hardware(write_func=self.dev.write_voltage)
 
+    def read_block(self, out):
+        """Reads out.size samples at sample_rate into the float64 array *out*."""
+        return self.dev.read_signals(out, self.settings["sample_rate"])
+
     def disconnect(self):
 
         self.settings.disconnect_all_from_hardware()
@@ -0,0 +1,71 @@
+"""Preallocated ring buffer for continuously acquired multi-channel samples."""
+import threading
+
+import numpy as np
+
+
+class SampleRing:
+    """(n_channels x size) ring of samples, written block-wise by an acquisition
+    callback and read block-wise by one consumer.
+
+    The writer never blocks: if the reader falls more than *size* samples
+    behind, the oldest unread samples are dropped and counted in `overruns`.
+    """
+
+    def __init__(self, n_channels, size, dtype=np.float64):
+        self.n_channels = int(n_channels)
+        self.size = int(size)
+        self.data = np.zeros((self.n_channels, self.size), dtype=dtype)
+        self.written = 0  # samples per channel written since reset
+        self.read_pos = 0
+        self.overruns = 0  # samples per channel lost to overruns
+        self.last_read_start = 0
+        self.cond = threading.Condition()
+
+    def reset(self):
+        with self.cond:
+            self.written = 0
+            self.read_pos = 0
+            self.overruns = 0
+
+    def write(self, block):
+        """Appends a (n_channels, n) block, n <= size."""
+        n = block.shape[1]
+        with self.cond:
+            i = self.written % self.size
+            first = min(n, self.size - i)
+            self.data[:, i:i + first] = block[:, :first]
+            self.data[:, :n - first] = block[:, first:]
+            self.written += n
+            self.cond.notify_all()
+
+    @property
+    def available(self):
+        return self.written - self.read_pos
+
+    def read(self, n, channels=None, timeout=10.0, out=None):
+        """Waits for the next *n* samples and returns a copy of them.
+
+        Args:
+            n (int): Samples per channel, at most size.
+            channels (int or slice, optional): Channel index or indices to return. Defaults to all.
+            timeout (float, optional): Seconds to wait for data. Defaults to 10.
+            out (array, optional): Preallocated array to copy into.
+
+        Returns:
+            array: (n,) for a single channel index, (n_channels, n) otherwise.
+            last_read_start holds the stream index of its first sample.
+        """
+        if channels is None:
+            channels = slice(None)
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.written - self.read_pos >= n, timeout):
+                raise TimeoutError(f"no {n} samples within {timeout} s")
+            lost = self.written - self.size - self.read_pos
+            if lost > 0:
+                self.overruns += lost
+                self.read_pos += lost
+            idx = np.arange(self.read_pos, self.read_pos + n) % self.size
+            self.last_read_start = self.read_pos
+            self.read_pos += n
+            return np.take(self.data[channels], idx, axis=-1, out=out)
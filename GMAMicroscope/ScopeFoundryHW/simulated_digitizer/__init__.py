@@ -0,0 +1 @@
+from .simulated_digitizer_hw import SimulatedDigitizerHW
@@ -0,0 +1,104 @@
+import time
+
+import numpy as np
+
+
+def parse_peaks(text):
+    """Parses '2.0:1, 3.5:0.5' (pulse height in V, optional relative weight) into
+    (heights, probabilities)."""
+    heights, weights = [], []
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        height, _, weight = item.partition(":")
+        heights.append(float(height))
+        weights.append(float(weight) if weight.strip() else 1.0)
+    if not heights:
+        raise ValueError("no peaks given")
+    weights = np.array(weights)
+    return np.array(heights), weights / weights.sum()
+
+
+class SimulatedDigitizerDev:
+    """Detector pulses on a noisy baseline, delivered like a continuously
+    sampling digitizer with 16 bit signed ADC values.
+
+    Pulses arrive as a Poisson process with heights drawn from a set of
+    Gaussian lines and a double exponential shape. The signal is continuous
+    across chunks, pulse tails carry over into the next chunk.
+
+    In realtime mode read() paces the stream to the sample clock and, like a
+    device with buffer_chunks chunks of on-board memory, drops samples once the
+    reader falls further behind. Otherwise chunks come as fast as they can be
+    generated, e.g. to benchmark the analysis.
+    """
+
+    def __init__(self, sample_freq=20e6, pulse_rate=1e3, peaks="2.0", resolution=2.0, noise=0.005,
+                 rise_time=50e-9, decay_time=2e-6, adc_bits=14, v_range=10.0,
+                 realtime=True, buffer_chunks=16, seed=None, debug=False):
+        self.sample_freq = float(sample_freq)
+        self.pulse_rate = float(pulse_rate)
+        self.heights, self.probabilities = parse_peaks(peaks)
+        self.sigma = resolution / 100 / 2.3548  # relative, from % FWHM
+        self.noise = noise
+        self.adc_bits = int(adc_bits)
+        self.scale = v_range / 2 ** self.adc_bits  # volts per ADC step
+        self.realtime = realtime
+        self.buffer_chunks = buffer_chunks
+        self.debug = debug
+        self.rng = np.random.default_rng(seed)
+
+        t = np.arange(int(np.ceil(8 * decay_time * self.sample_freq)) + 1) / self.sample_freq
+        shape = np.exp(-t / decay_time) - np.exp(-t / rise_time)
+        self.kernel = shape / shape.max()
+        self.tail = np.zeros(len(self.kernel) - 1)
+        self.next_sample = 0
+        self.start_time = time.time()
+
+    def start(self):
+        self.tail[:] = 0
+        self.next_sample = 0
+        self.start_time = time.time()
+
+    def generate(self, n):
+        """Next *n* samples of the signal in volts."""
+        impulses = np.zeros(n)
+        k = self.rng.poisson(self.pulse_rate * n / self.sample_freq)
+        heights = self.rng.choice(self.heights, k, p=self.probabilities)
+        heights *= 1 + self.sigma * self.rng.standard_normal(k)
+        np.add.at(impulses, self.rng.integers(0, n, k), heights)
+        signal = np.convolve(impulses, self.kernel)
+        signal[:len(self.tail)] += self.tail
+        self.tail = signal[n:]
+        signal = signal[:n]
+        signal += self.noise * self.rng.standard_normal(n)
+        return signal
+
+    def read(self, out):
+        """Fills the int16 array *out* with the next chunk.
+
+        Returns:
+            (int, int): Stream index of the chunk's first sample, samples dropped before it.
+        """
+        n = out.size
+        lost = 0
+        if self.realtime:
+            now_sample = (time.time() - self.start_time) * self.sample_freq
+            backlog = now_sample - self.next_sample
+            if backlog > (self.buffer_chunks + 1) * n:
+                lost = int(backlog) - self.buffer_chunks * n
+                self.next_sample += lost
+                self.tail[:] = 0
+                if self.debug:
+                    print(f"SimulatedDigitizerDev: reader behind, dropped {lost} samples")
+            wait = (self.next_sample + n) / self.sample_freq - (time.time() - self.start_time)
+            if wait > 0:
+                time.sleep(wait)
+        limit = 2 ** (self.adc_bits - 1)
+        codes = np.rint(self.generate(n) / self.scale)
+        np.clip(codes, -limit, limit - 1, out=codes)
+        out[:] = codes
+        first = self.next_sample
+        self.next_sample += n
+        return first, lost
+
+    def close(self):
+        pass
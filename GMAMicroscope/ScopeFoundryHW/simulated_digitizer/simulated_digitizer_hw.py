@@ -0,0 +1,73 @@
+import numpy as np
+
+from ScopeFoundry import HardwareComponent
+from ScopeFoundryHW.acquisition_source import AcquisitionSource, StreamConfig
+from ScopeFoundryHW.simulated_digitizer.simulated_digitizer_dev import (
+    SimulatedDigitizerDev,
+)
+
+
+class SimulatedDigitizerHW(HardwareComponent, AcquisitionSource):
+    """Simulated pulse digitizer, an AcquisitionSource like the ADS and the NI
+    DAQ, so measurements can be tried and benchmarked without hardware."""
+
+    name = "sim_digitizer"
+    simulated = True
+    max_sample_rate = 100e6
+
+    def setup(self):
+        S = self.settings
+        S.New("pulse_rate", float, initial=1e3, unit="Hz")
+        S.New("peaks", str, initial="2.0:1, 3.5:0.5",
+              description="pulse heights (V) with optional relative weights, 'V:weight, ...'")
+        S.New("resolution", float, initial=2.0, unit="%", description="FWHM of the lines")
+        S.New("noise", float, initial=0.005, unit="V", description="rms baseline noise")
+        S.New("rise_time", float, initial=50e-9, unit="s")
+        S.New("decay_time", float, initial=2e-6, unit="s")
+        S.New("adc_bits", int, initial=14, vmin=8, vmax=16)
+        S.New("v_range", float, initial=10.0, unit="V", description="ADC full range")
+        S.New("realtime", bool, initial=True,
+              description="pace to the sample clock and drop samples when the reader falls behind; "
+                          "off: as fast as possible, for benchmarks")
+        S.New("buffer_chunks", int, initial=16, description="simulated on-board memory in chunks")
+        S.New("seed", int, initial=-1, description="random seed, -1: fresh every stream")
+        S.New("lost_samples", int, initial=0, ro=True)
+
+    def connect(self):
+        pass
+
+    def _open_stream(self, buffer_size, sample_freq, channel):
+        S = self.settings
+        self.dev = SimulatedDigitizerDev(
+            sample_freq, S["pulse_rate"], S["peaks"], S["resolution"], S["noise"],
+            S["rise_time"], S["decay_time"], S["adc_bits"], S["v_range"], S["realtime"],
+            S["buffer_chunks"], seed=None if S["seed"] < 0 else S["seed"], debug=self.debug_mode.val)
+        self.raw_chunk = np.empty(buffer_size, dtype=np.int16)
+        S["lost_samples"] = 0
+        self.dev.start()
+        return StreamConfig(buffer_size, sample_freq, np.int16, self.dev.scale, 0.0, continuous=True)
+
+    def _read_into(self, out, raw):
+        raw_chunk = out if raw else self.raw_chunk
+        first, lost = self.dev.read(raw_chunk)
+        if not raw:
+            self.stream_config.to_volts(raw_chunk, out=out)
+        if lost:
+            self.settings["lost_samples"] += lost
+        return self.dev.start_time + first / self.dev.sample_freq, lost
+
+    def _close_stream(self):
+        self.dev.close()
+
+    # same calls as ADSHardware, for code that does not use the stream interface
+    def open_scope(self, buffer_size=1000, sample_freq=1e6):
+        self.open_stream(buffer_size, sample_freq)
+
+    def read_scope(self, channel=1):
+        return self.read_chunk()[0]
+
+    def close_scope(self):
+        self.close_stream()
+
+    def disconnect(self):
+        self.settings.disconnect_all_from_hardware()
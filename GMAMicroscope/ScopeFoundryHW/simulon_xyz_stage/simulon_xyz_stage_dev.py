@@ -1,38 +1,230 @@
-import random
+import threading
+import time
+
+import numpy as np
+
+AXES = ("x", "y", "z")
+
+
+def move_time(distance, velocity, acceleration):
+    """Duration of point-to-point moves with a trapezoidal velocity profile
+    (accelerate, cruise at velocity, brake), vectorized over distance."""
+    d = np.abs(np.asarray(distance, dtype=float))
+    # moves shorter than d_ramp never reach full speed (triangular profile)
+    d_ramp = velocity**2 / acceleration
+    return np.where(d >= d_ramp, d / velocity + velocity / acceleration, 2 * np.sqrt(d / acceleration))
+
+
+def travelled(distance, velocity, acceleration, tau):
+    """Distance covered tau seconds after the start of the moves, vectorized."""
+    d = np.abs(np.asarray(distance, dtype=float))
+    T = move_time(d, velocity, acceleration)
+    tau = np.clip(tau, 0, T)
+    t_acc = np.minimum(velocity / acceleration, T / 2)
+    v_peak = acceleration * t_acc
+    return np.where(
+        tau < t_acc,
+        0.5 * acceleration * tau**2,
+        np.where(
+            tau <= T - t_acc,
+            0.5 * acceleration * t_acc**2 + v_peak * (tau - t_acc),
+            d - 0.5 * acceleration * (T - tau) ** 2,
+        ),
+    )
 
 
 class SimulonXYZStageDev:
+    """Simulated xyz stage with a kinematic timing model.
+
+    Each axis moves independently with a trapezoidal velocity profile
+    (velocity in um/s, acceleration in um/s^2) and is settled settle_time
+    after it arrived. A write starts a move from wherever the axis is at that
+    moment and, with wait_for_move, returns once the axis has settled. Reads
+    take read_latency and return the modelled position plus uniform noise of
+    read_noise (um, peak to peak).
+
+    With realtime=False the stage runs on a virtual clock that jumps forward
+    instead of sleeping, so scan strategies can be timed offline in a
+    fraction of the real time; now() is the stage time in either mode.
 
-    def __init__(self, debug=False):
-        self.x = 0
-        self.y = 0
-        self.z = 0
+    Every read and every target is kept in a history, see history_arrays().
+    """
+
+    def __init__(
+        self,
+        debug=False,
+        velocity=1000.0,
+        acceleration=1e4,
+        settle_time=0.005,
+        read_latency=0.001,
+        read_noise=10e-3,
+        wait_for_move=True,
+        realtime=True,
+    ):
         self.debug = debug
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.settle_time = settle_time
+        self.read_latency = read_latency
+        self.read_noise = read_noise
+        self.wait_for_move = wait_for_move
+        self.realtime = realtime
+        self.rng = np.random.default_rng()
+        self.lock = threading.RLock()
+        self.t_origin = time.perf_counter()
+        self.virtual_time = 0.0
+        # per axis schedule of moves: start time, from, to, velocity, acceleration;
+        # a new move cuts the running one short at its start, earlier ones are kept
+        self.segments = {axis: np.zeros((1, 5)) for axis in AXES}
+        for seg in self.segments.values():
+            seg[0, 3:] = velocity, acceleration
+        self.settled_at = dict.fromkeys(AXES, 0.0)
+        self.clear_history()
         # communicate with hardware here
 
+    def set_param(self, name, value):
+        setattr(self, name, value)
+
+    # clock
+
+    def now(self):
+        if self.realtime:
+            return time.perf_counter() - self.t_origin
+        return self.virtual_time
+
+    def sleep_until(self, t):
+        if self.realtime:
+            dt = t - self.now()
+            if dt > 0:
+                time.sleep(dt)
+        else:
+            with self.lock:
+                self.virtual_time = max(self.virtual_time, t)
+
+    # kinematics
+
+    def position(self, axis, t):
+        """Modelled position of *axis* at stage time(s) t."""
+        seg = self.segments[axis]
+        t = np.asarray(t, dtype=float)
+        i = np.clip(np.searchsorted(seg[:, 0], t, side="right") - 1, 0, len(seg) - 1)
+        t0, p0, p1, v, a = seg[i].T
+        return p0 + np.sign(p1 - p0) * travelled(p1 - p0, v, a, t - t0)
+
+    def positions(self, times):
+        """(n, 3) modelled x, y, z at the stage times, e.g. the sample clock of a fly scan."""
+        return np.column_stack([self.position(axis, times) for axis in AXES])
+
+    def schedule(self, axis, t, rows):
+        """Replaces the moves of *axis* from stage time t on by *rows*, the
+        history before t stays so that positions() covers the past too."""
+        seg = self.segments[axis]
+        self.segments[axis] = np.vstack([seg[seg[:, 0] < t], rows])
+
+    def move(self, **targets):
+        """Starts moving the given axes (x=..., y=..., z=...) together.
+
+        Returns:
+            float: Stage time when the last of them has settled. With
+            wait_for_move the call returns at that time.
+        """
+        with self.lock:
+            t = self.now()
+            done = t
+            for axis, target in targets.items():
+                start = float(self.position(axis, t))
+                self.schedule(axis, t, [[t, start, target, self.velocity, self.acceleration]])
+                arrive = t + float(move_time(target - start, self.velocity, self.acceleration))
+                self.settled_at[axis] = arrive + self.settle_time
+                done = max(done, self.settled_at[axis])
+                self.targets[axis].append((t, target))
+        if self.debug:
+            print("SimulonXYZStageDev move", targets, "settled in", done - t)
+        if self.wait_for_move:
+            self.sleep_until(done)
+        return done
+
+    def run_trajectory(self, points, dwell=0.0, axes=AXES):
+        """Executes a list of points as one batch, like a trajectory uploaded to
+        a motion controller: each point is approached with all axes at once,
+        the stage settles and dwells there, then moves on.
+
+        Args:
+            points (array): (n_points, len(axes)) target positions.
+            dwell (float or array, optional): Time spent at each point after
+                settling, e.g. the pixel time. Defaults to 0.
+            axes (tuple, optional): Axes the columns of points belong to.
+
+        Returns:
+            dict: 'start' (move to point i begins), 'settled' (stage time the
+            point is reached and settled) and 'end' (dwell over) arrays, all
+            in stage time. With wait_for_move the call returns at end[-1].
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n = len(points)
+        with self.lock:
+            t = self.now()
+            previous = np.array([[float(self.position(axis, t)) for axis in axes]])
+            steps = np.diff(np.vstack([previous, points]), axis=0)
+            moves = move_time(steps, self.velocity, self.acceleration)
+            # a point is reached when its slowest axis arrives
+            durations = moves.max(axis=1) + self.settle_time + np.broadcast_to(dwell, n)
+            end = t + np.cumsum(durations)
+            start = end - durations
+            settled = start + moves.max(axis=1) + self.settle_time
+            v, a = self.velocity, self.acceleration
+            for k, axis in enumerate(axes):
+                p_from = np.r_[previous[0, k], points[:-1, k]]
+                self.schedule(axis, t, np.column_stack(
+                    [start, p_from, points[:, k], np.full(n, v), np.full(n, a)]
+                ))
+                self.settled_at[axis] = end[-1]
+                self.targets[axis].extend(zip(start.tolist(), points[:, k].tolist()))
+        if self.wait_for_move:
+            self.sleep_until(end[-1])
+        return {"start": start, "settled": settled, "end": end}
+
+    def wait(self):
+        """Waits until all axes have settled."""
+        self.sleep_until(max(self.settled_at.values()))
+
+    # reads and writes
+
+    def read(self, axis):
+        self.sleep_until(self.now() + self.read_latency)
+        t = self.now()
+        value = float(self.position(axis, t)) + (self.rng.random() - 0.5) * self.read_noise
+        self.reads[axis].append((t, value))
+        return value
+
     def read_x(self):
-        self.x = self.x + self.noise()
-        return self.x
+        return self.read("x")
 
     def read_y(self):
-        self.y = self.y + self.noise()
-        return self.y
+        return self.read("y")
 
     def read_z(self):
-        self.z = self.z + self.noise()
-        return self.z
+        return self.read("z")
 
     def write_x(self, x):
-        self.x = x
+        self.move(x=x)
 
     def write_y(self, y):
-        self.y = y
+        self.move(y=y)
 
     def write_z(self, z):
-        self.z = z
+        self.move(z=z)
+
+    # history
+
+    def clear_history(self):
+        self.reads = {axis: [] for axis in AXES}
+        self.targets = {axis: [] for axis in AXES}
+
+    def history_arrays(self, kind="reads"):
+        """{axis: (n, 2) array of (stage time, position)} of the reads or targets."""
+        history = self.reads if kind == "reads" else self.targets
+        return {axis: np.array(rows, dtype=float).reshape(-1, 2) for axis, rows in history.items()}
 
     def close(self):
         pass
-
-    def noise(self):
-        return (random.random() - 0.5) * 10e-3
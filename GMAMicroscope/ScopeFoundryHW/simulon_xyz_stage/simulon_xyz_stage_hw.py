@@ -3,6 +3,17 @@ from ScopeFoundryHW.simulon_xyz_stage.simulon_xyz_stage_dev import (
     SimulonXYZStageDev,
 )
 
+# settings of the kinematic model, passed on to SimulonXYZStageDev
+MODEL_PARAMS = (
+    "velocity",
+    "acceleration",
+    "settle_time",
+    "read_latency",
+    "read_noise",
+    "wait_for_move",
+    "realtime",
+)
+
 
 class SimulonXYZStageHW(HardwareComponent):
 
@@ -32,9 +43,29 @@ class SimulonXYZStageHW(HardwareComponent):
             "z_target_position", ro=False, **position_params
         )
 
+        # kinematic model, see SimulonXYZStageDev
+        self.settings.New("velocity", float, initial=1000.0, vmin=1e-3, unit="um/s")
+        self.settings.New("acceleration", float, initial=1e4, vmin=1e-3, unit="um/s^2")
+        self.settings.New("settle_time", float, initial=0.005, vmin=0, unit="s", si=True)
+        self.settings.New("read_latency", float, initial=0.001, vmin=0, unit="s", si=True)
+        self.settings.New("read_noise", float, initial=10e-3, vmin=0, unit="um",
+                          description="peak to peak noise of position reads")
+        self.settings.New("wait_for_move", bool, initial=True,
+                          description="target writes return when the axis has settled")
+        self.settings.New("realtime", bool, initial=True,
+                          description="off: virtual clock, moves and reads take no real time")
+
+        self.add_operation("clear_history", self.clear_history)
+
     def connect(self):
 
-        dev = self.stage_device = SimulonXYZStageDev(debug=self.debug_mode.val)
+        dev = self.stage_device = SimulonXYZStageDev(
+            debug=self.debug_mode.val, **{name: self.settings[name] for name in MODEL_PARAMS}
+        )
+        for name in MODEL_PARAMS:
+            self.settings.get_lq(name).connect_to_hardware(
+                write_func=lambda value, name=name: dev.set_param(name, value)
+            )
 
         self.x_position.connect_to_hardware(read_func=dev.read_x)
         self.y_position.connect_to_hardware(read_func=dev.read_y)
@@ -44,6 +75,27 @@ class SimulonXYZStageHW(HardwareComponent):
         self.y_target_position.connect_to_hardware(write_func=dev.write_y)
         self.z_target_position.connect_to_hardware(write_func=dev.write_z)
 
+    def run_trajectory(self, points, dwell=0.0):
+        """Moves through (n_points, 3) x, y, z points as one batch, see
+        SimulonXYZStageDev.run_trajectory() for the returned timing arrays."""
+        timing = self.stage_device.run_trajectory(points, dwell)
+        for axis, value in zip("xyz", points[-1]):
+            # show the final targets without sending a new move
+            self.settings.get_lq(f"{axis}_target_position").update_value(value, update_hardware=False)
+        return timing
+
+    def position_history(self):
+        """{'x'|'y'|'z': (n, 2) array of (stage time, read position)}."""
+        return self.stage_device.history_arrays("reads")
+
+    def target_history(self):
+        """{'x'|'y'|'z': (n, 2) array of (stage time, target)}."""
+        return self.stage_device.history_arrays("targets")
+
+    def clear_history(self):
+        if hasattr(self, "stage_device"):
+            self.stage_device.clear_history()
+
     def disconnect(self):
 
         self.settings.disconnect_all_from_hardware()
@@ -0,0 +1,347 @@
+import os
+import tempfile
+import threading
+
+import h5py
+import numpy as np
+
+# Each pyramid level is LOD_FACTOR times shorter than the one below it.
+LOD_FACTOR = 8
+# Samples read from the file per step while building the pyramid.
+CHUNK_SIZE = 1 << 20
+# Stop adding levels once a level has fewer points than this.
+MIN_LEVEL_POINTS = 4096
+
+
+def minmax_decimate(y, factor):
+    """Reduces y to the min and max of consecutive blocks of *factor* samples.
+
+    Args:
+        y (array): 1D array of samples.
+        factor (int): Number of samples per block. A trailing partial block
+        is reduced on its own.
+
+    Returns:
+        ymin, ymax (array, array): Block minima and maxima, each of length ceil(len(y)/factor).
+    """
+    y = np.asarray(y)
+    n_full = y.size // factor
+    full = y[:n_full * factor].reshape(n_full, factor)
+    ymin = full.min(axis=1)
+    ymax = full.max(axis=1)
+    if y.size % factor:
+        tail = y[n_full * factor:]
+        ymin = np.append(ymin, tail.min())
+        ymax = np.append(ymax, tail.max())
+    return ymin, ymax
+
+
+def recorded_length(x, chunk_size=CHUNK_SIZE):
+    """Number of recorded samples in a time axis dataset.
+
+    Interrupted runs leave trailing zeros in the preallocated x array, so this
+    is the index after the last nonzero entry. Reads *x* in chunks.
+    """
+    valid = 0
+    for start in range(0, x.shape[0], chunk_size):
+        nonzero = np.flatnonzero(x[start:start + chunk_size])
+        if nonzero.size:
+            valid = start + nonzero[-1] + 1
+    return valid
+
+
+class VoltsDataset:
+    """Read-only view of a dataset of raw samples whose slices are returned in
+    volts, y * scale + offset."""
+
+    def __init__(self, dset, scale, offset=0.0):
+        self.dset = dset
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.shape = dset.shape
+        self.dtype = np.dtype(float)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self.dset[index] * self.scale + self.offset
+
+
+def volts(dset):
+    """*dset* as volts: a VoltsDataset if its group has '<name>_scale' and
+    '<name>_offset' attributes (raw samples, e.g. ScopeRead with native_dtype),
+    the dataset itself otherwise."""
+    name = dset.name.rsplit("/", 1)[-1]
+    attrs = dset.parent.attrs
+    if f"{name}_scale" not in attrs:
+        return dset
+    return VoltsDataset(dset, attrs[f"{name}_scale"], attrs.get(f"{name}_offset", 0.0))
+
+
+def interleave_minmax(x, ymin, ymax):
+    """Turns block minima/maxima into a single polyline that draws the envelope."""
+    return np.repeat(x, 2), np.column_stack((ymin, ymax)).ravel()
+
+
+def _merge_pairs(x, ymin, ymax):
+    """Merges neighbouring min/max blocks, an odd last block is kept on its own."""
+    n = x.size // 2 * 2
+    mx = x[::2]
+    mmin = np.append(np.minimum(ymin[:n:2], ymin[1:n:2]), ymin[n:])
+    mmax = np.append(np.maximum(ymax[:n:2], ymax[1:n:2]), ymax[n:])
+    return mx, mmin, mmax
+
+
+class LiveTraceView:
+    """Fixed-size live views of a trace that grows buffer by buffer.
+
+    Keeps a rolling window of the latest *window_size* samples and a min/max
+    overview of everything so far with at most *overview_points* blocks. When the
+    overview fills up, neighbouring blocks are merged and the block size doubles,
+    so memory and redraw cost stay constant however long the run is.
+    append() is called from the acquisition thread, window()/overview() from the UI.
+    """
+
+    def __init__(self, window_size=20000, overview_points=2000):
+        self.window_size = window_size
+        self.overview_points = overview_points
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.win_x = np.zeros(self.window_size)
+            self.win_y = np.zeros(self.window_size)
+            self.win_pos = 0
+            self.win_n = 0
+
+            self.block_size = 1
+            self.ov_x = np.zeros(self.overview_points)
+            self.ov_min = np.zeros(self.overview_points)
+            self.ov_max = np.zeros(self.overview_points)
+            self.ov_n = 0
+            self.pending_x = np.zeros(0)
+            self.pending_y = np.zeros(0)
+            self.version = 0
+
+    def append(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        with self.lock:
+            self._append_window(x, y)
+            self._append_overview(x, y)
+            self.version += 1
+
+    def _append_window(self, x, y):
+        if x.size >= self.window_size:
+            x, y = x[-self.window_size:], y[-self.window_size:]
+        first = min(x.size, self.window_size - self.win_pos)
+        self.win_x[self.win_pos:self.win_pos + first] = x[:first]
+        self.win_y[self.win_pos:self.win_pos + first] = y[:first]
+        rest = x.size - first
+        self.win_x[:rest] = x[first:]
+        self.win_y[:rest] = y[first:]
+        self.win_pos = (self.win_pos + x.size) % self.window_size
+        self.win_n = min(self.win_n + x.size, self.window_size)
+
+    def _append_overview(self, x, y):
+        x = np.concatenate((self.pending_x, x))
+        y = np.concatenate((self.pending_y, y))
+        n_full = x.size // self.block_size * self.block_size
+        self.pending_x, self.pending_y = x[n_full:], y[n_full:]
+        if n_full == 0:
+            return
+        ymin, ymax = minmax_decimate(y[:n_full], self.block_size)
+        bx = x[:n_full:self.block_size]
+
+        while self.ov_n + bx.size > self.overview_points:
+            # halve the resolution of what is stored and of the new blocks
+            n = self.ov_n
+            merged = _merge_pairs(self.ov_x[:n], self.ov_min[:n], self.ov_max[:n])
+            self.ov_n = merged[0].size
+            self.ov_x[:self.ov_n], self.ov_min[:self.ov_n], self.ov_max[:self.ov_n] = merged
+            bx, ymin, ymax = _merge_pairs(bx, ymin, ymax)
+            self.block_size *= 2
+
+        self.ov_x[self.ov_n:self.ov_n + bx.size] = bx
+        self.ov_min[self.ov_n:self.ov_n + bx.size] = ymin
+        self.ov_max[self.ov_n:self.ov_n + bx.size] = ymax
+        self.ov_n += bx.size
+
+    def window(self):
+        """(x, y) of the latest samples, oldest first."""
+        with self.lock:
+            if self.win_n < self.window_size:
+                return self.win_x[:self.win_n].copy(), self.win_y[:self.win_n].copy()
+            order = np.r_[self.win_pos:self.window_size, 0:self.win_pos]
+            return self.win_x[order], self.win_y[order]
+
+    def overview(self):
+        """(x, y) min/max envelope polyline of the whole run so far."""
+        with self.lock:
+            return interleave_minmax(self.ov_x[:self.ov_n], self.ov_min[:self.ov_n],
+                                     self.ov_max[:self.ov_n])
+
+
+class TracePyramid:
+    """Min/max level-of-detail pyramid of a (possibly huge) trace stored in an h5 file.
+
+    The pyramid is built once, streaming through the source in chunks, and cached
+    in a sidecar file next to the source (<name>_lod.h5). Afterwards only the slice of
+    the level needed for a given view is read, so traces larger than RAM can be browsed.
+    """
+
+    def __init__(self, filepath, group_path, y_name="y", x_name="x"):
+        self.filepath = filepath
+        self.group_path = group_path
+        self.y_name = y_name
+        self.x_name = x_name
+        self.src = None
+        self.lod = None
+
+    @property
+    def sidecar_path(self):
+        return os.path.splitext(self.filepath)[0] + "_lod.h5"
+
+    def open(self):
+        """Opens the source file and the sidecar, (re)building the sidecar if it is missing or stale."""
+        self.src = h5py.File(self.filepath, "r")
+        group = self.src[self.group_path]
+        # raw samples are converted while the levels are built, views are always volts
+        self.y = volts(group[self.y_name])
+        self.x = group[self.x_name] if self.x_name in group else None
+
+        sidecar = self.sidecar_path
+        if not self._sidecar_is_valid(sidecar):
+            try:
+                self._build(sidecar)
+            except OSError:
+                # data folder not writable, keep the cache in the temp dir instead
+                sidecar = os.path.join(tempfile.gettempdir(), os.path.basename(sidecar))
+                if not self._sidecar_is_valid(sidecar):
+                    self._build(sidecar)
+        self.lod = h5py.File(sidecar, "r")
+        self.length = int(self.lod.attrs["length"])
+        self.n_levels = int(self.lod.attrs["n_levels"])
+        self.factor = int(self.lod.attrs["factor"])
+
+        # the coarsest level is small, keep its x in memory to locate views
+        if self.n_levels > 0:
+            self.top_x = self.lod[f"level_{self.n_levels}/x"][()]
+        else:
+            self.top_x = self.read_x(0, self.length)
+        return self
+
+    def close(self):
+        for f in (self.lod, self.src):
+            if f is not None:
+                f.close()
+        self.lod = self.src = None
+
+    def _source_signature(self):
+        stat = os.stat(self.filepath)
+        return stat.st_size, stat.st_mtime
+
+    def _sidecar_is_valid(self, sidecar):
+        if not os.path.exists(sidecar):
+            return False
+        size, mtime = self._source_signature()
+        try:
+            with h5py.File(sidecar, "r") as f:
+                return (f.attrs.get("source_size") == size
+                        and f.attrs.get("volts", False)
+                        and f.attrs.get("source_mtime") == mtime
+                        and f.attrs.get("group_path") == self.group_path)
+        except OSError:
+            return False
+
+    def read_x(self, start, stop):
+        if self.x is None:
+            return np.arange(start, stop, dtype=float)
+        return self.x[start:stop]
+
+    def _build(self, sidecar):
+        print(f"Building level-of-detail cache {sidecar}")
+        length = self.y.shape[0] if self.x is None else recorded_length(self.x)
+        size, mtime = self._source_signature()
+        chunk = CHUNK_SIZE - CHUNK_SIZE % LOD_FACTOR
+
+        with h5py.File(sidecar, "w") as f:
+            f.attrs["source_size"] = size
+            f.attrs["source_mtime"] = mtime
+            f.attrs["group_path"] = self.group_path
+            f.attrs["volts"] = True
+            f.attrs["length"] = length
+            f.attrs["factor"] = LOD_FACTOR
+
+            level = 0
+            level_len = length
+            below = None
+            while level_len > MIN_LEVEL_POINTS:
+                level += 1
+                new_len = -(-level_len // LOD_FACTOR)
+                g = f.create_group(f"level_{level}")
+                x_ds = g.create_dataset("x", shape=(new_len,), dtype=float)
+                min_ds = g.create_dataset("ymin", shape=(new_len,), dtype=self.y.dtype)
+                max_ds = g.create_dataset("ymax", shape=(new_len,), dtype=self.y.dtype)
+
+                for start in range(0, level_len, chunk):
+                    stop = min(start + chunk, level_len)
+                    out = slice(start // LOD_FACTOR, -(-stop // LOD_FACTOR))
+                    if below is None:
+                        ymin, ymax = minmax_decimate(self.y[start:stop], LOD_FACTOR)
+                        x = self.read_x(start, stop)
+                    else:
+                        ymin = minmax_decimate(below["ymin"][start:stop], LOD_FACTOR)[0]
+                        ymax = minmax_decimate(below["ymax"][start:stop], LOD_FACTOR)[1]
+                        x = below["x"][start:stop]
+                    x_ds[out] = x[::LOD_FACTOR]
+                    min_ds[out] = ymin
+                    max_ds[out] = ymax
+
+                below = g
+                level_len = new_len
+            f.attrs["n_levels"] = level
+
+    def level_x(self, level, start, stop):
+        """x of the blocks start..stop-1 of a level, level 0 being the raw samples."""
+        if level == 0:
+            return self.read_x(start, stop)
+        return self.lod[f"level_{level}/x"][start:stop]
+
+    def _locate(self, x, offset, level, x0, x1):
+        """Raw sample range [i0, i1) of the blocks of *level* that cover [x0, x1],
+        *x* being that level's x from block *offset* on."""
+        step = self.factor ** level
+        i0 = (max(np.searchsorted(x, x0, side="right") - 1, 0) + offset) * step
+        i1 = min((np.searchsorted(x, x1, side="right") + offset) * step, self.length)
+        return i0, max(i1, i0 + 1)
+
+    def view(self, x0=-np.inf, x1=np.inf, max_points=4000):
+        """Returns the (x, y) polyline to draw for the x range [x0, x1].
+
+        Picks the finest level that shows the range with at most ~max_points
+        blocks and reads only the matching slice of it. Decimated levels are
+        returned as a min/max envelope.
+        """
+        if self.length == 0:
+            return np.array([]), np.array([])
+
+        # locate the requested range on the coarsest level, then refine it level by
+        # level while the next finer one still shows it with at most max_points blocks
+        level = self.n_levels
+        i0, i1 = self._locate(self.top_x, 0, level, x0, x1)
+        while level > 0 and (i1 - i0) / self.factor ** (level - 1) <= max_points:
+            level -= 1
+            step = self.factor ** level
+            a, b = i0 // step, -(-i1 // step)
+            i0, i1 = self._locate(self.level_x(level, a, b), a, level, x0, x1)
+
+        if level == 0:
+            return self.read_x(i0, i1), self.y[i0:i1]
+
+        step = self.factor ** level
+        g = self.lod[f"level_{level}"]
+        s = slice(i0 // step, -(-i1 // step))
+        return interleave_minmax(g["x"][s], g["ymin"][s], g["ymax"][s])
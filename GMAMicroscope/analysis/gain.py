@@ -0,0 +1,99 @@
+"""Online gain drift correction by tracking a reference peak."""
+import numpy as np
+
+
+class GainStabilizer:
+    """Tracks the centroid of a reference peak in short time slices and
+    corrects pulse heights for the gain drift it shows.
+
+    In each slice the mean pulse height inside a window around the expected
+    (drifted) reference position is measured. A straight line through the
+    gains of the last *fit_slices* slices, evaluated at the current time, gives
+    the correction factor, so single noisy slices do not jerk the correction.
+    The window follows the gain, so slow drifts of any size are tracked.
+
+    The factor only changes at slice boundaries. Every change is recorded in
+    the correction table (first event index, time, factor), which together
+    with the uncorrected pulse heights is enough to redo the correction
+    offline, see correct_events().
+    """
+
+    TABLE_FIELDS = ("first_event", "time", "factor", "centroid", "n_events")
+
+    def __init__(self, reference, window=0.1, slice_duration=5.0, fit_slices=5, min_events=50):
+        self.reference = float(reference)
+        self.window = float(window)  # relative half width of the search window
+        self.slice_duration = float(slice_duration)
+        self.fit_slices = int(fit_slices)
+        self.min_events = int(min_events)
+        self.gain = 1.0
+        self.factor = 1.0
+        self.slice_start = 0.0
+        self.slice_sum = 0.0
+        self.slice_n = 0
+        self.slice_times = []
+        self.slice_gains = []
+        self.table = {name: [] for name in self.TABLE_FIELDS}
+        self._record(0, 0.0, np.nan, 0)
+
+    def _record(self, first_event, t, centroid, n_events):
+        for name, value in zip(self.TABLE_FIELDS, (first_event, t, self.factor, centroid, n_events)):
+            self.table[name].append(value)
+
+    def process(self, values, t, first_event):
+        """Corrects one batch of raw pulse heights.
+
+        Args:
+            values (array): Raw pulse heights of the batch.
+            t (float): Run time of the batch (s).
+            first_event (int): Index of the batch's first event in the raw stream.
+
+        Returns:
+            array: values * current correction factor.
+        """
+        if t - self.slice_start >= self.slice_duration:
+            self._end_slice(t, first_event)
+        # the reference peak sits at reference * gain in raw pulse heights
+        center = self.reference * self.gain
+        sel = values[np.abs(values - center) <= self.window * center]
+        self.slice_sum += sel.sum()
+        self.slice_n += sel.size
+        return values * self.factor
+
+    def _end_slice(self, t, first_event):
+        if self.slice_n < self.min_events:
+            return  # too few reference events, keep the correction and go on counting
+        centroid = self.slice_sum / self.slice_n
+        self.slice_times.append(0.5 * (self.slice_start + t))
+        self.slice_gains.append(centroid / self.reference)
+        times = np.array(self.slice_times[-self.fit_slices:])
+        gains = np.array(self.slice_gains[-self.fit_slices:])
+        if len(times) >= 2:
+            self.gain = np.polyval(np.polyfit(times, gains, 1), t)
+        else:
+            self.gain = gains[-1]
+        self.factor = 1 / self.gain
+        self._record(first_event, t, centroid, self.slice_n)
+
+        self.slice_start = t
+        self.slice_sum = 0.0
+        self.slice_n = 0
+
+    @property
+    def n_table(self):
+        return len(self.table["time"])
+
+    def table_arrays(self, start=0):
+        return {name: np.array(values[start:]) for name, values in self.table.items()}
+
+
+def correct_events(raw_values, first_event, factor):
+    """Applies a stored correction table to raw pulse heights (vectorized).
+
+    Args:
+        raw_values (array): Uncorrected pulse heights in acquisition order.
+        first_event (array): Index of the first event each factor applies to (ascending).
+        factor (array): Correction factors.
+    """
+    idx = np.searchsorted(first_event, np.arange(len(raw_values)), side="right") - 1
+    return raw_values * np.asarray(factor)[np.clip(idx, 0, None)]
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def bin_indices(values, vmin, vmax, bin_number):
+    """Bin index of each value for bin_number equal bins over [vmin, vmax].
+
+    Uses the same convention as np.histogram(range=(vmin, vmax)): the last bin
+    includes vmax. Values outside the range get index -1.
+    """
+    values = np.asarray(values, dtype=float)
+    idx = ((values - vmin) * (bin_number / (vmax - vmin))).astype(np.intp)
+    # vmax itself, and values a few ulp below it that round up, go to the last bin
+    np.minimum(idx, bin_number - 1, out=idx)
+    idx[(values < vmin) | (values > vmax) | ~np.isfinite(values)] = -1
+    return idx
+
+
+class IncrementalHistogram:
+    """Fixed binning histogram that is updated batch by batch with np.bincount.
+
+    Cost per batch is proportional to the batch size, not to the number of
+    events seen so far.
+    """
+
+    def __init__(self, bin_number, vmin, vmax):
+        self.bin_number = int(bin_number)
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.edges = np.linspace(self.vmin, self.vmax, self.bin_number + 1)
+        self.counts = np.zeros(self.bin_number, dtype=np.int64)
+        self.n_events = 0
+
+    def batch_counts(self, values):
+        """Histogram of *values* alone, without adding them."""
+        idx = bin_indices(values, self.vmin, self.vmax, self.bin_number)
+        return np.bincount(idx[idx >= 0], minlength=self.bin_number)
+
+    def add(self, values):
+        """Adds *values* to the histogram and returns their own batch histogram."""
+        batch = self.batch_counts(values)
+        self.counts += batch
+        self.n_events += len(values)
+        return batch
+
+    def reset(self):
+        self.counts[:] = 0
+        self.n_events = 0
+
+    def snapshot(self, version, **extras):
+        return HistogramSnapshot(version, self.counts, self.edges, self.n_events, **extras)
+
+    @property
+    def centers(self):
+        return 0.5 * (self.edges[:-1] + self.edges[1:])
+
+
+def frozen_copy(arr):
+    arr = np.array(arr)
+    arr.flags.writeable = False
+    return arr
+
+
+class HistogramSnapshot:
+    """Versioned, read-only copy of a histogram plus any companion values.
+
+    An acquisition thread publishes a new snapshot by replacing a single
+    reference; the UI thread only redraws when the version changed and never
+    touches arrays the acquisition is still writing to.
+    """
+
+    def __init__(self, version, counts, edges, n_events, **extras):
+        self.version = version
+        self.counts = frozen_copy(counts)
+        self.edges = edges
+        self.n_events = n_events
+        for name, value in extras.items():
+            if isinstance(value, np.ndarray):
+                value = frozen_copy(value)
+            setattr(self, name, value)
@@ -0,0 +1,76 @@
+"""Line-wise trajectories and pixel binning for hardware-timed raster scans."""
+import numpy as np
+
+TRAJECTORIES = ("step", "ramp")
+
+
+def split_lines(scan_slow_move):
+    """(start, stop) pixel index ranges of the scan lines, a line starts at
+    every slow move of a ScopeFoundry raster scan."""
+    starts = np.flatnonzero(scan_slow_move)
+    if len(starts) == 0 or starts[0] != 0:
+        starts = np.r_[0, starts]
+    stops = np.r_[starts[1:], len(scan_slow_move)]
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def line_trajectory(positions, samples_per_pixel, lead_in=0, start=None, kind="step"):
+    """Output waveform that scans one line.
+
+    Args:
+        positions (array): (n_pixels, n_axes) pixel positions in output units (V).
+        samples_per_pixel (int): Output samples per pixel.
+        lead_in (int, optional): Samples of a linear move from *start* to the
+            first pixel before the line, e.g. the fly back. Defaults to 0.
+        start (array, optional): (n_axes,) position before the line, the first
+            pixel if None.
+        kind (str, optional): 'step' holds every pixel position, 'ramp' moves
+            linearly through each pixel, centered on its position (pixels evenly
+            spaced). Defaults to 'step'.
+
+    Returns:
+        array: (lead_in + n_pixels * samples_per_pixel, n_axes) waveform.
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype=float))
+    n_pixels = len(positions)
+    if kind == "step" or n_pixels < 2:
+        line = np.repeat(positions, samples_per_pixel, axis=0)
+    elif kind == "ramp":
+        # continuous motion through the evenly spaced pixels, pixel i covers i-0.5 .. i+0.5
+        t = (np.arange(n_pixels * samples_per_pixel) + 0.5) / samples_per_pixel - 0.5
+        step = (positions[-1] - positions[0]) / (n_pixels - 1)
+        line = positions[0] + t[:, None] * step
+    else:
+        raise ValueError(f"unknown trajectory {kind!r}, choose from {TRAJECTORIES}")
+
+    if start is None:
+        start = line[0]
+    frac = np.arange(lead_in) / max(lead_in, 1)
+    lead = start + frac[:, None] * (line[0] - start)
+    return np.concatenate([lead, line])
+
+
+def bin_line(samples, n_pixels, samples_per_pixel, lead_in=0, settle=0):
+    """Averages synchronously acquired samples into pixels.
+
+    Args:
+        samples (array): (n_channels, n_samples) or (n_samples,) input samples,
+            sample k taken on the same clock edge as output sample k.
+        n_pixels (int): Pixels in the line.
+        samples_per_pixel (int): Samples per pixel.
+        lead_in (int, optional): Samples before the first pixel, dropped. Defaults to 0.
+        settle (int, optional): Samples at the start of each pixel dropped while
+            the stage or detector settles. Defaults to 0.
+
+    Returns:
+        array: (n_channels, n_pixels) or (n_pixels,) pixel means.
+
+    Raises:
+        ValueError: settle leaves no samples of a pixel to average.
+    """
+    if settle >= samples_per_pixel:
+        raise ValueError(f"settle ({settle}) has to be less than samples_per_pixel ({samples_per_pixel})")
+    samples = np.asarray(samples)
+    line = samples[..., lead_in:lead_in + n_pixels * samples_per_pixel]
+    pixels = line.reshape(*samples.shape[:-1], n_pixels, samples_per_pixel)
+    return pixels[..., settle:].mean(axis=-1)
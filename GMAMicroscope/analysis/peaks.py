@@ -0,0 +1,286 @@
+"""Peak search, Gaussian peak fits and energy calibration of pulse height spectra.
+
+Peak search and calibration only need NumPy. Fits use scipy.optimize.curve_fit
+if SciPy is installed.
+"""
+import json
+import os
+
+import numpy as np
+
+try:
+    from scipy.optimize import curve_fit
+except ImportError:
+    curve_fit = None
+
+from analysis.pulse_analysis import FWHM_PER_SIGMA
+
+DEFAULT_CALIBRATION_FILE = "energy_calibration.json"
+
+
+def calibration_path(path, data_dir):
+    """*path* of a calibration file, a relative one resolved against the data
+    directory instead of the working directory the app was started in."""
+    return os.path.join(data_dir, os.path.expanduser(path))
+
+
+def second_derivative_kernel(sigma_bins):
+    """Negative second derivative of a unit Gaussian, sampled out to +-4 sigma."""
+    half = max(1, int(np.ceil(4 * sigma_bins)))
+    t = np.arange(-half, half + 1) / sigma_bins
+    kernel = (1 - t ** 2) * np.exp(-t ** 2 / 2)
+    return kernel - kernel.mean()  # zero response to a flat background
+
+
+def find_peaks(counts, fwhm_bins=5.0, min_significance=4.0):
+    """Finds peaks with the smoothed second derivative method.
+
+    The spectrum is convolved with the (negated) second derivative of a Gaussian
+    of the expected peak width; peaks show up as maxima of the result.
+    Linear backgrounds give no response. Each maximum is compared with its
+    statistical uncertainty (Poisson counts propagated through the kernel).
+
+    Args:
+        counts (array): Histogram counts.
+        fwhm_bins (float): Expected peak FWHM in bins.
+        min_significance (float): Minimum response / uncertainty to accept a peak.
+
+    Returns:
+        (indices, significance): Bin indices of the peaks, strongest first, and
+        their significance.
+    """
+    counts = np.asarray(counts, dtype=float)
+    kernel = second_derivative_kernel(fwhm_bins / FWHM_PER_SIGMA)
+    half = len(kernel) // 2
+    # edge padding so that the histogram limits do not look like steps
+    padded = np.pad(counts, half, mode="edge")
+    response = np.convolve(padded, kernel, mode="valid")
+    sigma = np.sqrt(np.convolve(np.maximum(padded, 1), kernel ** 2, mode="valid"))
+    significance = response / sigma
+
+    # local maxima of the response, not closer to the limits than one FWHM
+    inner = significance[1:-1]
+    is_max = (inner > significance[:-2]) & (inner >= significance[2:]) & (inner >= min_significance)
+    indices = np.flatnonzero(is_max) + 1
+    margin = int(np.ceil(fwhm_bins))
+    indices = indices[(indices >= margin) & (indices < len(counts) - margin)]
+    order = np.argsort(significance[indices])[::-1]
+    return indices[order], significance[indices[order]]
+
+
+def gaussians_with_background(x, *params):
+    """Linear background plus any number of Gaussians.
+
+    params: (b0, b1, amplitude_1, mean_1, sigma_1, amplitude_2, ...), the
+    background is b0 + b1 * x.
+    """
+    x = np.asarray(x, dtype=float)
+    p = np.asarray(params[2:], dtype=float).reshape(-1, 3)
+    amplitude, mean, sigma = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    peaks = amplitude * np.exp(-0.5 * ((x[None, :] - mean) / sigma) ** 2)
+    return params[0] + params[1] * x + peaks.sum(axis=0)
+
+
+class PeakFitResult:
+    """Fitted parameters of one joint fit, one entry per peak in each array."""
+
+    def __init__(self, params, errors, bin_width, chi2_ndf, fit_range):
+        self.params = params
+        self.errors = errors
+        self.background = params[:2]
+        p = params[2:].reshape(-1, 3)
+        e = errors[2:].reshape(-1, 3)
+        self.amplitude = p[:, 0]
+        self.centroid = p[:, 1]
+        self.centroid_error = e[:, 1]
+        self.sigma = np.abs(p[:, 2])
+        self.fwhm = FWHM_PER_SIGMA * self.sigma
+        # net counts under each Gaussian
+        self.area = self.amplitude * self.sigma * np.sqrt(2 * np.pi) / bin_width
+        self.chi2_ndf = chi2_ndf
+        self.fit_range = fit_range
+
+    def __len__(self):
+        return len(self.centroid)
+
+    def curve(self, x):
+        return gaussians_with_background(x, *self.params)
+
+
+def fit_peaks(counts, edges, p0, fit_range=None):
+    """Fits Gaussians plus a linear background to a region of a histogram.
+
+    Args:
+        counts, edges: Histogram.
+        p0 (array): Start parameters, see gaussians_with_background().
+        fit_range (tuple, optional): (x0, x1) region to fit. Defaults to the
+        start peaks +- 4 sigma.
+
+    Returns:
+        PeakFitResult
+    """
+    if curve_fit is None:
+        raise ImportError("peak fits require scipy")
+    counts = np.asarray(counts, dtype=float)
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    p0 = np.asarray(p0, dtype=float)
+    if fit_range is None:
+        p = p0[2:].reshape(-1, 3)
+        fit_range = ((p[:, 1] - 4 * np.abs(p[:, 2])).min(), (p[:, 1] + 4 * np.abs(p[:, 2])).max())
+    sel = (centers >= fit_range[0]) & (centers <= fit_range[1])
+    x, y = centers[sel], counts[sel]
+    if len(x) <= len(p0):
+        raise ValueError("fit range has fewer bins than parameters")
+    # Poisson weights, empty bins count as one
+    err = np.sqrt(np.maximum(y, 1))
+    params, cov = curve_fit(gaussians_with_background, x, y, p0=p0, sigma=err,
+                            absolute_sigma=True, maxfev=2000)
+    errors = np.sqrt(np.abs(np.diag(cov)))
+    chi2 = (((y - gaussians_with_background(x, *params)) / err) ** 2).sum()
+    return PeakFitResult(params, errors, edges[1] - edges[0], chi2 / (len(x) - len(params)), fit_range)
+
+
+def initial_params(counts, edges, indices, fwhm_bins):
+    """Start parameters for fit_peaks() from peak search results."""
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    sigma = fwhm_bins * (edges[1] - edges[0]) / FWHM_PER_SIGMA
+    indices = np.sort(indices)
+    lo = max(0, int(indices[0] - 4 * fwhm_bins))
+    background = min(counts[lo], counts[min(len(counts) - 1, int(indices[-1] + 4 * fwhm_bins))])
+    p0 = [background, 0.0]
+    for i in indices:
+        p0 += [max(counts[i] - background, 1.0), centers[i], sigma]
+    return np.array(p0)
+
+
+def group_peaks(indices, fwhm_bins, separation=3.0):
+    """Splits sorted peak bin indices into groups closer than *separation* FWHMs,
+    each group is fitted together."""
+    if len(indices) == 0:
+        return []
+    indices = np.sort(indices)
+    splits = np.flatnonzero(np.diff(indices) > separation * fwhm_bins) + 1
+    return np.split(indices, splits)
+
+
+class PeakFitter:
+    """Searches and fits the strongest peaks of a spectrum, refresh after refresh.
+
+    Overlapping peaks are fitted together, each group with its own linear
+    background. The parameters of the last successful fits are used as start
+    values for the next ones, so live refreshes converge in a few iterations.
+    A new peak search is only run when there is no usable previous fit.
+    """
+
+    def __init__(self, max_peaks=3, fwhm_bins=5.0, min_significance=4.0):
+        self.max_peaks = max_peaks
+        self.fwhm_bins = fwhm_bins
+        self.min_significance = min_significance
+        self.results = []
+
+    def reset(self):
+        self.results = []
+
+    def fit(self, counts, edges):
+        """Returns a list of PeakFitResult (one per group of peaks), sorted by
+        position. Empty if no peak was found."""
+        counts = np.asarray(counts, dtype=float)
+        if self.results:
+            try:
+                results = [fit_peaks(counts, edges, r.params, r.fit_range) for r in self.results]
+                if all(self._plausible(r) for r in results):
+                    self.results = results
+                    return results
+            except (RuntimeError, ValueError):
+                pass
+        # no previous fit or it ran away: search again
+        self.results = []
+        indices, _ = find_peaks(counts, self.fwhm_bins, self.min_significance)
+        for group in group_peaks(indices[:self.max_peaks], self.fwhm_bins):
+            p0 = initial_params(counts, edges, group, self.fwhm_bins)
+            try:
+                self.results.append(fit_peaks(counts, edges, p0))
+            except (RuntimeError, ValueError) as e:
+                print(f"peak fit failed: {e}")
+        return self.results
+
+    @staticmethod
+    def _plausible(result):
+        x0, x1 = result.fit_range
+        return (np.all(result.amplitude > 0) and np.all(result.centroid > x0)
+                and np.all(result.centroid < x1) and np.all(result.fwhm < x1 - x0))
+
+
+def peak_table(results, calibration=None):
+    """Flattens fit results to a dict of arrays (one entry per peak), with an
+    'energy' column if a valid *calibration* is given."""
+    table = {name: np.concatenate([getattr(r, name) for r in results]) if results else np.zeros(0)
+             for name in ("centroid", "centroid_error", "fwhm", "area")}
+    if calibration is not None and calibration.is_valid:
+        table["energy"] = calibration(table["centroid"])
+        table["fwhm_energy"] = calibration(table["centroid"] + table["fwhm"] / 2) \
+            - calibration(table["centroid"] - table["fwhm"] / 2)
+    return table
+
+
+class EnergyCalibration:
+    """Pulse height (V) to energy (keV) calibration from any number of reference peaks.
+
+    Points are (pulse height, energy) pairs. With one point the calibration is
+    proportional, with more a polynomial of up to *degree* is fitted. It is
+    saved as JSON so that it can be reused by later runs and the data browser.
+    """
+
+    def __init__(self, points=(), degree=1):
+        self.points = [tuple(map(float, p)) for p in points]
+        self.degree = degree
+        self.coefficients = None
+        if self.points:
+            self.fit()
+
+    def add_point(self, pulse_height, energy):
+        self.points.append((float(pulse_height), float(energy)))
+        try:
+            self.fit()
+        except ValueError:
+            self.points.pop()
+            raise
+
+    def clear(self):
+        self.points = []
+        self.coefficients = None
+
+    def fit(self):
+        v, e = np.array(self.points).T
+        if len(v) == 1:
+            if v[0] == 0:
+                raise ValueError("a single calibration point needs a non-zero pulse height")
+            self.coefficients = np.array([e[0] / v[0], 0.0])
+        else:
+            self.coefficients = np.polyfit(v, e, min(self.degree, len(v) - 1))
+        return self.coefficients
+
+    @property
+    def is_valid(self):
+        return self.coefficients is not None
+
+    def __call__(self, pulse_height):
+        """Energy in keV of *pulse_height* (V, scalar or array)."""
+        return np.polyval(self.coefficients, pulse_height)
+
+    def to_dict(self):
+        return dict(points=self.points, degree=self.degree,
+                    coefficients=None if self.coefficients is None else list(self.coefficients))
+
+    def save(self, path=DEFAULT_CALIBRATION_FILE):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CALIBRATION_FILE):
+        """Loads a saved calibration, an empty one if *path* does not exist."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            d = json.load(f)
+        return cls(d.get("points", ()), d.get("degree", 1))
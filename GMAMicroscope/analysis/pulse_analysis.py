@@ -0,0 +1,106 @@
+"""Pulse height extraction from scope buffers and peak statistics of spectra."""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+
+
+def split_windows(buffer, window_size):
+    """View of *buffer* as (n_windows, window_size) rows, the remainder is dropped."""
+    buffer = np.asarray(buffer, dtype=float)
+    n_windows = buffer.size // window_size
+    return as_strided(buffer, shape=(n_windows, window_size),
+                      strides=(buffer.strides[0] * window_size, buffer.strides[0]))
+
+
+def window_amplitudes(windows):
+    """Pulse amplitude of every window: max minus mean of the central 80%."""
+    window_size = windows.shape[1]
+    core = windows[:, window_size // 10:9 * window_size // 10]
+    return np.abs(core.max(axis=1) - core.mean(axis=1))
+
+
+def analyze_buffer(buffer, window_size, threshold, max_val):
+    """Splits a scope buffer into pulse windows and measures them.
+
+    Returns:
+        (windows, amplitudes, valid): The (n_windows, window_size) view, the
+        amplitude of every window and a mask of the windows with
+        threshold <= amplitude <= max_val.
+    """
+    windows = split_windows(buffer, window_size)
+    amplitudes = window_amplitudes(windows)
+    valid = (amplitudes >= threshold) & (amplitudes <= max_val)
+    return windows, amplitudes, valid
+
+
+def peak_stats(counts, edges):
+    """Centroid and FWHM of the main peak of one or many histograms.
+
+    Works on all rows at once: *counts* is (n_bins,) or (n_spectra, n_bins)
+    over the common bin *edges*. The FWHM is taken between the linearly
+    interpolated half maximum crossings around the highest bin, the centroid
+    is the count weighted mean of the bins within them.
+
+    Returns:
+        (centroid, fwhm, area): Arrays with one entry per row (scalars for 1D
+        input), area is the number of counts within the FWHM. Rows without
+        counts give nan.
+    """
+    counts = np.asarray(counts, dtype=float)
+    single = counts.ndim == 1
+    counts = np.atleast_2d(counts)
+    n_bins = counts.shape[1]
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    idx = np.arange(n_bins)
+    rows = np.arange(len(counts))
+
+    peak = counts.argmax(axis=1)
+    half = counts[rows, peak] / 2
+    below = counts < half[:, None]
+    # last bin below half max left of the peak, first one right of it
+    left = np.where(below & (idx < peak[:, None]), idx, -1).max(axis=1)
+    right = np.where(below & (idx > peak[:, None]), idx, n_bins).min(axis=1)
+
+    def crossing(outside, inside):
+        # interpolate between the last bin below half max (or the histogram
+        # edge if there is none) and its neighbour towards the peak
+        at_edge = (outside < 0) | (outside >= n_bins)
+        o = np.clip(outside, 0, n_bins - 1)
+        c_out = np.where(at_edge, 0.0, counts[rows, o])
+        x_out = np.where(at_edge, np.where(outside < 0, edges[0], edges[-1]), centers[o])
+        c_in = counts[rows, inside]
+        step = c_in - c_out
+        frac = (half - c_out) / np.where(step > 0, step, 1)
+        return x_out + np.clip(frac, 0, 1) * (centers[inside] - x_out)
+
+    x_left = crossing(left, np.clip(left + 1, 0, n_bins - 1))
+    x_right = crossing(right, np.clip(right - 1, 0, n_bins - 1))
+    fwhm = x_right - x_left
+
+    in_peak = (idx > left[:, None]) & (idx < right[:, None])
+    weights = np.where(in_peak, counts, 0.0)
+    area = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = (weights * centers).sum(axis=1) / area
+    empty = counts.sum(axis=1) == 0
+    centroid[empty] = fwhm[empty] = np.nan
+
+    if single:
+        return centroid[0], fwhm[0], area[0]
+    return centroid, fwhm, area
+
+
+def linear_calibration(x, y, deg=1, weights=None):
+    """Polynomial fit y(x), ignoring nan points.
+
+    Returns:
+        (coefficients, residuals): np.polyfit coefficients (highest power first)
+        and y - fit(x) for every input point.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    w = None if weights is None else np.asarray(weights, dtype=float)[ok]
+    coefficients = np.polyfit(x[ok], y[ok], deg, w=w)
+    return coefficients, y - np.polyval(coefficients, x)
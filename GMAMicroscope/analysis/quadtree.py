@@ -0,0 +1,140 @@
+"""Quadtree refinement plan and rendering for adaptive (sparse-then-refine) 2D scans."""
+import numpy as np
+
+
+def lattice(n, step):
+    """Indices 0, step, 2*step, ... of an axis with n pixels, the last pixel included."""
+    return np.unique(np.r_[np.arange(0, n, step), n - 1])
+
+
+def _brackets(idx, n):
+    """Lower lattice neighbour and weight of every pixel 0..n-1 for linear interpolation."""
+    x = np.arange(n)
+    if len(idx) == 1:
+        return np.zeros(n, int), np.zeros(n, int), np.zeros(n)
+    a = np.clip(np.searchsorted(idx, x, side="right") - 1, 0, len(idx) - 2)
+    w = (x - idx[a]) / (idx[a + 1] - idx[a])
+    return a, a + 1, w
+
+
+def bilinear(values, jl, il, shape):
+    """Bilinear interpolation of the lattice values[jl x il] onto the full (Nv, Nh) grid."""
+    j0, j1, wj = _brackets(jl, shape[0])
+    i0, i1, wi = _brackets(il, shape[1])
+    wj = wj[:, None]
+    top = values[j0][:, i0] * (1 - wi) + values[j0][:, i1] * wi
+    bottom = values[j1][:, i0] * (1 - wi) + values[j1][:, i1] * wi
+    return top * (1 - wj) + bottom * wj
+
+
+def serpentine(j, i):
+    """Sorts points row by row with alternating direction, short moves for the stage."""
+    row = np.unique(j, return_inverse=True)[1]
+    order = np.lexsort((np.where(row % 2, -i, i), j))
+    return j[order], i[order]
+
+
+class QuadtreeRefiner:
+    """Chooses the pixels of an adaptive scan pass by pass.
+
+    The first pass measures a coarse lattice every coarse_step pixels (the last
+    row and column included). Each further pass halves the step and measures
+    the new lattice points only inside the cells of the previous pass that are
+    "interesting": a corner value at or above value_threshold, or a spread
+    (max - min) of the corner values above gradient_threshold. The refinement of
+    a pass is computed for all cells at once with array operations.
+
+    Measured values are kept on the full (Nv, Nh) grid, nan where not measured,
+    render() interpolates them into a complete image.
+    """
+
+    def __init__(self, shape, coarse_step=8, value_threshold=np.inf, gradient_threshold=np.inf):
+        self.shape = tuple(shape)
+        # a power of two, so that every pass halves the cells, and small enough
+        # that halving it adds lattice points (a larger one only hits the corners)
+        step = 2 ** int(np.ceil(np.log2(max(coarse_step, 1))))
+        largest = 2 ** int(np.floor(np.log2(max(max(self.shape) - 1, 1))))
+        self.coarse_step = min(step, largest)
+        self.value_threshold = value_threshold
+        self.gradient_threshold = gradient_threshold
+        self.values = np.full(self.shape, np.nan)
+        self.measured = np.zeros(self.shape, bool)
+        self.step = None
+        self.n_pass = 0
+
+    @property
+    def n_passes(self):
+        """Passes of a scan that refines everywhere."""
+        return int(np.log2(self.coarse_step)) + 1
+
+    def first_pass(self):
+        """(j, i) pixel indices of the coarse pass."""
+        self.step = self.coarse_step
+        self.n_pass = 1
+        jl, il = lattice(self.shape[0], self.step), lattice(self.shape[1], self.step)
+        j, i = np.meshgrid(jl, il, indexing="ij")
+        return serpentine(j.ravel(), i.ravel())
+
+    def add(self, j, i, values):
+        """Stores measured values at pixels (j, i)."""
+        self.values[j, i] = values
+        self.measured[j, i] = True
+
+    def refine_cells(self):
+        """(cells_v, cells_h) bool, the cells of the current lattice to refine."""
+        jl, il = lattice(self.shape[0], self.step), lattice(self.shape[1], self.step)
+        C = self.values[np.ix_(jl, il)]
+        # a single row or column scan has cells of zero height or width
+        C = np.pad(C, ((0, int(C.shape[0] < 2)), (0, int(C.shape[1] < 2))), mode="edge")
+        corners = np.stack([C[:-1, :-1], C[1:, :-1], C[:-1, 1:], C[1:, 1:]])
+        active = np.isfinite(corners).all(axis=0)  # leaf cells, all corners measured
+        with np.errstate(invalid="ignore"):
+            high = corners.max(axis=0) >= self.value_threshold
+            steep = corners.max(axis=0) - corners.min(axis=0) > self.gradient_threshold
+        return active & (high | steep)
+
+    def next_pass(self):
+        """(j, i) pixel indices of the next refinement pass, empty when done."""
+        if self.step is None or self.step == 1:
+            return np.zeros(0, int), np.zeros(0, int)
+        refine = self.refine_cells()
+        jl, il = lattice(self.shape[0], self.step), lattice(self.shape[1], self.step)
+        self.step //= 2
+        self.n_pass += 1
+        jh, ih = lattice(self.shape[0], self.step), lattice(self.shape[1], self.step)
+
+        # a point belongs to every cell it lies in or on the border of, padding
+        # the refine mask with False makes cells beyond the edges lookups too
+        pad = np.pad(refine, 1)
+        ja = np.searchsorted(jl, jh, side="left")  # cell (index + 1 in pad) below/at the point
+        jb = np.searchsorted(jl, jh, side="right")
+        ia = np.searchsorted(il, ih, side="left")
+        ib = np.searchsorted(il, ih, side="right")
+        ja, jb = np.minimum(ja, pad.shape[0] - 1), np.minimum(jb, pad.shape[0] - 1)
+        ia, ib = np.minimum(ia, pad.shape[1] - 1), np.minimum(ib, pad.shape[1] - 1)
+        need = (pad[np.ix_(ja, ia)] | pad[np.ix_(ja, ib)]
+                | pad[np.ix_(jb, ia)] | pad[np.ix_(jb, ib)])
+        need &= ~self.measured[np.ix_(jh, ih)]
+        p, q = np.nonzero(need)
+        if len(p) == 0:
+            self.step = 1
+        return serpentine(jh[p], ih[q])
+
+    def render(self):
+        """Interpolated (Nv, Nh) image of the measured values.
+
+        Coarse to fine, every lattice is interpolated bilinearly, with the
+        measured values where there are some and the coarser image elsewhere,
+        so the image is exact at measured pixels and smooth in between.
+        """
+        image = None
+        step = self.coarse_step
+        while True:
+            jl, il = lattice(self.shape[0], step), lattice(self.shape[1], step)
+            L = self.values[np.ix_(jl, il)]
+            if image is not None:
+                L = np.where(self.measured[np.ix_(jl, il)], L, image[np.ix_(jl, il)])
+            image = bilinear(L, jl, il, self.shape)
+            if step == 1:
+                return image
+            step //= 2
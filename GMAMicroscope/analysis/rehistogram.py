@@ -0,0 +1,149 @@
+"""Headless re-histogramming of stored pulse heights.
+
+Rebuilds histograms from the 'raw_values' of many *_pulse_height_analyzer.h5
+files with a new bin_number / threshold / max_val, without opening the GUI.
+Files are processed in parallel and raw_values are read in chunks.
+
+    python -m analysis.rehistogram data/ --bin-number 2048 --threshold 0.5 -o rebinned.h5
+    python -m analysis.rehistogram data/ --sum -o cs137_sum.h5
+
+With --sum, runs taken with the same acquisition settings are added up into
+one high-statistics spectrum per settings group.
+"""
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from analysis.histogram import IncrementalHistogram
+
+MEAS_GROUP = 'measurement/pulse_height_analyzer'
+REHIST_CHUNK_SIZE = 1 << 20
+# settings that change what ends up in raw_values, runs are only summed if these match
+ACQUISITION_SETTINGS = ('threshold', 'max_val', 'pulse_window_size', 'sampling_frequency', 'buffer_size')
+
+
+def find_pulse_height_files(paths):
+    fnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            fnames += sorted(glob.glob(os.path.join(path, '*_pulse_height_analyzer.h5')))
+        else:
+            fnames.append(path)
+    return fnames
+
+
+def read_settings(fname):
+    with h5py.File(fname, 'r') as f:
+        return dict(f[MEAS_GROUP + '/settings'].attrs)
+
+
+def rehistogram_file(fname, bin_number, vmin, vmax, chunk_size=REHIST_CHUNK_SIZE):
+    """Histograms the raw_values of one file, reading them chunk by chunk.
+
+    Returns:
+        dict with 'fname', 'counts', 'n_events' (in range) and 'settings'.
+    """
+    hist = IncrementalHistogram(bin_number, vmin, vmax)
+    with h5py.File(fname, 'r') as f:
+        group = f[MEAS_GROUP]
+        settings = dict(group['settings'].attrs)
+        raw = group['raw_values']
+        for start in range(0, raw.shape[0], chunk_size):
+            hist.add(raw[start:start + chunk_size])
+    return dict(fname=fname, counts=hist.counts, n_events=int(hist.counts.sum()), settings=settings)
+
+
+def settings_key(settings):
+    return tuple((name, str(settings.get(name))) for name in ACQUISITION_SETTINGS)
+
+
+def rehistogram_files(fnames, bin_number, vmin, vmax, max_workers=None, chunk_size=REHIST_CHUNK_SIZE):
+    """Re-histograms *fnames* in a process pool. Files without raw_values are skipped."""
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {fname: pool.submit(rehistogram_file, fname, bin_number, vmin, vmax, chunk_size)
+                   for fname in fnames}
+        for fname, future in futures.items():
+            try:
+                results.append(future.result())
+                print(f"{fname}: {results[-1]['n_events']} events")
+            except KeyError:
+                print(f"{fname}: no raw_values, skipped")
+            except Exception as e:
+                print(f"{fname}: failed ({e})")
+    return results
+
+
+def sum_by_settings(results):
+    """Adds up the histograms of runs with identical acquisition settings."""
+    groups = {}
+    for result in results:
+        key = settings_key(result['settings'])
+        if key not in groups:
+            settings = {name: result['settings'][name] for name in ACQUISITION_SETTINGS
+                        if name in result['settings']}
+            groups[key] = dict(settings=settings, counts=np.zeros_like(result['counts']),
+                               n_events=0, sources=[])
+        group = groups[key]
+        group['counts'] += result['counts']
+        group['n_events'] += result['n_events']
+        group['sources'].append(os.path.basename(result['fname']))
+    return list(groups.values())
+
+
+def write_results(out_fname, edges, results, sums=None):
+    with h5py.File(out_fname, 'w') as f:
+        f['x'] = edges
+        runs = f.create_group('runs')
+        for result in results:
+            g = runs.create_group(os.path.splitext(os.path.basename(result['fname']))[0])
+            g['y'] = result['counts']
+            g.attrs['n_events'] = result['n_events']
+            g.attrs['source_file'] = result['fname']
+        for i, group in enumerate(sums or []):
+            g = f.create_group(f'sums/sum_{i}')
+            g['y'] = group['counts']
+            g.attrs['n_events'] = group['n_events']
+            g.attrs['n_runs'] = len(group['sources'])
+            g['sources'] = np.array(group['sources'], dtype=h5py.string_dtype())
+            for name, val in group['settings'].items():
+                g.attrs[name] = val
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-histogram stored pulse heights without the GUI")
+    parser.add_argument('paths', nargs='+', help="pulse height h5 files or directories")
+    parser.add_argument('-o', '--output', default='rehistogram.h5')
+    parser.add_argument('--bin-number', type=int, default=None, help="defaults to the first file's setting")
+    parser.add_argument('--threshold', type=float, default=None, help="lower edge (V), defaults to the first file's setting")
+    parser.add_argument('--max-val', type=float, default=None, help="upper edge (V), defaults to the first file's setting")
+    parser.add_argument('--sum', action='store_true', help="also sum runs taken with the same settings")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=REHIST_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fnames = find_pulse_height_files(args.paths)
+    if not fnames:
+        print("No pulse height files found")
+        return
+
+    # every file is binned the same way so that histograms can be summed
+    defaults = read_settings(fnames[0])
+    bin_number = args.bin_number or int(defaults.get('bin_number', 1024))
+    vmin = args.threshold if args.threshold is not None else float(defaults.get('threshold', 0.0))
+    vmax = args.max_val if args.max_val is not None else float(defaults.get('max_val', 5.0))
+    print(f"Re-histogramming {len(fnames)} files: {bin_number} bins over [{vmin}, {vmax}] V")
+
+    results = rehistogram_files(fnames, bin_number, vmin, vmax, args.workers, args.chunk_size)
+    sums = sum_by_settings(results) if args.sum else None
+    edges = IncrementalHistogram(bin_number, vmin, vmax).edges
+    write_results(args.output, edges, results, sums)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
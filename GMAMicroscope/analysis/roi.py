@@ -0,0 +1,128 @@
+"""Regions of interest on a pulse height histogram, updated batch by batch."""
+import numpy as np
+
+
+def parse_rois(text):
+    """Parses 'name:lo-hi; name2:lo-hi' (pulse heights in V) into (name, lo, hi) tuples.
+
+    A missing name defaults to roi<i>.
+    """
+    rois = []
+    for i, item in enumerate(filter(None, (part.strip() for part in text.split(";")))):
+        name, _, span = item.rpartition(":")
+        try:
+            lo, hi = (float(v) for v in span.split("-"))
+        except ValueError:
+            raise ValueError(f"ROI {item!r} is not of the form name:lo-hi")
+        rois.append((name.strip() or f"roi{i}", min(lo, hi), max(lo, hi)))
+    return rois
+
+
+class ROIMonitor:
+    """Gross/net counts of a set of ROIs, fed with the batch histograms of an
+    IncrementalHistogram.
+
+    The background under each ROI is estimated from *bg_bins* bins on either
+    side of it (flat average, scaled to the ROI width). Per batch only the bins
+    of the ROIs and their background windows are summed, independent of how
+    many events were seen before.
+    """
+
+    def __init__(self, rois, edges, bg_bins=3):
+        self.names = [name for name, _, _ in rois]
+        self.limits = np.array([(lo, hi) for _, lo, hi in rois], dtype=float).reshape(-1, 2)
+        n_bins = len(edges) - 1
+        self.bin_ranges = []
+        for lo, hi in self.limits:
+            i0 = int(np.clip(np.searchsorted(edges, lo, side="right") - 1, 0, n_bins - 1))
+            i1 = int(np.clip(np.searchsorted(edges, hi, side="left"), i0 + 1, n_bins))
+            b0, b1 = max(0, i0 - bg_bins), min(n_bins, i1 + bg_bins)
+            self.bin_ranges.append((i0, i1, b0, b1))
+        # ROI width over background window width, per ROI
+        self.bg_scale = np.array([(i1 - i0) / max((i0 - b0) + (b1 - i1), 1)
+                                  for i0, i1, b0, b1 in self.bin_ranges])
+        self.reset()
+
+    def __len__(self):
+        return len(self.names)
+
+    def reset(self):
+        n = len(self.names)
+        self.gross = np.zeros(n, dtype=np.int64)
+        self.background = np.zeros(n, dtype=np.int64)  # counts in the side windows
+        self.live_time = 0.0
+
+    def add(self, batch_counts, dt=0.0):
+        """Adds the histogram of one event batch, *dt* is the acquisition time it
+        covers. batch_counts may be None for a batch without events."""
+        self.live_time += dt
+        if batch_counts is None:
+            return
+        for k, (i0, i1, b0, b1) in enumerate(self.bin_ranges):
+            self.gross[k] += batch_counts[i0:i1].sum()
+            self.background[k] += batch_counts[b0:i0].sum() + batch_counts[i1:b1].sum()
+
+    @property
+    def net(self):
+        return self.gross - self.bg_scale * self.background
+
+    @property
+    def net_error(self):
+        """Poisson uncertainty of the net counts."""
+        return np.sqrt(self.gross + self.bg_scale ** 2 * self.background)
+
+    @property
+    def relative_error(self):
+        """net_error / net, inf while the net counts are not positive."""
+        net = self.net
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(net > 0, self.net_error / net, np.inf)
+
+    def rates(self):
+        """(gross, net) count rates in 1/s averaged over the live time."""
+        t = max(self.live_time, 1e-12)
+        return self.gross / t, self.net / t
+
+    def precision_reached(self, target):
+        """Mask of the ROIs whose relative net error is at or below *target* (fraction)."""
+        return self.relative_error <= target
+
+
+class ROITimeSeries:
+    """Samples of ROI counts and rates over a run, kept in growable arrays."""
+
+    FIELDS = ("time", "gross", "net", "gross_rate", "net_rate", "relative_error")
+
+    def __init__(self, n_rois, capacity=1024):
+        self.n = 0
+        self.time = np.zeros(capacity)
+        self.gross = np.zeros((capacity, n_rois))
+        self.net = np.zeros((capacity, n_rois))
+        self.gross_rate = np.zeros((capacity, n_rois))
+        self.net_rate = np.zeros((capacity, n_rois))
+        self.relative_error = np.zeros((capacity, n_rois))
+
+    def append(self, t, monitor):
+        """Records the current state of *monitor*. Rates are over the interval since the last sample."""
+        if self.n == len(self.time):
+            for name in self.FIELDS:
+                old = getattr(self, name)
+                new = np.zeros((2 * len(old), *old.shape[1:]))
+                new[:self.n] = old
+                setattr(self, name, new)
+        i = self.n
+        self.time[i] = t
+        self.gross[i] = monitor.gross
+        self.net[i] = monitor.net
+        dt = t - self.time[i - 1] if i > 0 else t
+        if dt > 0:
+            prev_gross = self.gross[i - 1] if i > 0 else 0
+            prev_net = self.net[i - 1] if i > 0 else 0
+            self.gross_rate[i] = (self.gross[i] - prev_gross) / dt
+            self.net_rate[i] = (self.net[i] - prev_net) / dt
+        self.relative_error[i] = monitor.relative_error
+        self.n += 1
+
+    def arrays(self):
+        """Dict of the recorded samples (copies), e.g. for save_h5."""
+        return {name: getattr(self, name)[:self.n].copy() for name in self.FIELDS}
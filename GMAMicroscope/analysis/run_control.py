@@ -0,0 +1,89 @@
+"""Adaptive stopping of counting runs once a quantity is known precisely enough."""
+import numpy as np
+
+QUANTITIES = ("total_counts", "roi_net_area", "peak_centroid")
+
+
+class PrecisionController:
+    """Tracks the relative uncertainty of one quantity while events come in and
+    decides when a run can stop.
+
+    Quantities:
+        total_counts: all accepted events, 1/sqrt(N).
+        roi_net_area: net counts of the ROIs of an ROIMonitor, the worst ROI counts.
+        peak_centroid: mean pulse height of the events within *window*, its
+        standard error over the mean. Kept as running sums, so each batch
+        costs only its own size.
+
+    Every check() appends a row to the convergence log.
+    """
+
+    LOG_FIELDS = ("time", "n_events", "value", "relative_error")
+
+    def __init__(self, quantity="total_counts", target=0.01, time_budget=0.0,
+                 window=(-np.inf, np.inf), roi_monitor=None):
+        if quantity not in QUANTITIES:
+            raise ValueError(f"unknown quantity {quantity!r}, choose from {QUANTITIES}")
+        if quantity == "roi_net_area" and roi_monitor is None:
+            raise ValueError("roi_net_area needs ROIs")
+        self.quantity = quantity
+        self.target = target
+        self.time_budget = time_budget
+        self.window = window
+        self.roi_monitor = roi_monitor
+        self.n_events = 0
+        # running sums of the events inside the centroid window
+        self.n_window = 0
+        self.sum_x = 0.0
+        self.sum_x2 = 0.0
+        self.log = {name: [] for name in self.LOG_FIELDS}
+        self.stop_reason = ""
+
+    def add(self, values):
+        """Adds accepted pulse heights (the ROI monitor is fed separately)."""
+        self.n_events += len(values)
+        if self.quantity == "peak_centroid":
+            lo, hi = self.window
+            x = values[(values >= lo) & (values <= hi)]
+            self.n_window += x.size
+            self.sum_x += x.sum()
+            self.sum_x2 += np.dot(x, x)
+
+    def estimate(self):
+        """Current (value, relative error) of the tracked quantity."""
+        if self.quantity == "total_counts":
+            n = self.n_events
+            return n, 1 / np.sqrt(n) if n > 0 else np.inf
+        if self.quantity == "roi_net_area":
+            rel = self.roi_monitor.relative_error
+            worst = int(np.argmax(rel))
+            return self.roi_monitor.net[worst], rel[worst]
+        n = self.n_window
+        if n < 2:
+            return np.nan, np.inf
+        mean = self.sum_x / n
+        var = max(self.sum_x2 / n - mean ** 2, 0.0) * n / (n - 1)
+        return mean, np.sqrt(var / n) / abs(mean)
+
+    def check(self, t):
+        """Logs the current estimate at run time *t* (s).
+
+        Returns:
+            str: Why the run should stop ('precision' or 'time budget'), or '' to go on.
+        """
+        value, rel = self.estimate()
+        for name, v in zip(self.LOG_FIELDS, (t, self.n_events, value, rel)):
+            self.log[name].append(v)
+        if rel <= self.target:
+            self.stop_reason = "precision"
+        elif self.time_budget > 0 and t >= self.time_budget:
+            self.stop_reason = "time budget"
+        return self.stop_reason
+
+    @property
+    def n_log(self):
+        return len(self.log["time"])
+
+    def log_arrays(self, start=0):
+        """Convergence log rows from *start* on as arrays."""
+        return {name: np.array(values[start:], dtype=float) for name, values in self.log.items()}
@@ -0,0 +1,90 @@
+"""Time-resolved pulse height spectra: one histogram per fixed-length time slice."""
+import threading
+
+import numpy as np
+
+SLICE_READ_ROWS = 4096
+
+
+class SpectrogramAccumulator:
+    """Builds a (time slice x amplitude bin) count matrix from batch histograms.
+
+    Completed slices are kept in a ring of the last *display_slices* rows for
+    the live image and, with *queue_slices*, queued for a writer that drains
+    them with pop_completed(). Without a writer nothing is queued, so memory
+    use does not grow with the run length.
+    """
+
+    def __init__(self, bin_number, slice_duration, display_slices=300, queue_slices=False):
+        if slice_duration <= 0:
+            raise ValueError(f"slice_duration must be positive, got {slice_duration}")
+        self.bin_number = int(bin_number)
+        self.slice_duration = float(slice_duration)
+        self.display_slices = int(display_slices)
+        self.lock = threading.Lock()
+        self.current = np.zeros(self.bin_number, dtype=np.int64)
+        self.n_slices = 0  # completed slices
+        self.ring = np.zeros((self.display_slices, self.bin_number), dtype=np.int64)
+        self.queue_slices = queue_slices
+        self.pending = []
+        self.version = 0
+
+    def add(self, batch_counts, t):
+        """Adds a batch histogram (or None for a batch without events) seen at
+        run time *t* (s). Slices that ended before *t* are completed first, empty
+        ones included."""
+        with self.lock:
+            while t >= (self.n_slices + 1) * self.slice_duration:
+                self._complete_slice()
+            if batch_counts is not None:
+                self.current += batch_counts
+
+    def finish(self):
+        """Completes the last, partial slice at the end of a run."""
+        with self.lock:
+            if self.current.any():
+                self._complete_slice()
+
+    def _complete_slice(self):
+        row = self.current
+        if self.queue_slices:
+            self.pending.append(row)
+        self.ring[self.n_slices % self.display_slices] = row
+        self.n_slices += 1
+        self.current = np.zeros(self.bin_number, dtype=np.int64)
+        self.version += 1
+
+    def pop_completed(self):
+        """Slices completed since the last call as a (k, bin_number) array."""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return np.zeros((0, self.bin_number), dtype=np.int64)
+        return np.stack(rows)
+
+    def image(self):
+        """Copy of the ring in time order and the start time of its first row."""
+        with self.lock:
+            n = min(self.n_slices, self.display_slices)
+            first = self.n_slices - n
+            idx = np.arange(first, self.n_slices) % self.display_slices
+            return self.ring[idx], first * self.slice_duration
+
+
+def slice_totals(dset, chunk_rows=SLICE_READ_ROWS):
+    """Total counts of every time slice of a stored spectrogram, read in chunks."""
+    totals = np.zeros(dset.shape[0], dtype=np.int64)
+    for start in range(0, dset.shape[0], chunk_rows):
+        totals[start:start + chunk_rows] = dset[start:start + chunk_rows].sum(axis=1)
+    return totals
+
+
+def window_spectrum(dset, start, stop, chunk_rows=SLICE_READ_ROWS):
+    """Sum of the slices start..stop-1 of a stored spectrogram, i.e. the
+    spectrum of that time window, without going back to the events."""
+    start = max(0, int(start))
+    stop = min(dset.shape[0], int(stop))
+    counts = np.zeros(dset.shape[1], dtype=np.int64)
+    for i in range(start, stop, chunk_rows):
+        counts += dset[i:min(i + chunk_rows, stop)].sum(axis=0)
+    return counts
@@ -0,0 +1,124 @@
+"""Vectorized FFT spectra and Welch-averaged noise power spectral densities."""
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+WINDOWS = ("hann", "hamming", "blackman", "flat_top", "rectangular")
+
+# cosine sum coefficients of the periodic windows
+_COSINE_COEFFICIENTS = {
+    "rectangular": (1.0,),
+    "hann": (0.5, 0.5),
+    "hamming": (0.54, 0.46),
+    "blackman": (0.42, 0.5, 0.08),
+    "flat_top": (0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368),
+}
+
+
+@lru_cache(maxsize=32)
+def get_window(name, n):
+    """Periodic (DFT-even) window of length *n*. Cached, the returned array is read-only."""
+    if name not in _COSINE_COEFFICIENTS:
+        raise ValueError(f"unknown window {name!r}, choose from {WINDOWS}")
+    phase = 2 * np.pi * np.arange(n) / n
+    w = np.zeros(n)
+    for k, a in enumerate(_COSINE_COEFFICIENTS[name]):
+        w += (-1) ** k * a * np.cos(k * phase)
+    w.flags.writeable = False
+    return w
+
+
+def rfft_frequencies(n, sample_rate):
+    return np.fft.rfftfreq(n, d=1.0 / sample_rate)
+
+
+def amplitude_spectrum(buffer, sample_rate, window="flat_top"):
+    """Single sided amplitude spectrum in V (rms) of one buffer.
+
+    Returns:
+        (freqs, amplitude): Frequencies in Hz and rms amplitudes in V. Use
+        20*log10(amplitude) for dBV.
+    """
+    buffer = np.asarray(buffer, dtype=float)
+    w = get_window(window, len(buffer))
+    spec = np.abs(np.fft.rfft(buffer * w)) / w.sum()
+    spec[1:] *= np.sqrt(2)  # single sided rms, DC stays as is
+    if len(buffer) % 2 == 0:
+        spec[-1] /= np.sqrt(2)
+    return rfft_frequencies(len(buffer), sample_rate), spec
+
+
+def segment_psds(segments, sample_rate, window="hann", detrend=True):
+    """One sided PSD (V^2/Hz) of every row of *segments* (shape (n_segments, n))."""
+    segments = np.asarray(segments, dtype=float)
+    n = segments.shape[-1]
+    w = get_window(window, n)
+    if detrend:
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+    spec = np.abs(np.fft.rfft(segments * w, axis=-1)) ** 2
+    spec /= sample_rate * np.dot(w, w)
+    spec[..., 1:] *= 2
+    if n % 2 == 0:
+        spec[..., -1] /= 2
+    return spec
+
+
+def split_segments(buffer, segment_size, overlap=0.5):
+    """Overlapping segments of *buffer* as a (n_segments, segment_size) view, no copies."""
+    step = max(1, int(round(segment_size * (1 - overlap))))
+    if len(buffer) < segment_size:
+        return np.empty((0, segment_size))
+    return np.lib.stride_tricks.sliding_window_view(buffer, segment_size)[::step]
+
+
+class WelchAccumulator:
+    """Running Welch average of the noise PSD over many buffers.
+
+    Every buffer is split into overlapping windowed segments, their
+    periodograms are averaged with everything accumulated so far. The cost of
+    add() only depends on the buffer size.
+    """
+
+    def __init__(self, segment_size, sample_rate, window="hann", overlap=0.5, detrend=True):
+        self.segment_size = int(segment_size)
+        self.sample_rate = float(sample_rate)
+        self.window = window
+        self.overlap = overlap
+        self.detrend = detrend
+        self.freqs = rfft_frequencies(self.segment_size, self.sample_rate)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.psd_sum = np.zeros(len(self.freqs))
+            self.n_averages = 0
+
+    def add(self, buffer):
+        """Adds the segments of *buffer*. Returns the number of segments used."""
+        segments = split_segments(np.asarray(buffer, dtype=float), self.segment_size, self.overlap)
+        if len(segments) == 0:
+            return 0
+        psds = segment_psds(segments, self.sample_rate, self.window, self.detrend)
+        with self.lock:
+            self.psd_sum += psds.sum(axis=0)
+            self.n_averages += len(segments)
+        return len(segments)
+
+    @property
+    def psd(self):
+        """Averaged PSD in V^2/Hz (a copy)."""
+        with self.lock:
+            return self.psd_sum / max(self.n_averages, 1)
+
+    @property
+    def asd(self):
+        """Averaged amplitude spectral density in V/sqrt(Hz)."""
+        return np.sqrt(self.psd)
+
+    @property
+    def resolution_bandwidth(self):
+        """Equivalent noise bandwidth of one bin in Hz."""
+        w = get_window(self.window, self.segment_size)
+        return self.sample_rate * np.dot(w, w) / w.sum() ** 2
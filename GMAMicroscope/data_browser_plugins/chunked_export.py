@@ -0,0 +1,278 @@
+"""Chunked export of measurement datasets to CSV (or Parquet).
+
+Datasets are read from the h5 file in slices and written block by block, so
+exports never hold a whole run in memory. Used by the data browser plugins
+(through ExportWorker, off the UI thread) and from the command line:
+
+    python -m data_browser_plugins.chunked_export data/ --format csv
+"""
+import argparse
+import csv
+import datetime
+import glob
+import os
+
+import h5py
+import numpy as np
+from qtpy import QtCore, QtWidgets
+
+from analysis.decimation import recorded_length, volts
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_CHUNK_SIZE = 1 << 20
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def settings_metadata_lines(group):
+    """Human readable lines describing the 'settings' of a measurement group."""
+    meta_lines = []
+    if 'settings' not in group:
+        return meta_lines
+    settings_group = group['settings']
+
+    for key, ds in settings_group.items():
+        try:
+            val = ds[()]
+            if isinstance(val, (bytes, np.bytes_)):
+                val = val.decode()
+            meta_lines.append(f"{key}: {val}")
+        except Exception as e:
+            meta_lines.append(f"{key}: <unreadable> ({e})")
+
+    for key, val in settings_group.attrs.items():
+        if isinstance(val, (bytes, np.bytes_)):
+            val = val.decode()
+        meta_lines.append(f"{key} (attr): {val}")
+    return meta_lines
+
+
+def provenance_lines(source_path):
+    return [
+        f"source_file: {os.path.basename(source_path)}",
+        f"export_timestamp: {datetime.datetime.now().isoformat(timespec='seconds')}"
+    ]
+
+
+def _column_format(dtype):
+    if np.issubdtype(dtype, np.integer) or np.issubdtype(dtype, np.bool_):
+        return '%d'
+    return '%.15g'
+
+
+def export_columns(out_path, columns, header_lines=(), n=None, chunk_size=EXPORT_CHUNK_SIZE,
+                   progress_func=None, cancel_func=None):
+    """Writes equally long 1D columns to *out_path* in blocks of *chunk_size* rows.
+
+    Args:
+        out_path (str): Destination. A '.parquet' extension writes Parquet (needs
+        pyarrow), anything else writes CSV with a commented header.
+        columns (dict): Column name -> h5py dataset or array. Only the current
+        block of each column is read.
+        header_lines (list of str): Written as '# ' comment lines (CSV) or as
+        file metadata (Parquet).
+        n (int, optional): Number of rows to export. Defaults to the shortest column.
+        progress_func (callable, optional): Called with the fraction done (0..1) after each block.
+        cancel_func (callable, optional): Polled between blocks; returning True
+        aborts the export, removes the partial file and raises ExportCancelled.
+    """
+    names = list(columns.keys())
+    if n is None:
+        n = min(len(col) for col in columns.values())
+    parquet = out_path.lower().endswith('.parquet')
+    if parquet and pq is None:
+        raise ImportError("Parquet export requires pyarrow")
+
+    try:
+        if parquet:
+            _export_parquet(out_path, columns, names, header_lines, n, chunk_size,
+                            progress_func, cancel_func)
+        else:
+            _export_csv(out_path, columns, names, header_lines, n, chunk_size,
+                        progress_func, cancel_func)
+    except ExportCancelled:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+
+
+def _blocks(columns, names, n, chunk_size, progress_func, cancel_func):
+    for start in range(0, n, chunk_size):
+        if cancel_func is not None and cancel_func():
+            raise ExportCancelled(f"export cancelled after {start} rows")
+        stop = min(start + chunk_size, n)
+        yield [np.asarray(columns[name][start:stop]) for name in names]
+        if progress_func is not None:
+            progress_func(stop / n)
+
+
+def _export_csv(out_path, columns, names, header_lines, n, chunk_size, progress_func, cancel_func):
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for line in header_lines:
+            writer.writerow([f"# {line}"])
+        if header_lines:
+            writer.writerow([])  # blank line
+        writer.writerow(names)
+
+        fmt = None
+        for block in _blocks(columns, names, n, chunk_size, progress_func, cancel_func):
+            if fmt is None:
+                fmt = [_column_format(col.dtype) for col in block]
+            np.savetxt(f, np.column_stack(block), fmt=fmt, delimiter=',')
+
+
+def _export_parquet(out_path, columns, names, header_lines, n, chunk_size, progress_func, cancel_func):
+    writer = None
+    try:
+        for block in _blocks(columns, names, n, chunk_size, progress_func, cancel_func):
+            table = pa.table(dict(zip(names, block)))
+            if writer is None:
+                metadata = {b'header': "\n".join(header_lines).encode()}
+                schema = table.schema.with_metadata(metadata)
+                writer = pq.ParquetWriter(out_path, schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_h5_file(fname, out_dir=None, fmt='csv', **kwargs):
+    """Exports every supported measurement in *fname*, next to it or into *out_dir*.
+
+    Returns:
+        list of str: Paths of the written files.
+    """
+    base = os.path.splitext(os.path.basename(fname))[0]
+    out_dir = out_dir or os.path.dirname(fname)
+    written = []
+
+    with h5py.File(fname, 'r') as f:
+        header = provenance_lines(fname)
+
+        if 'measurement/pulse_height_analyzer/y' in f:
+            group = f['measurement/pulse_height_analyzer']
+            meta = header + settings_metadata_lines(group)
+            x = group['x'][()]
+            out = os.path.join(out_dir, f"{base}_histogram.{fmt}")
+            export_columns(out, {'x_mid': 0.5 * (x[:-1] + x[1:]), 'count': group['y']}, meta, **kwargs)
+            written.append(out)
+            if 'raw_values' in group:
+                out = os.path.join(out_dir, f"{base}_raw_data.{fmt}")
+                export_columns(out, {'pulse_height': group['raw_values']}, meta, **kwargs)
+                written.append(out)
+
+        if 'measurement/read_scope/y' in f:
+            group = f['measurement/read_scope']
+            meta = header + settings_metadata_lines(group)
+            y = volts(group['y'])
+            columns = {'x': group['x'], 'y': y} if 'x' in group else {'y': y}
+            n = recorded_length(group['x']) if 'x' in group else None
+            out = os.path.join(out_dir, f"{base}_scope_trace.{fmt}")
+            export_columns(out, columns, meta, n=n, **kwargs)
+            written.append(out)
+
+    return written
+
+
+class ExportWorker(QtCore.QThread):
+    """Runs export jobs off the UI thread.
+
+    Each job is a dict of keyword arguments for export_columns(), except that
+    'source' names an h5 file and 'columns' maps column names to dataset paths
+    in it (or to arrays), raw sample datasets are exported in volts. The file
+    is opened inside the worker thread.
+    """
+
+    progress = QtCore.Signal(int)
+    failed = QtCore.Signal(str)
+
+    def __init__(self, jobs, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        n_jobs = len(self.jobs)
+        for i, job in enumerate(self.jobs):
+            job = dict(job)
+            source = job.pop('source')
+
+            def progress(frac, i=i):
+                self.progress.emit(int(100 * (i + frac) / n_jobs))
+
+            try:
+                with h5py.File(source, 'r') as f:
+                    columns = {name: volts(f[col]) if isinstance(col, str) else col
+                               for name, col in job.pop('columns').items()}
+                    export_columns(columns=columns, progress_func=progress,
+                                   cancel_func=lambda: self._cancelled, **job)
+                print(f"exported {job['out_path']}")
+            except ExportCancelled:
+                print("export cancelled")
+                return
+            except Exception as e:
+                self.failed.emit(f"{job['out_path']}: {e}")
+                return
+
+
+# workers that have not finished yet, a QThread must not be garbage collected while it runs
+_running_workers = []
+
+
+def start_export(parent, jobs, title="Exporting..."):
+    """Starts an ExportWorker for *jobs* with a cancellable progress dialog.
+
+    Returns the worker. It is kept referenced until it has finished, so
+    starting another export while one runs is safe.
+    """
+    dialog = QtWidgets.QProgressDialog(title, "Cancel", 0, 100, parent)
+    dialog.setMinimumDuration(200)
+    worker = ExportWorker(jobs)
+    worker.progress.connect(dialog.setValue)
+    worker.failed.connect(lambda msg: print("Export failed:", msg))
+    worker.finished.connect(dialog.close)
+    worker.finished.connect(lambda: _running_workers.remove(worker))
+    dialog.canceled.connect(worker.cancel)
+    _running_workers.append(worker)
+    worker.start()
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked CSV/Parquet export of measurement h5 files")
+    parser.add_argument('paths', nargs='+', help="h5 files or directories of h5 files")
+    parser.add_argument('--out-dir', default=None, help="defaults to next to each h5 file")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fnames = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            fnames += sorted(glob.glob(os.path.join(path, '*.h5')))
+        else:
+            fnames.append(path)
+
+    for fname in fnames:
+        if fname.endswith('_lod.h5'):
+            continue
+        try:
+            for out in export_h5_file(fname, args.out_dir, args.format, chunk_size=args.chunk_size):
+                print(f"{fname} -> {out}")
+        except Exception as e:
+            print(f"Failed to export {fname}: {e}")
+
+
+if __name__ == "__main__":
+    main()
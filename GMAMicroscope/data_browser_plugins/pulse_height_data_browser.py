@@ -3,10 +3,12 @@ import h5py
 import pyqtgraph as pg
 from qtpy import QtWidgets
 from ScopeFoundry.data_browser import DataBrowserView
-import csv
-import datetime
 import os
 
+from analysis.peaks import DEFAULT_CALIBRATION_FILE, EnergyCalibration, PeakFitter, calibration_path, peak_table
+from analysis.spectrogram import slice_totals, window_spectrum
+from data_browser_plugins.chunked_export import provenance_lines, start_export
+
 class PulseHeightDataBrowser(DataBrowserView):
     
     name = 'pulse_height_data_browser'
@@ -19,6 +21,15 @@ class PulseHeightDataBrowser(DataBrowserView):
         # Plotting
         self.graph_layout = pg.GraphicsLayoutWidget()
         self.plot = self.graph_layout.addPlot(title="Pulse Height Histogram")
+        # counts per time slice of spectrogram runs, drag the region to re-slice
+        self.graph_layout.nextRow()
+        self.time_plot = self.graph_layout.addPlot(title="Counts per time slice (drag region to select)")
+        self.time_plot.setLabel('bottom', "Time", units='s')
+        self.time_curve = self.time_plot.plot(stepMode="center", pen='g')
+        self.time_region = pg.LinearRegionItem()
+        self.time_region.sigRegionChangeFinished.connect(self.reslice)
+        self.time_plot.addItem(self.time_region)
+        self.time_plot.hide()
         main_layout.addWidget(self.graph_layout)
 
         # Horizontal layout for metadata + buttons
@@ -37,15 +48,25 @@ class PulseHeightDataBrowser(DataBrowserView):
         self.export_btn = QtWidgets.QPushButton("Export CSV")
         self.export_btn.clicked.connect(self.export_csv)
         button_layout.addWidget(self.export_btn)
+        self.calibrate_btn = QtWidgets.QPushButton("Calibrate Energy...")
+        self.calibrate_btn.clicked.connect(self.calibrate_energy)
+        button_layout.addWidget(self.calibrate_btn)
         button_layout.addStretch()
         lower_layout.addLayout(button_layout)
 
         self.x = None
         self.y = None
-        self.raw_data = None
+        self.has_raw_data = False
         self.bin_number = None
         self.filepath = None
         self.bar_item = None
+        # kept between files, similar spectra warm-start from the previous fit
+        self.peak_fitter = PeakFitter()
+        self.peak_results = []
+        self.fit_items = []
+        self.settings_text = ""
+        self.calibration_file = DEFAULT_CALIBRATION_FILE
+        self.slice_duration = None
     
     def on_change_data_filename(self, fname=None):
         self.is_file_supported(fname)
@@ -55,8 +76,13 @@ class PulseHeightDataBrowser(DataBrowserView):
         print(f"load_data called on {filepath}")
         print("Loading:", filepath)
         self.filepath = filepath
+        # the calibration lives with the data, like the one PulseHeightAnalyze uses
+        self.calibration_file = calibration_path(DEFAULT_CALIBRATION_FILE, os.path.dirname(filepath))
         self.metadata_box.clear()
+        self.settings_text = ""
         self.plot.clear()
+        self.fit_items = []
+        self.slice_duration = None
 
         with h5py.File(filepath, 'r') as f:
             try:
@@ -70,8 +96,9 @@ class PulseHeightDataBrowser(DataBrowserView):
                     self.x = np.arange(len(self.y) + 1)
                     print("Generated x:", self.x.shape)
                 
-                self.raw_data = group['raw_values'][()]
-                print("Loaded raw_data shape:", self.raw_data.shape)
+                # raw values can be huge, they are only streamed from the file on export
+                self.has_raw_data = 'raw_values' in group
+                print("Raw data shape:", group['raw_values'].shape if self.has_raw_data else None)
 
                 # Metadata
                 if 'settings' in group:
@@ -97,7 +124,14 @@ class PulseHeightDataBrowser(DataBrowserView):
                             self.bin_number = int(val)
                         meta_lines.append(f"{key} (attr): {val}")
 
-                    self.metadata_box.setPlainText("\n".join(meta_lines))
+                    self.settings_text = "\n".join(meta_lines)
+                    self.metadata_box.setPlainText(self.settings_text)
+
+                if 'spectrogram' in group:
+                    # only the per-slice totals are read here, spectra are summed on demand
+                    spectrogram = group['spectrogram']
+                    self.slice_duration = float(spectrogram.attrs['slice_duration'])
+                    self.slice_totals = slice_totals(spectrogram)
             except Exception as e:
                 print("Failed to load data:", e)
                 return
@@ -112,9 +146,100 @@ class PulseHeightDataBrowser(DataBrowserView):
             print("y shape:", self.y.shape)
             self.bar_item = pg.BarGraphItem(x=x_mid, height=self.y, width=bin_width, brush='g')
             self.plot.addItem(self.bar_item)
+            self.fit_peaks(bin_width)
+
+        if self.slice_duration:
+            t = self.slice_duration * np.arange(len(self.slice_totals) + 1)
+            self.time_curve.setData(t, self.slice_totals)
+            self.time_region.blockSignals(True)
+            self.time_region.setRegion((t[0], t[-1]))
+            self.time_region.blockSignals(False)
+            self.time_plot.show()
+        else:
+            self.time_plot.hide()
+
+    def reslice(self):
+        """Shows the spectrum of the selected time window, summed from the stored slices."""
+        if not self.slice_duration or self.filepath is None:
+            return
+        t0, t1 = self.time_region.getRegion()
+        start = int(np.floor(t0 / self.slice_duration + 0.5))
+        stop = int(np.floor(t1 / self.slice_duration + 0.5))
+        with h5py.File(self.filepath, 'r') as f:
+            self.y = window_spectrum(f['measurement/pulse_height_analyzer/spectrogram'], start, stop)
+        self.bar_item.setOpts(height=self.y)
+        self.plot.setTitle(f"Pulse Height Histogram, {start * self.slice_duration:g} - "
+                           f"{stop * self.slice_duration:g} s")
+        self.fit_peaks(self.x[1] - self.x[0])
+
+    def fit_peaks(self, bin_width):
+        """Fits the strongest peaks, draws the fits and lists them under the metadata."""
+        # run settings give the expected FWHM in V if present, 0.05 V otherwise
+        fwhm_bins = max(self.peak_fwhm_setting() / bin_width, 1.5)
+        if self.peak_fitter.fwhm_bins != fwhm_bins:
+            self.peak_fitter = PeakFitter(fwhm_bins=fwhm_bins)
+        try:
+            self.peak_results = self.peak_fitter.fit(self.y, self.x)
+        except ImportError as e:
+            print(f"Peak fit skipped: {e}")
+            self.peak_results = []
+            return
+
+        for item in self.fit_items:
+            self.plot.removeItem(item)
+        self.fit_items = []
+        for result in self.peak_results:
+            x = np.linspace(*result.fit_range, 200)
+            self.fit_items.append(self.plot.plot(x, result.curve(x), pen=pg.mkPen('r', width=2)))
+
+        calibration = EnergyCalibration.load(self.calibration_file)
+        table = peak_table(self.peak_results, calibration)
+        lines = ["", "Peaks:"]
+        for i in range(len(table['centroid'])):
+            line = (f"{i}: {table['centroid'][i]:.4f} +- {table['centroid_error'][i]:.2g} V, "
+                    f"FWHM {100 * table['fwhm'][i] / table['centroid'][i]:.2f} %, net {table['area'][i]:.0f}")
+            if 'energy' in table:
+                line += f", {table['energy'][i]:.1f} keV"
+            lines.append(line)
+        self.metadata_box.setPlainText(self.settings_text + "\n".join(lines))
+
+    def peak_fwhm_setting(self):
+        for line in self.metadata_box.toPlainText().splitlines():
+            if line.startswith("peak_fwhm"):
+                try:
+                    return float(line.split(":", 1)[1])
+                except ValueError:
+                    break
+        return 0.05
+
+    def calibrate_energy(self):
+        """Assigns known energies to the fitted peaks and saves the calibration."""
+        table = peak_table(self.peak_results)
+        if len(table['centroid']) == 0:
+            return
+        peaks = ", ".join(f"{i}: {c:.4f} V" for i, c in enumerate(table['centroid']))
+        text, ok = QtWidgets.QInputDialog.getText(
+            self.ui, "Energy Calibration",
+            f"Peaks {peaks}\nEnergies in keV, comma separated in peak order (blank to skip a peak):")
+        if not ok:
+            return
+        # the peaks of this file replace the saved calibration, points of earlier files are not mixed in
+        calibration = EnergyCalibration()
+        try:
+            for centroid, energy in zip(table['centroid'], text.split(",")):
+                if energy.strip():
+                    calibration.add_point(centroid, float(energy))
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self.ui, "Energy Calibration", f"Calibration not saved: {e}")
+            return
+        if not calibration.points:
+            return
+        calibration.save(self.calibration_file)
+        print(f"energy calibration {calibration.coefficients} saved to {self.calibration_file}")
+        self.load_data(self.filepath)
 
     def export_csv(self):
-        if self.x is None or self.y is None or self.raw_data is None:
+        if self.x is None or self.y is None or not self.has_raw_data:
             return
 
         base = os.path.splitext(os.path.basename(self.filepath))[0]
@@ -122,59 +247,27 @@ class PulseHeightDataBrowser(DataBrowserView):
         default_csv_path2 = os.path.join(os.path.dirname(self.filepath), base + "_raw_data.csv")
 
         fname, _ = QtWidgets.QFileDialog.getSaveFileName(
-            self.ui, "Save Histogram CSV", default_csv_path, "CSV files (*.csv)")
+            self.ui, "Save Histogram CSV", default_csv_path, "CSV files (*.csv);;Parquet files (*.parquet)")
         
         fname2, _ = QtWidgets.QFileDialog.getSaveFileName(
-            self.ui, "Save Raw Data CSV", default_csv_path2, "CSV files (*.csv)"
+            self.ui, "Save Raw Data CSV", default_csv_path2, "CSV files (*.csv);;Parquet files (*.parquet)"
         )
 
         print(f'saving to {fname} and {fname2}')
 
-        # add provenance info
-        provenance_lines = [
-            f"source_file: {os.path.basename(self.filepath)}",
-            f"export_timestamp: {datetime.datetime.now().isoformat(timespec='seconds')}"
-        ]
-
-        # grab metadata lines
-        meta_text = self.metadata_box.toPlainText().splitlines()
+        # provenance info followed by the metadata lines as commented header
+        header_lines = provenance_lines(self.filepath) + self.metadata_box.toPlainText().splitlines()
 
-        # ---- HISTOGRAM CSV WITH METADATA HEADER ----
+        jobs = []
         if fname:
             x_mid = 0.5 * (self.x[:-1] + self.x[1:])
-            with open(fname, 'w', newline='') as f:
-                writer = csv.writer(f)
-
-                #add original filepath, datetime
-                for line in provenance_lines:
-                    writer.writerow([f"# {line}"])
-
-                # write metadata as commented header
-                for line in meta_text:
-                    writer.writerow([f"# {line}"])
-                writer.writerow([])  # blank line
-
-                # histogram data
-                writer.writerow(['x_mid', 'count'])
-                writer.writerows(zip(x_mid, self.y))
-        
-        # ---- RAW DATA CSV WITH METADATA HEADER ----
+            jobs.append(dict(source=self.filepath, out_path=fname, header_lines=header_lines,
+                             columns={'x_mid': x_mid, 'count': self.y}))
         if fname2:
-            with open(fname2, 'w', newline='') as f:
-                writer = csv.writer(f)
-
-                #add original filepath, datetime
-                for line in provenance_lines:
-                    writer.writerow([f"# {line}"])
-
-                # write metadata as commented header
-                for line in meta_text:
-                    writer.writerow([f"# {line}"])
-                writer.writerow([])  # blank line
-
-                # raw data values
-                writer.writerow(['pulse_height'])
-                writer.writerows(zip(self.raw_data))
+            jobs.append(dict(source=self.filepath, out_path=fname2, header_lines=header_lines,
+                             columns={'pulse_height': 'measurement/pulse_height_analyzer/raw_values'}))
+        if jobs:
+            self.export_worker = start_export(self.ui, jobs)
 
     def is_file_supported(self, fname):
         print(f"Checking if file is supported: {fname}")
@@ -1,12 +1,13 @@
 import numpy as np
 import h5py
 import pyqtgraph as pg
-from qtpy import QtWidgets
+from qtpy import QtCore, QtWidgets
 from ScopeFoundry.data_browser import DataBrowserView
-import csv
-import datetime
 import os
 
+from analysis.decimation import TracePyramid
+from data_browser_plugins.chunked_export import provenance_lines, start_export
+
 class ScopeReadDataBrowser(DataBrowserView):
     
     name = 'scope_read_data_browser'
@@ -22,6 +23,13 @@ class ScopeReadDataBrowser(DataBrowserView):
         self.plot_lines = {"y": self.plot.plot(pen="g")}
         main_layout.addWidget(self.graph_layout)
 
+        # only re-read the file once the user stops zooming/panning
+        self.view_timer = QtCore.QTimer()
+        self.view_timer.setSingleShot(True)
+        self.view_timer.setInterval(50)
+        self.view_timer.timeout.connect(self.refresh_view)
+        self.plot.sigXRangeChanged.connect(self.view_timer.start)
+
         # Horizontal layout for metadata + buttons
         lower_layout = QtWidgets.QHBoxLayout()
         main_layout.addLayout(lower_layout)
@@ -41,8 +49,7 @@ class ScopeReadDataBrowser(DataBrowserView):
         button_layout.addStretch()
         lower_layout.addLayout(button_layout)
 
-        self.x = None
-        self.y = None
+        self.pyramid = None
         self.filepath = None
 
     def on_change_data_filename(self, fname=None):
@@ -55,19 +62,13 @@ class ScopeReadDataBrowser(DataBrowserView):
         self.filepath = filepath
         self.metadata_box.clear()
         self.plot_lines["y"].setData([])
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid = None
 
         with h5py.File(filepath, 'r') as f:
             try:
                 group = f['measurement/read_scope']
-                self.y = group['y'][()]
-                print("Loaded y shape:", self.y.shape)
-
-                try:
-                    self.x = group['x'][()]
-                    print("Loaded x shape:", self.x.shape)
-                except KeyError:
-                    self.x = np.arange(len(self.y))
-                    print("Generated x:", self.x.shape)
 
                 # Metadata
                 if 'settings' in group:
@@ -96,48 +97,50 @@ class ScopeReadDataBrowser(DataBrowserView):
                 print("Failed to load data:", e)
                 return
 
-        if self.x is not None and self.y is not None:
-            self.plot_lines["y"].setData(x=self.x, y=self.y)
+        # x and y are not loaded, only the decimation level needed for the view is read
+        try:
+            self.pyramid = TracePyramid(filepath, 'measurement/read_scope').open()
+            print("Trace length:", self.pyramid.length, "levels:", self.pyramid.n_levels)
+        except Exception as e:
+            print("Failed to load data:", e)
+            self.pyramid = None
+            return
+
+        x, y = self.pyramid.view()
+        if len(x):
+            self.plot.setXRange(x[0], x[-1], padding=0)
+        self.plot_lines["y"].setData(x=x, y=y)
+
+    def refresh_view(self):
+        if self.pyramid is None:
+            return
+        x0, x1 = self.plot.viewRange()[0]
+        max_points = max(int(self.plot.vb.width()), 1000)
+        x, y = self.pyramid.view(x0, x1, max_points=max_points)
+        self.plot_lines["y"].setData(x=x, y=y)
 
     def export_csv(self):
-        if self.x is None or self.y is None:
+        if self.pyramid is None:
             return
 
         base = os.path.splitext(os.path.basename(self.filepath))[0]
         default_csv_path = os.path.join(os.path.dirname(self.filepath), base + "_scope_trace.csv")
 
         fname, _ = QtWidgets.QFileDialog.getSaveFileName(
-            self.ui, "Save CSV", default_csv_path, "CSV files (*.csv)")
+            self.ui, "Save CSV", default_csv_path, "CSV files (*.csv);;Parquet files (*.parquet)")
 
         print(f'saving to {fname}')
 
-        # add provenance info
-        provenance_lines = [
-            f"source_file: {os.path.basename(self.filepath)}",
-            f"export_timestamp: {datetime.datetime.now().isoformat(timespec='seconds')}"
-        ]
-
-        # grab metadata lines
-        meta_text = self.metadata_box.toPlainText().splitlines()
+        # provenance info followed by the metadata lines as commented header
+        header_lines = provenance_lines(self.filepath) + self.metadata_box.toPlainText().splitlines()
 
-        # ---- HISTOGRAM CSV WITH METADATA HEADER ----
         if fname:
-            with open(fname, 'w', newline='') as f:
-                writer = csv.writer(f)
-
-                #add original filepath, datetime
-                for line in provenance_lines:
-                    writer.writerow([f"# {line}"])
-
-                # write metadata as commented header
-                for line in meta_text:
-                    writer.writerow([f"# {line}"])
-                writer.writerow([])  # blank line
-
-                # histogram data and raw height data
-                writer.writerow(['x', 'y'])
-                export_data = zip(self.x, self.y)
-                writer.writerows(export_data)
+            columns = {'y': 'measurement/read_scope/y'}
+            if self.pyramid.x is not None:
+                columns = {'x': 'measurement/read_scope/x', **columns}
+            job = dict(source=self.filepath, out_path=fname, header_lines=header_lines,
+                       columns=columns, n=self.pyramid.length)
+            self.export_worker = start_export(self.ui, [job])
     
     def is_file_supported(self, fname):
         print(f"Checking if file is supported: {fname}")
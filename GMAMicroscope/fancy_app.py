@@ -14,12 +14,26 @@ class FancyApp(BaseMicroscopeApp):
         from ScopeFoundryHW.ADS import ADSHardware
         self.add_hardware(ADSHardware(self))
 
+        # acquisition sources are added before the measurements, which list them as choices
+        from ScopeFoundryHW.simulated_digitizer import SimulatedDigitizerHW
+        self.add_hardware(SimulatedDigitizerHW(self))
+
         from measurements.pulse_height import PulseHeightAnalyze
         self.add_measurement(PulseHeightAnalyze(self))
 
         from measurements.scope_read import ScopeRead
         self.add_measurement(ScopeRead(self))
 
+        from measurements.noise_spectrum import NoiseSpectrum
+        self.add_measurement(NoiseSpectrum(self))
+
+        from measurements.pulser_calibration import PulserCalibration
+        self.add_measurement(PulserCalibration(self))
+
+        # runs sequencer plans of the measurements above, added last
+        from measurements.sweep_plan import PlanSequencer
+        self.add_measurement(PlanSequencer(self))
+
 if __name__ == "__main__":
     app = FancyApp(sys.argv)
     app.settings_load_ini("default_settings.ini")
@@ -1,6 +1,7 @@
 import sys
 import os
 import numpy as np
+import h5py
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog,
     QSpinBox, QDoubleSpinBox, QLabel, QHBoxLayout
@@ -11,15 +12,105 @@ matplotlib.use("Qt5Agg")
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from analysis.histogram import IncrementalHistogram
+
+# files with these extensions are read as append-only little-endian float32
+BINARY_EXTENSIONS = (".f32", ".bin")
+# pulse heights written by PulseHeightAnalyze with swmr_stream enabled
+H5_EVENTS_PATH = "measurement/pulse_height_analyzer/raw_values"
+
+
+def parse_text_block(block):
+    """Parses whitespace separated numbers with NumPy, skipping lines that are not numbers."""
+    try:
+        return np.array(block.split(), dtype=float)
+    except ValueError:
+        values = []
+        for line in block.splitlines():
+            try:
+                values.append(float(line.strip()))
+            except ValueError:
+                continue  # skip bad lines
+        return np.array(values, dtype=float)
+
+
+class TextTailReader:
+    """Returns the values appended to a text file (one number per line) since the last call."""
+
+    def __init__(self, filepath):
+        self.file = open(filepath, "rb")
+        self.pending = b""
+
+    def read_new(self):
+        block = self.pending + self.file.read()
+        # keep an incomplete last line for the next call
+        end = block.rfind(b"\n") + 1
+        self.pending = block[end:]
+        return parse_text_block(block[:end])
+
+    def skip_to_end(self):
+        self.file.seek(0, os.SEEK_END)
+        self.pending = b""
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryTailReader(TextTailReader):
+    """Returns the float32 values appended to a binary file since the last call."""
+
+    dtype = np.dtype("<f4")
+
+    def read_new(self):
+        block = self.pending + self.file.read()
+        # keep a partially written value for the next call
+        end = len(block) - len(block) % self.dtype.itemsize
+        self.pending = block[end:]
+        return np.frombuffer(block[:end], dtype=self.dtype)
+
+
+class H5TailReader:
+    """Follows a growing event dataset of an h5 file that is being written in SWMR mode.
+
+    Only the slice appended since the last call is read.
+    """
+
+    def __init__(self, filepath, dataset_path=H5_EVENTS_PATH):
+        try:
+            self.file = h5py.File(filepath, "r", libver="latest", swmr=True)
+        except (OSError, ValueError):
+            # finished (non SWMR) file, nothing will be appended
+            self.file = h5py.File(filepath, "r")
+        self.dset = self.file[dataset_path]
+        self.position = 0
+
+    def read_new(self):
+        if self.file.swmr_mode:
+            self.dset.refresh()
+        n = self.dset.shape[0]
+        new = self.dset[self.position:n]
+        self.position = n
+        return new
+
+    def skip_to_end(self):
+        if self.file.swmr_mode:
+            self.dset.refresh()
+        self.position = self.dset.shape[0]
+
+    def close(self):
+        self.file.close()
+
 
 class LiveHistogram(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Live Histogram Viewer")
         self.filepath = None
-        self.file = None
-        self.file_position = 0
-        self.data = []
+        self.reader = None
+        # all values read so far, kept to re-bin when bins/min/max change
+        self.values = np.empty(1 << 16, dtype=np.float32)
+        self.n_values = 0
+        self.hist = None
 
         # Layout
         layout = QVBoxLayout()
@@ -63,12 +154,22 @@ class LiveHistogram(QWidget):
         self.count_label = QLabel("N points: 0")
         layout.addWidget(self.count_label)
 
-        # Matplotlib figure
+        # Matplotlib figure, the histogram artist is created once and only updated
         self.figure = Figure()
         self.canvas = FigureCanvas(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_title("Pulse Height Analyzer")
+        self.ax.set_xlabel("Voltage (V)")
+        self.ax.set_ylabel("Counts")
+        self.step = self.ax.stairs([0], [0, 1], color="blue", fill=True)
         layout.addWidget(self.canvas)
 
         self.setLayout(layout)
+        self.rebin()
+
+        self.bin_input.valueChanged.connect(self.rebin)
+        self.min_input.valueChanged.connect(self.rebin)
+        self.max_input.valueChanged.connect(self.rebin)
 
         # Timer for live update
         self.timer = QTimer()
@@ -79,69 +180,71 @@ class LiveHistogram(QWidget):
         path, _ = QFileDialog.getOpenFileName(self, "Select Data File", "", "All Files (*)")
         if path:
             self.filepath = path
-            if self.file:
-                self.file.close()
-            self.file = open(self.filepath, "r")
-            self.file_position = 0
-            self.data = []
-            self.update_count_label()
+            if self.reader:
+                self.reader.close()
+            if path.lower().endswith(".h5"):
+                self.reader = H5TailReader(path)
+            elif path.lower().endswith(BINARY_EXTENSIONS):
+                self.reader = BinaryTailReader(path)
+            else:
+                self.reader = TextTailReader(path)
+            self.n_values = 0
+            self.rebin()
 
     def reset_data(self):
         """Clear stored data and reset histogram."""
-        self.data = []
-        self.file_position = self.file.tell() if self.file else 0
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-        ax.set_title("Live Histogram (reset)")
-        ax.set_xlabel("Value")
-        ax.set_ylabel("Frequency")
-        self.canvas.draw()
-        self.update_count_label()
-    
+        self.n_values = 0
+        if self.reader:
+            self.reader.skip_to_end()
+        self.rebin()
+        self.ax.set_title("Live Histogram (reset)")
+        self.canvas.draw_idle()
+
     def update_count_label(self):
-        self.count_label.setText(f"N points: {len(self.data)}")
+        self.count_label.setText(f"N points: {self.n_values}")
+
+    def append_values(self, new_data):
+        needed = self.n_values + new_data.size
+        if needed > self.values.size:
+            grown = np.empty(max(needed, 2 * self.values.size), dtype=self.values.dtype)
+            grown[:self.n_values] = self.values[:self.n_values]
+            self.values = grown
+        self.values[self.n_values:needed] = new_data
+        self.n_values = needed
+
+    def rebin(self):
+        """Rebuilds the histogram from the stored values with the current bins/min/max."""
+        vmin = self.min_input.value()
+        vmax = self.max_input.value()
+        if vmax <= vmin:
+            return
+        self.hist = IncrementalHistogram(self.bin_input.value(), vmin, vmax)
+        self.hist.add(self.values[:self.n_values])
+        self.draw_histogram()
+
+    def draw_histogram(self):
+        self.step.set_data(self.hist.counts, self.hist.edges)
+        self.ax.set_xlim(self.hist.vmin, self.hist.vmax)
+        self.ax.set_ylim(0, max(1, self.hist.counts.max()) * 1.05)
+        self.canvas.draw_idle()
+        self.update_count_label()
 
     def update_plot(self):
-        if not self.file:
+        if not self.reader:
             return
 
         try:
-            # Seek to last read position
-            self.file.seek(self.file_position)
-            new_lines = self.file.readlines()
-            self.file_position = self.file.tell()
-
-            # Convert new lines to floats
-            new_data = []
-            for line in new_lines:
-                try:
-                    new_data.append(float(line.strip()))
-                except ValueError:
-                    continue  # skip bad lines
-
-            if new_data:
-                self.data.extend(new_data)
-                self.update_count_label()
-
+            new_data = self.reader.read_new()
         except Exception as e:
             print(f"Error reading file: {e}")
             return
 
-        if not self.data:
+        if new_data.size == 0:
             return
 
-        bins = self.bin_input.value()
-        vmin = self.min_input.value()
-        vmax = self.max_input.value()
-
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-        ax.hist(self.data, bins=bins, range=(vmin, vmax),
-                color="blue", edgecolor="blue")
-        ax.set_title("Pulse Height Analyzer")
-        ax.set_xlabel("Voltage (V)")
-        ax.set_ylabel("Counts")
-        self.canvas.draw()
+        self.append_values(new_data)
+        self.hist.add(new_data)
+        self.draw_histogram()
 
 
 if __name__ == "__main__":
@@ -149,4 +252,4 @@ if __name__ == "__main__":
     window = LiveHistogram()
     window.resize(800, 600)
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
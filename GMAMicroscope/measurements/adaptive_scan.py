@@ -0,0 +1,139 @@
+import time
+import traceback
+
+import numpy as np
+
+from analysis.quadtree import QuadtreeRefiner
+from measurements.h5_stream import AppendableDataset
+
+
+class AdaptiveRaster2DScan:
+    """Adaptive (sparse-then-refine) mode for BaseRaster2DSlowScanV2 scans.
+
+    With 'adaptive' on, run() does not scan the full raster: a coarse pass
+    every coarse_step pixels comes first, then each pass halves the step and
+    only measures inside the cells whose corner values reach value_threshold or
+    spread by more than gradient_threshold (see analysis.quadtree). The scan's
+    own collect_pixel() measures every point, the value used for refinement is
+    what it puts into display_image_map. Between passes the display shows the
+    interpolated image.
+
+    The points go to the sparse h5 group 'adaptive' (coords (j, i), positions
+    (h, v), values, pass_index, pixel_time; one append per pass) and the
+    interpolated image to 'interpolated_map'. pixel_num counts the measured
+    points in order, so per-pixel datasets of collect_pixel stay dense.
+    """
+
+    def scan_specific_setup(self):
+        super().scan_specific_setup()
+        S = self.settings
+        S.New("adaptive", bool, initial=False, description="coarse pass, then refine where the signal is")
+        S.New("coarse_step", int, initial=8, vmin=1, description="pixels between coarse points, power of 2")
+        S.New("value_threshold", float, initial=0.5, description="refine cells with a corner at or above")
+        S.New("gradient_threshold", float, initial=0.1,
+              description="refine cells whose corner values spread more than this")
+        S.New("adaptive_fraction", float, initial=0.0, ro=True,
+              description="measured points / raster pixels of the last adaptive scan")
+
+    def run(self):
+        if not self.settings["adaptive"]:
+            return super().run()
+
+        S = self.settings
+        self.compute_scan_arrays()
+        self.initial_scan_setup_plotting = True
+        self.display_image_map = np.nan * np.zeros(self.scan_shape, dtype=float)
+
+        while not self.interrupt_measurement_called:
+            try:
+                self.t0 = time.time()
+                if S["save_h5"]:
+                    H = self.open_new_h5_file()
+                    self.h5_filename = self.h5_file.filename
+                    H["h_array"] = self.h_array
+                    H["v_array"] = self.v_array
+                    H["range_extent"] = self.range_extent
+                    H["corners"] = self.corners
+                    H["imshow_extent"] = self.imshow_extent
+                    self.setup_sparse_h5(H)
+
+                self.pixel_i = 0
+                self.current_scan_index = self.scan_index_array[0]
+                self.pixel_time = np.zeros(self.scan_shape, dtype=float)
+                self.refiner = QuadtreeRefiner(
+                    self.scan_shape[1:], S["coarse_step"], S["value_threshold"], S["gradient_threshold"]
+                )
+                self.pre_scan_setup()
+                self.scan_passes()
+            except Exception as err:
+                self.last_err = err
+                self.log.error("Failed to Scan {}".format(repr(err)))
+                traceback.print_exc()
+            finally:
+                self.post_scan_cleanup()
+                if S["save_h5"] and hasattr(self, "refiner"):
+                    self.h5_meas_group["interpolated_map"] = self.refiner.render()[None]
+                if hasattr(self, "h5_file"):
+                    try:
+                        self.h5_file.close()
+                    except ValueError as err:
+                        self.log.warning("failed to close h5_file: {}".format(err))
+                if not S["continuous_scan"]:
+                    break
+        print(self.name, "done")
+
+    def scan_passes(self):
+        refiner = self.refiner
+        j, i = refiner.first_pass()
+        prev = None
+        while len(j) and not self.interrupt_measurement_called:
+            done = 0
+            for jj, ii in zip(j, i):
+                if self.interrupt_measurement_called:
+                    break
+                h, v = self.h_array[ii], self.v_array[jj]
+                if prev is None:
+                    self.move_position_start(h, v)
+                elif jj != prev[0]:
+                    self.move_position_slow(h, v, h - self.h_array[prev[1]], v - self.v_array[prev[0]])
+                else:
+                    self.move_position_fast(h, v, h - self.h_array[prev[1]], v - self.v_array[prev[0]])
+                prev = (jj, ii)
+                self.pos = (h, v)
+                self.current_scan_index = (0, jj, ii)
+                self.pixel_time[0, jj, ii] = time.time()
+                self.collect_pixel(self.pixel_i, 0, jj, ii)
+                self.pixel_i += 1
+                done += 1
+
+            j, i = j[:done], i[:done]
+            values = self.display_image_map[0, j, i]
+            refiner.add(j, i, values)
+            if self.settings["save_h5"]:
+                self.save_pass(j, i, values, refiner.n_pass)
+            self.display_image_map[0] = refiner.render()
+            self.settings["adaptive_fraction"] = self.pixel_i / self.Npixels
+            self.set_progress(100.0 * refiner.n_pass / refiner.n_passes)
+            j, i = refiner.next_pass()
+
+    def setup_sparse_h5(self, H):
+        S = self.settings
+        G = H.create_group("adaptive")
+        for name in ("coarse_step", "value_threshold", "gradient_threshold"):
+            G.attrs[name] = S[name]
+        G.attrs["shape"] = self.scan_shape
+        self.sparse_h5 = {
+            "coords": AppendableDataset(G, "coords", row_shape=(2,), dtype=int),
+            "positions": AppendableDataset(G, "positions", row_shape=(2,), dtype=float),
+            "values": AppendableDataset(G, "values", dtype=float),
+            "pass_index": AppendableDataset(G, "pass_index", dtype=int),
+            "pixel_time": AppendableDataset(G, "pixel_time", dtype=float),
+        }
+
+    def save_pass(self, j, i, values, n_pass):
+        D = self.sparse_h5
+        D["coords"].append(np.column_stack([j, i]))
+        D["positions"].append(np.column_stack([self.h_array[i], self.v_array[j]]))
+        D["values"].append(values)
+        D["pass_index"].append(np.full(len(j), n_pass))
+        D["pixel_time"].append(self.pixel_time[0, j, i])
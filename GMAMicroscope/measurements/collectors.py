@@ -1,13 +1,24 @@
 # required for Sweep4d example
 
 
+import numpy as np
+
 from ScopeFoundry import Collector
 
 
 class Noiser200Collector(Collector):
     name = "noiser200"
-    repeated_dset_names = ("signals",)
-    acquisition_duration_path = "mm/noiser200/capture_duration"
+    # signals is the mean; run() narrows this to what the settings produce,
+    # so every declared dataset is filled at every point with the same shape
+    repeated_dset_names = ("signals", "signal_std", "counts", "raw")
+    acquisition_duration_path = "hw/noiser_200/int_time"
+
+    def setup(self):
+        self.settings.New("integrate", bool, initial=True,
+                          description="read a block of samples over int_time per point, "
+                                      "off: one signal reading per point")
+        self.settings.New("keep_raw", bool, initial=False, description="also store every sample")
+        self.block = np.zeros(0)
 
     def run(
         self,
@@ -20,6 +31,41 @@ class Noiser200Collector(Collector):
         **kwargs
     ):
         # needs to define self.data with reapated_dset_names
-        self.data["signals"] = self.app.get_lq(
-            "hw/noiser_200/signal"
-        ).read_from_hardware()
+        if not self.settings["integrate"]:
+            self.repeated_dset_names = ("signals",)
+            self.data = {"signals": self.app.get_lq("hw/noiser_200/signal").read_from_hardware()}
+            return
+        keep_raw = self.settings["keep_raw"]
+        self.repeated_dset_names = ("signals", "signal_std", "counts") + (("raw",) if keep_raw else ())
+
+        hw = self.app.hardware["noiser_200"]
+        if int_time is None:
+            int_time = hw.settings["int_time"]
+        n = max(1, int(round(int_time * hw.settings["sample_rate"])))
+        if self.block.size != n:
+            self.block = np.zeros(n)
+
+        # block reads of about polling_time each, polling in between
+        step = max(1, int(polling_time * hw.settings["sample_rate"]))
+        filled = 0
+        while filled < n:
+            filled += hw.read_block(self.block[filled:filled + step]).size
+            if polling_func is not None:
+                polling_func()
+            if host_measurement.interrupt_measurement_called:
+                break
+
+        # an interrupted point only reduces the samples read so far
+        samples = self.block[:filled]
+        mean = samples.mean()
+        self.data = {
+            "signals": mean,
+            "signal_std": samples.std(ddof=1) if filled > 1 else 0.0,
+            "counts": filled,
+        }
+        if keep_raw:
+            # always n long, samples not read on an interrupted point are nan
+            raw = np.full(n, np.nan)
+            raw[:filled] = samples
+            self.data["raw"] = raw
+        hw.settings["signal"] = mean
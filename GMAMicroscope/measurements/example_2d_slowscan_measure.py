@@ -1,18 +1,26 @@
-from ScopeFoundry import HardwareComponent
 from ScopeFoundry.scanning import BaseRaster2DSlowScanV2
 
+from measurements.adaptive_scan import AdaptiveRaster2DScan
+from measurements.h5_stream import WriteBehindMap
+from measurements.parallel_pixels import ParallelDetectorScan
 
-class Example2DSlowScanMeasure(BaseRaster2DSlowScanV2):
+
+class Example2DSlowScanMeasure(AdaptiveRaster2DScan, ParallelDetectorScan, BaseRaster2DSlowScanV2):
 
     name = "example_2d_scan"
 
-    def scan_specific_setup(self):
-        self.detector: HardwareComponent = self.app.hardware["noiser_200"]
+    def setup_detectors(self):
+        # all detectors are read in parallel, add more with add_detector
+        self.detector = self.app.hardware["noiser_200"]
+        self.pixels.add_detector("noiser_200", self.detector.settings.get_lq("signal").read_from_hardware)
 
     def pre_scan_setup(self):
-        if self.settings["save_h5"]:
-            self.signal_map = self.h5_meas_group.create_dataset(
-                name="signal_map", shape=self.scan_shape, dtype=float
+        super().pre_scan_setup()
+        # adaptive scans are stored sparse, see AdaptiveRaster2DScan
+        if self.settings["save_h5"] and not self.settings["adaptive"]:
+            # pixels are collected per line and written from a background thread
+            self.signal_map = WriteBehindMap(
+                self.h5_meas_group, "signal_map", shape=self.scan_shape, dtype=float
             )
 
     # def setup_figure(self):
@@ -24,7 +32,13 @@ class Example2DSlowScanMeasure(BaseRaster2DSlowScanV2):
     #     )
 
     def collect_pixel(self, pixel_num, k, j, i):
-        signal = self.detector.settings.get_lq("signal").read_from_hardware()
-        self.display_image_map[k, j, i] = signal
-        if self.settings["save_h5"]:
-            self.signal_map[k, j, i] = signal
+        record = super().collect_pixel(pixel_num, k, j, i)
+        if hasattr(self, "signal_map"):
+            self.signal_map[k, j, i] = record["noiser_200"]
+
+    def post_scan_cleanup(self):
+        # also runs on interrupt, before the file is closed
+        super().post_scan_cleanup()
+        if hasattr(self, "signal_map"):
+            self.signal_map.close()
+            del self.signal_map
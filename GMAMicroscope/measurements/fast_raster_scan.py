@@ -0,0 +1,181 @@
+import time
+
+import numpy as np
+
+from ScopeFoundry.scanning.base_raster_scan import BaseRaster2DScan, BaseRaster3DScan
+
+from analysis.line_scan import TRAJECTORIES, bin_line, line_trajectory, split_lines
+
+
+class HardwareTimedLineScan:
+    """Run loop shared by the fast 2D and 3D raster scans.
+
+    Instead of moving the stage and reading the detector once per pixel, every
+    scan line is sent to the scanner hardware as one buffered output waveform
+    (the stage trajectory) while the detector inputs are sampled on the same
+    clock. The samples of a line come back as one array and are averaged into
+    pixels with numpy, so there is no Python round trip per pixel.
+
+    The scanner is a hardware component with
+        setup_line_scan(n_samples, rate) -> actual rate
+        scan_line(trajectory, out=None) -> (n_channels, n_samples) samples
+        end_line_scan()
+    e.g. NIDAQHardware (AO trajectory, AI on the AO sample clock).
+    """
+
+    axes = ("h", "v")
+
+    def scan_specific_setup(self):
+        S = self.settings
+        S.New("scanner", str, initial="ni_dac", description="hardware that outputs the lines")
+        S.New("samples_per_pixel", int, initial=10, vmin=1)
+        S.New("settle_samples", int, initial=2, vmin=0,
+              description="samples dropped at the start of every pixel")
+        S.New("lead_in_samples", int, initial=50, vmin=0,
+              description="fly back samples before every line, not recorded")
+        S.New("trajectory", str, initial="step", choices=TRAJECTORIES)
+        for axis in self.axes:
+            S.New(f"{axis}_volts_per_unit", float, initial=1.0, unit="V")
+            S.New(f"{axis}_offset", float, initial=0.0, unit="V")
+        S.New("line_rate", float, initial=0.0, unit="Hz", ro=True)
+        # here the pixel time sets the sample clock
+        S.get_lq("pixel_time").change_readonly(False)
+        S["pixel_time"] = 1e-3
+
+    def scan_positions(self):
+        """(Npixels, n_axes) positions in scan units."""
+        return np.column_stack([self.scan_h_positions, self.scan_v_positions])
+
+    def output_positions(self):
+        """(Npixels, n_axes) scanner output voltages."""
+        S = self.settings
+        scale = np.array([S[f"{axis}_volts_per_unit"] for axis in self.axes])
+        offset = np.array([S[f"{axis}_offset"] for axis in self.axes])
+        return self.scan_positions() * scale + offset
+
+    def h5_scan_arrays(self):
+        return {
+            "h_array": self.h_array,
+            "v_array": self.v_array,
+            "range_extent": self.range_extent,
+            "corners": self.corners,
+            "imshow_extent": self.imshow_extent,
+            "scan_h_positions": self.scan_h_positions,
+            "scan_v_positions": self.scan_v_positions,
+            "scan_slow_move": self.scan_slow_move,
+            "scan_index_array": self.scan_index_array,
+        }
+
+    def run(self):
+        S = self.settings
+        scanner = self.app.hardware[S["scanner"]]
+        self.compute_scan_arrays()
+        self.initial_scan_setup_plotting = True
+        self.display_image_map = np.nan * np.zeros(self.scan_shape, dtype=float)
+
+        while not self.interrupt_measurement_called:
+            try:
+                self.t0 = time.time()
+                if S["save_h5"]:
+                    H = self.open_new_h5_file()
+                    for name, value in self.h5_scan_arrays().items():
+                        H[name] = value
+                self.signal_map = None
+                self.pixel_time = np.zeros(self.scan_shape, dtype=float)
+                self.pre_scan_setup()
+                self.scan_lines(scanner)
+            finally:
+                scanner.end_line_scan()
+                self.post_scan_cleanup()
+                self.close_h5_file()
+            if not S["continuous_scan"]:
+                break
+        print(self.name, "done")
+
+    def scan_lines(self, scanner):
+        S = self.settings
+        spp = S["samples_per_pixel"]
+        lead_in = S["lead_in_samples"]
+        if S["settle_samples"] >= spp:
+            raise ValueError(f"settle_samples ({S['settle_samples']}) has to be less than "
+                             f"samples_per_pixel ({spp}), no samples would be left to average")
+        rate = spp / S["pixel_time"]
+        positions = self.output_positions()
+        lines = split_lines(self.scan_slow_move)
+
+        prepared = None
+        samples = None
+        previous = None
+        t_last = time.time()
+        for n_line, (first, stop) in enumerate(lines):
+            if self.interrupt_measurement_called:
+                break
+            trajectory = line_trajectory(positions[first:stop], spp, lead_in, previous, S["trajectory"])
+            previous = trajectory[-1]
+            if len(trajectory) != prepared:
+                # lines of an ortho scan differ in length, re-arm for each length
+                rate = scanner.setup_line_scan(len(trajectory), rate)
+                prepared = len(trajectory)
+                samples = None
+            t_line = time.time()
+            samples = scanner.scan_line(trajectory, out=samples)
+
+            pixels = np.atleast_2d(bin_line(samples, stop - first, spp, lead_in, S["settle_samples"]))
+            kk, jj, ii = self.scan_index_array[first:stop].T
+            if self.signal_map is None:
+                self.setup_signal_map(len(pixels))
+            self.signal_map[:, kk, jj, ii] = pixels
+            self.display_image_map[kk, jj, ii] = pixels[0]
+            self.pixel_time[kk, jj, ii] = t_line + (lead_in + spp * np.arange(stop - first)) / rate
+            self.pixel_i = stop
+            self.current_scan_index = self.scan_index_array[stop - 1]
+            if S["save_h5"]:
+                self.save_line(kk, jj, ii)
+
+            now = time.time()
+            S["line_rate"] = 1 / max(now - t_last, 1e-9)
+            t_last = now
+            self.set_progress(100.0 * (n_line + 1) / len(lines))
+
+    def setup_signal_map(self, n_channels):
+        self.signal_map = np.nan * np.zeros((n_channels, *self.scan_shape), dtype=float)
+        if self.settings["save_h5"]:
+            self.signal_map_h5 = self.h5_meas_group.create_dataset(
+                name="signal_map", shape=self.signal_map.shape, dtype=float
+            )
+            self.pixel_time_h5 = self.h5_meas_group.create_dataset(
+                name="pixel_time", shape=self.scan_shape, dtype=float
+            )
+
+    def save_line(self, kk, jj, ii):
+        """Writes the block of the maps a line touched, one h5 write per line."""
+        block = tuple(slice(idx.min(), idx.max() + 1) for idx in (kk, jj, ii))
+        self.signal_map_h5[(slice(None), *block)] = self.signal_map[(slice(None), *block)]
+        self.pixel_time_h5[block] = self.pixel_time[block]
+
+    def pre_scan_setup(self):
+        pass
+
+    def post_scan_cleanup(self):
+        pass
+
+
+class FastRaster2DScan(HardwareTimedLineScan, BaseRaster2DScan):
+
+    name = "fast_raster_2d_scan"
+
+
+class FastRaster3DScan(HardwareTimedLineScan, BaseRaster3DScan):
+
+    name = "fast_raster_3d_scan"
+
+    axes = ("h", "v", "z")
+
+    def scan_positions(self):
+        return np.column_stack([self.scan_h_positions, self.scan_v_positions, self.scan_z_positions])
+
+    def h5_scan_arrays(self):
+        arrays = super().h5_scan_arrays()
+        arrays["z_array"] = self.z_array
+        arrays["scan_z_positions"] = self.scan_z_positions
+        return arrays
@@ -0,0 +1,160 @@
+import queue
+import threading
+
+import h5py
+import numpy as np
+
+from ScopeFoundry import h5_io
+
+
+def open_swmr_h5_file(measurement):
+    """Like Measurement.open_new_h5_file(), but the file is created with the latest
+    HDF5 format so that it can be switched to single-writer/multiple-reader mode.
+
+    Create every dataset the run needs, then call start_swmr(). After that other
+    processes can open the file with h5py.File(fname, 'r', libver='latest', swmr=True)
+    and follow the datasets while they grow.
+
+    Sets measurement.h5_file and measurement.h5_meas_group, returns the latter.
+    """
+    measurement.close_h5_file()
+    dataset_metadata = measurement.new_dataset_metadata()
+
+    h5_file = h5py.File(dataset_metadata.h5_file_path, "w", libver="latest")
+    root = h5_file["/"]
+    root.attrs["time_id"] = int(dataset_metadata.t0)
+    root.attrs["unique_id"] = dataset_metadata.unique_id
+    root.attrs["uuid"] = str(dataset_metadata.u)
+    h5_io.h5_save_app_lq(measurement.app, root)
+    h5_io.h5_save_hardware_lq(measurement.app, root)
+
+    measurement.h5_file = h5_file
+    measurement.h5_meas_group = h5_io.h5_create_measurement_group(measurement, h5_file)
+    return measurement.h5_meas_group
+
+
+def start_swmr(h5_file):
+    """Switches the file to SWMR write mode. No new objects can be created afterwards."""
+    h5_file.swmr_mode = True
+
+
+def save_remaining(h5_path, group_name, data):
+    """Reopens a closed stream file and stores the entries of *data* that its
+    measurement group does not have yet, iterables as datasets and scalars as
+    attributes like Measurement.save_h5(). Results only known at the end of a
+    run go in this way, no objects can be created while the file is in SWMR mode.
+    """
+    with h5py.File(h5_path, "a", libver="latest") as h5_file:
+        M = h5_file[group_name]
+        for name, value in data.items():
+            if name in M or name in M.attrs:
+                continue
+            try:
+                iter(value)
+            except TypeError:
+                M.attrs[name] = value
+            else:
+                M.create_dataset(name=name, data=value)
+
+
+class AppendableDataset:
+    """Extendable dataset that grows along axis 0 as blocks are appended."""
+
+    def __init__(self, h5_group, name, row_shape=(), dtype=float, chunk_rows=4096, **kwargs):
+        self.dset = h5_io.create_extendable_h5_dataset(
+            h5_group, name, shape=(0, *row_shape), axis=0, dtype=dtype,
+            chunks=(chunk_rows, *row_shape), **kwargs)
+        self.n = 0
+
+    def append(self, block, flush=True):
+        block = np.asarray(block)
+        if block.shape[0] == 0:
+            return
+        new_n = self.n + block.shape[0]
+        self.dset.resize(new_n, axis=0)
+        self.dset[self.n:new_n] = block
+        self.n = new_n
+        if flush:
+            self.dset.flush()
+
+
+class WriteBehindMap:
+    """h5 map dataset written in whole lines (or planes) from a background thread.
+
+    Pixels are assigned like on the dataset, map[k, j, i] = value, but collect
+    in a numpy block per line (the last *batch_axes* axes). A completed block is
+    handed to a writer thread and stored with one slice write, chunks match the
+    blocks. close() writes the partially filled blocks, e.g. of an interrupted
+    scan, and waits until everything is on disk; call it before the file is closed.
+    """
+
+    def __init__(self, h5_group, name, shape, dtype=float, batch_axes=1, max_pending=64):
+        self.shape = tuple(shape)
+        self.batch_axes = batch_axes
+        self.block_shape = self.shape[len(self.shape) - batch_axes:]
+        self.block_size = int(np.prod(self.block_shape))
+        self.dtype = np.dtype(dtype)
+        self.dset = h5_group.create_dataset(
+            name, shape=self.shape, dtype=dtype,
+            chunks=(1,) * (len(self.shape) - batch_axes) + self.block_shape)
+        self.blocks = {}  # key -> (values, filled mask, number filled)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, name=f"write_behind_{name}", daemon=True)
+        self.writer.start()
+
+    def __setitem__(self, index, value):
+        n = len(self.shape) - self.batch_axes
+        key, pos = tuple(index[:n]), tuple(index[n:])
+        if key not in self.blocks:
+            self.blocks[key] = [np.zeros(self.block_shape, self.dtype),
+                                np.zeros(self.block_shape, bool), 0]
+        block = self.blocks[key]
+        block[0][pos] = value
+        if not block[1][pos]:
+            block[1][pos] = True
+            block[2] += 1
+        if block[2] == self.block_size:
+            del self.blocks[key]
+            self._put(key, block[0], None)
+
+    def _put(self, key, values, mask):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((key, values, mask))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                key, values, mask = item
+                if mask is None:
+                    self.dset[key] = values
+                elif self.error is None:
+                    # partial block, only the pixels that were set
+                    for pos in zip(*np.nonzero(mask)):
+                        self.dset[key + pos] = values[pos]
+            except Exception as err:
+                self.error = err
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Queues the partially filled blocks and waits until all writes are done."""
+        for key, (values, mask, _) in self.blocks.items():
+            self._put(key, values, mask)
+        self.blocks = {}
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if not self.writer.is_alive():
+            return
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.writer.join()
@@ -0,0 +1,90 @@
+import numpy as np
+import pyqtgraph as pg
+from qtpy import QtWidgets
+
+from analysis.spectrum import WINDOWS, WelchAccumulator
+from measurements.scope_read import ScopeRead
+from ScopeFoundryHW.acquisition_source import pick_source
+
+
+class NoiseSpectrum(ScopeRead):
+    """Welch-averaged noise spectrum of the scope input.
+
+    Reads buffers like ScopeRead, but instead of keeping the trace it splits
+    every buffer into overlapping windowed segments and adds their power
+    spectra to a running average. Useful to find pickup lines (mains, switching
+    supplies) on the detector signal without an external analyzer.
+    """
+
+    name = "noise_spectrum"
+
+    def setup(self):
+        super().setup()
+        s = self.settings
+        s["buffer_size"] = 8192
+        s["N"] = 100
+        s.New("segment_size", int, initial=4096, description="samples per FFT segment, sets the resolution")
+        s.New("window", str, initial="hann", choices=WINDOWS)
+        s.New("overlap", float, initial=0.5, vmin=0, vmax=0.9)
+        s.New("n_averages", int, initial=0, ro=True)
+        s.New("resolution_bw", float, initial=0, unit="Hz", ro=True)
+        self.welch = None
+        self.displayed = (None, -1)
+
+    def run(self):
+        source = pick_source(self.app, self.settings["source"])
+        S = self.settings
+        config = source.open_stream(S["buffer_size"], S["sampling_freq"])
+        segment_size = min(S["segment_size"], config.buffer_size)
+
+        self.welch = welch = WelchAccumulator(segment_size, config.sample_freq, S["window"], S["overlap"])
+        self.version = 0
+        S["resolution_bw"] = welch.resolution_bandwidth
+        self.data = {"freq": welch.freqs}
+
+        buffer = source.new_chunk_buffer()
+        try:
+            for i in range(S["N"]):
+                buffer, _ = source.read_chunk(out=buffer)
+                welch.add(buffer)
+                self.version += 1
+                S["n_averages"] = welch.n_averages
+                if i % 10 == 0:
+                    self.set_progress(i * 100.0 / S["N"])
+                if self.interrupt_measurement_called:
+                    break
+        finally:
+            source.close_stream()
+
+        self.data["psd"] = welch.psd
+        self.data["asd"] = np.sqrt(self.data["psd"])
+        self.data["n_averages"] = welch.n_averages
+        if S["save_h5"]:
+            self.save_h5(data=self.data)
+
+    def setup_figure(self):
+        self.ui = QtWidgets.QWidget()
+
+        layout = QtWidgets.QVBoxLayout()
+        self.ui.setLayout(layout)
+        layout.addWidget(
+            self.settings.New_UI(include=("source", "N", "buffer_size", "sampling_freq", "segment_size", "window",
+                                          "overlap", "n_averages", "resolution_bw", "save_h5"))
+        )
+        layout.addWidget(self.new_start_stop_button())
+        self.graphics_widget = pg.GraphicsLayoutWidget(border=(100, 100, 100))
+        self.plot = self.graphics_widget.addPlot(title=self.name)
+        self.plot.setLogMode(x=True, y=True)
+        self.plot.setLabel("bottom", "Frequency", units="Hz")
+        self.plot.setLabel("left", "Noise density", units="V/√Hz")
+        self.plot.showGrid(x=True, y=True)
+        self.plot_lines = {"asd": self.plot.plot(pen="g")}
+        layout.addWidget(self.graphics_widget)
+
+    def update_display(self):
+        welch = self.welch
+        if welch is None or welch.n_averages == 0 or self.displayed == (welch, self.version):
+            return
+        self.displayed = (welch, self.version)
+        # skip the DC bin, it has no place on a log frequency axis
+        self.plot_lines["asd"].setData(x=welch.freqs[1:], y=welch.asd[1:])
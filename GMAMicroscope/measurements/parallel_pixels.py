@@ -0,0 +1,141 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class ParallelPixelCollector:
+    """Reads all registered detectors of a pixel at the same time.
+
+    A detector is a read function without arguments that returns a scalar or
+    an array of fixed shape. collect() starts every read in a thread pool and
+    waits for all of them, so a pixel takes as long as the slowest detector
+    instead of the sum of all. The results are joined into one record of the
+    structured `dtype`:
+        pixel_num, k, j, i   scan index of the pixel
+        t                    time.time() when the reads were started
+        read_time            seconds until the slowest read returned
+        <detector name>      one field per detector, in registration order
+    """
+
+    INDEX_FIELDS = [
+        ("pixel_num", np.int64),
+        ("k", np.int32),
+        ("j", np.int32),
+        ("i", np.int32),
+        ("t", np.float64),
+        ("read_time", np.float64),
+    ]
+
+    def __init__(self):
+        self.detectors = {}
+        self.pool = None
+
+    def add_detector(self, name, read_func, shape=(), dtype=float):
+        """Registers a detector.
+
+        Args:
+            name (str): Field name of its reading in the pixel record.
+            read_func (callable): Returns one reading, called from a pool thread.
+            shape (tuple, optional): Shape of a reading. Defaults to () (scalar).
+            dtype (optional): Dtype of a reading. Defaults to float.
+        """
+        if name in self.detectors or name in dict(self.INDEX_FIELDS):
+            raise ValueError(f"detector name {name!r} already used")
+        self.detectors[name] = (read_func, tuple(shape), np.dtype(dtype))
+
+    @property
+    def names(self):
+        return list(self.detectors)
+
+    @property
+    def dtype(self):
+        fields = [(name, dtype, shape) for name, (_, shape, dtype) in self.detectors.items()]
+        return np.dtype(self.INDEX_FIELDS + fields)
+
+    def start(self):
+        """Creates the thread pool, one worker per detector."""
+        self.stop()
+        self.record = np.zeros((), dtype=self.dtype)
+        self.pool = ThreadPoolExecutor(
+            max_workers=max(1, len(self.detectors)), thread_name_prefix="pixel_read"
+        )
+
+    def collect(self, pixel_num, k, j, i):
+        """Reads all detectors concurrently.
+
+        Returns:
+            array: 0-d record of `dtype`, reused by the next call (copy to keep it).
+        """
+        record = self.record
+        t0 = time.time()
+        futures = [
+            (name, self.pool.submit(read_func))
+            for name, (read_func, _, _) in self.detectors.items()
+        ]
+        for name, future in futures:
+            record[name] = future.result()
+        record["read_time"] = time.time() - t0
+        record["t"] = t0
+        record["pixel_num"] = pixel_num
+        record["k"], record["j"], record["i"] = k, j, i
+        return record
+
+    def stop(self):
+        """Waits for running reads and shuts the pool down."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+class ParallelDetectorScan:
+    """collect_pixel for BaseRaster2DSlowScanV2 / BaseRaster3DSlowScanV2 scans
+    that read several detectors per pixel, e.g.
+
+        class MyScan(ParallelDetectorScan, BaseRaster2DSlowScanV2):
+            def setup_detectors(self):
+                hw = self.app.hardware["noiser_200"]
+                self.pixels.add_detector("noiser_200", hw.settings.get_lq("signal").read_from_hardware)
+
+    The detectors are read in parallel by a ParallelPixelCollector and every
+    pixel record is stored as row pixel_num of the compound dataset 'pixels',
+    trimmed to the rows collected when the scan ends. Subclasses that override
+    pre_scan_setup, collect_pixel or post_scan_cleanup call super().
+    """
+
+    def scan_specific_setup(self):
+        self.pixels = ParallelPixelCollector()
+        self.setup_detectors()
+        names = self.pixels.names or [""]
+        self.settings.New("display_detector", str, initial=names[0], choices=names)
+        self.settings.New("pixel_read_time", float, initial=0.0, ro=True, unit="s", si=True,
+                          description="time the slowest detector took for the last pixel")
+
+    def setup_detectors(self):
+        """Override to register the detectors with self.pixels.add_detector()."""
+        pass
+
+    def pre_scan_setup(self):
+        self.pixels.start()
+        self.pixel_rows = 0
+        if self.settings["save_h5"]:
+            self.pixels_h5 = self.h5_meas_group.create_dataset(
+                "pixels", shape=(self.Npixels,), maxshape=(None,), dtype=self.pixels.dtype
+            )
+            self.h5_meas_group.attrs["detectors"] = self.pixels.names
+
+    def collect_pixel(self, pixel_num, k, j, i):
+        record = self.pixels.collect(pixel_num, k, j, i)
+        self.settings["pixel_read_time"] = float(record["read_time"])
+        self.display_image_map[k, j, i] = np.mean(record[self.settings["display_detector"]])
+        if self.settings["save_h5"]:
+            self.pixels_h5[pixel_num] = record
+        self.pixel_rows = max(self.pixel_rows, pixel_num + 1)
+        return record
+
+    def post_scan_cleanup(self):
+        self.pixels.stop()
+        if self.settings["save_h5"] and hasattr(self, "pixels_h5"):
+            # interrupted or adaptive scans collect fewer than Npixels
+            self.pixels_h5.resize((self.pixel_rows,))
+            del self.pixels_h5
@@ -1,11 +1,22 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pyqtgraph as pg
-from numpy.lib.stride_tricks import as_strided
 from qtpy import QtCore, QtWidgets
 
 from ScopeFoundry import Measurement, h5_io
 
+from analysis.gain import GainStabilizer
+from analysis.histogram import IncrementalHistogram
+from analysis.peaks import DEFAULT_CALIBRATION_FILE, EnergyCalibration, PeakFitter, calibration_path, peak_table
+from analysis.pulse_analysis import analyze_buffer
+from analysis.roi import ROIMonitor, ROITimeSeries, parse_rois
+from analysis.run_control import QUANTITIES, PrecisionController
+from analysis.spectrogram import SpectrogramAccumulator
+from measurements.h5_stream import AppendableDataset, open_swmr_h5_file, save_remaining, start_swmr
+from ScopeFoundryHW.acquisition_source import pick_source, source_names
+
 class PulseHeightAnalyze(Measurement):
 
     name = "pulse_height_analyzer"
@@ -17,6 +28,8 @@ class PulseHeightAnalyze(Measurement):
         """
 
         s = self.settings
+        s.New("source", str, initial="auto", choices=["auto"] + source_names(self.app),
+              description="acquisition source, auto: the fastest connected one")
         s.New("buffer_size", int, initial=8000)
         s.New("pulse_window_size", int, initial=400)
         s.New("sampling_frequency", float, initial=20e6, unit="Hz")
@@ -25,11 +38,59 @@ class PulseHeightAnalyze(Measurement):
         s.New("max_val", float, initial=5.00, unit="V")
         s.New("N", int, initial=1001)
         s.New("save_h5", bool, initial=True)
+        s.New("snapshot_interval", float, initial=0.1, unit="s",
+              description="minimum time between histogram snapshots handed to the display")
+        s.New("swmr_stream", bool, initial=False,
+              description="write pulse heights to the h5 file while the run is going, "
+                          "other processes can follow it (HDF5 SWMR)")
+        s.New("fit_peaks", bool, initial=False, description="search and fit peaks in the live histogram")
+        s.New("peak_fwhm", float, initial=0.05, unit="V", description="expected peak FWHM for the peak search")
+        s.New("max_peaks", int, initial=3)
+        s.New("fit_interval", float, initial=1.0, unit="s")
+        s.New("calibration_file", "file", initial=DEFAULT_CALIBRATION_FILE,
+              description="energy calibration (JSON) used to label fitted peaks, "
+                          "relative to save_dir")
+        s.New("rois", str, initial="",
+              description="regions of interest as 'name:lo-hi; name2:lo-hi' (V)")
+        s.New("stop_at_precision", bool, initial=False,
+              description="stop the run once precision_quantity is known to target_precision "
+                          "(or time_budget is used up), N stays an upper limit")
+        s.New("precision_quantity", str, initial="total_counts", choices=QUANTITIES,
+              description="peak_centroid uses the events inside the first ROI")
+        s.New("target_precision", float, initial=1.0, unit="%",
+              description="relative uncertainty to reach")
+        s.New("time_budget", float, initial=0.0, unit="s", description="0: no time limit")
+        s.New("spectrogram", bool, initial=False,
+              description="also histogram every slice_duration separately; with save_h5 the "
+                          "slices are written to the file as they complete (SWMR file)")
+        s.New("slice_duration", float, initial=1.0, vmin=1e-3, unit="s")
+        s.New("display_slices", int, initial=300, description="most recent slices shown in the live image")
+        s.New("gain_stabilization", bool, initial=False,
+              description="correct gain drift by tracking the reference peak, raw_values stay uncorrected")
+        s.New("reference_peak", float, initial=2.0, unit="V", description="nominal position of the reference peak")
+        s.New("reference_window", float, initial=10.0, unit="%", description="half width of the reference peak search window")
+        s.New("gain_slice", float, initial=5.0, unit="s", description="time slice for each reference centroid")
+        s.New("gain_fit_slices", int, initial=5, description="slices in the gain trend fit")
         #self.data = {"y": np.ones(self.settings["N"])}
         self.data = {}
+        # latest HistogramSnapshot published by the run thread, only read by update_display
+        self.snapshot = None
+        self.displayed_version = -1
+        self.peak_fitter = PeakFitter()
+        # latest live fit (results, label text) from the fit worker, drawn by update_display
+        self.peak_fits = None
+        self.displayed_peak_fits = None
+        self.roi_monitor = None
+        self.roi_series = None
+        self.controller = None
+        self.spectrogram = None
+        self.displayed_spectrogram = (None, -1)
+        self.gain = None
 
     def run(self):
-        hw = self.app.hardware["ads"]
+        # nothing of an earlier run (ROIs, peak fits, ...) may end up in this run's file
+        self.data = {}
+        source = pick_source(self.app, self.settings["source"])
         noise_threshold = self.settings["threshold"]
         buffer_size = self.settings["buffer_size"]
         window_size = self.settings["pulse_window_size"]
@@ -41,68 +102,307 @@ class PulseHeightAnalyze(Measurement):
         US_CONVERSION = 1e6
         MV_CONVERSION = 1000
 
-        #actually will have buffer size of buffer_size*1000 oops
-        hw.open_scope(buffer_size=buffer_size, sample_freq=sampling_frequency)
-
-        raw_data = np.zeros(N)
-
-        legit_data_points = 0
-        data_points = 0
-        deadtime_total = 0
-        loop_deadtime_prev = time.time()
-
-        while legit_data_points <= N:
-            data_points += 1
-            buffer = np.array(hw.read_scope())
-
-            # measure deadtime
-            now = time.time()
-            loop_deadtime = now - loop_deadtime_prev
-            loop_deadtime_prev = now
-
-            # --- reshape into (n_chunks, split_point) ---
-            n_chunks = buffer.size // window_size
-            #chunks = buffer[:n_chunks * window_size].reshape(n_chunks, window_size)
-            chunks = as_strided(buffer, shape=(n_chunks, window_size),
-                    strides=(buffer.strides[0]*window_size, buffer.strides[0]))
-
-            deadtime_total += US_CONVERSION * (loop_deadtime + buffer.size / sampling_frequency) / n_chunks
-            self.data["deadtime_mean"] = deadtime_total / data_points
-
-            # --- vectorized base + height ---
-            base = chunks[:, window_size//10:9*window_size//10].mean(axis=1)
-            height = chunks[:, window_size//10:9*window_size//10].max(axis=1)
-
-            # --- pulse amplitudes ---
-            amplitudes = np.abs(height - base)
-
-            # --- filter pulses above threshold and below max ---
-            valid_amplitudes = amplitudes[amplitudes >= noise_threshold]
-            valid_amplitudes = valid_amplitudes[valid_amplitudes <= max_val]
-
-            if valid_amplitudes.size > 0:
-                end = min(legit_data_points + valid_amplitudes.size, raw_data.size)
-                raw_data[legit_data_points:legit_data_points + valid_amplitudes.size] = valid_amplitudes[:end - legit_data_points]
-                legit_data_points += valid_amplitudes.size
-
-                # keep most recent pulse trace
-                last_idx = np.where(np.abs(amplitudes) >= noise_threshold)[0][-1]
-                self.data["recent_pulse"] = chunks[last_idx, :]
-
-            if self.interrupt_measurement_called:
-                break
-
-            if legit_data_points % 5 == 0 and legit_data_points > 1:
-                counts, bins = np.histogram(raw_data[:legit_data_points - 1], bins=bin_number, range=(noise_threshold, max_val))
-                self.data["x"] = bins
-                self.data["y"] = counts
-                self.set_progress(legit_data_points * 100.0 / self.settings["N"])
-
-        hw.close_scope()
+        # live peak fits run in a worker, off the acquisition loop and the GUI thread
+        fit_pool = self.calibration = None
+        if self.settings["fit_peaks"]:
+            fit_pool = ThreadPoolExecutor(max_workers=1)
+            self.calibration = EnergyCalibration.load(
+                calibration_path(self.settings["calibration_file"], self.app.settings["save_dir"]))
+        fit_future = None
+        self.peak_fits = None
+
+        # the source may round buffer size and rate to what it supports
+        config = source.open_stream(buffer_size, sampling_frequency)
+        try:
+            sampling_frequency = config.sample_freq
+            buffer = source.new_chunk_buffer()
+
+            raw_data = np.zeros(N)
+
+            hist = IncrementalHistogram(bin_number, noise_threshold, max_val)
+            self.data["x"] = hist.edges
+            self.setup_rois(hist.edges)
+            rois = self.roi_monitor
+            controller = self.controller = self.setup_controller()
+            # the spectrogram history goes to disk while the run is going
+            stream = self.settings["save_h5"] and (self.settings["swmr_stream"] or self.settings["spectrogram"])
+            spectrogram = self.spectrogram = None
+            if self.settings["spectrogram"]:
+                # completed slices are only queued when the stream writes them out
+                spectrogram = self.spectrogram = SpectrogramAccumulator(
+                    bin_number, self.settings["slice_duration"], self.settings["display_slices"],
+                    queue_slices=stream)
+
+            gain = self.gain = None
+            if self.settings["gain_stabilization"]:
+                gain = self.gain = GainStabilizer(self.settings["reference_peak"], self.settings["reference_window"] / 100,
+                                                  self.settings["gain_slice"], self.settings["gain_fit_slices"])
+
+            if stream:
+                self.setup_h5_stream(window_size, bin_number)
+            self.snapshot = None
+            self.displayed_version = -1  # versions restart at 0 every run
+            snapshot_interval = self.settings["snapshot_interval"]
+            last_snapshot_time = last_fit_time = 0
+
+            legit_data_points = 0
+            data_points = 0
+            deadtime_total = 0
+            t_start = loop_deadtime_prev = time.time()
+
+            while legit_data_points <= N:
+                data_points += 1
+                buffer, _ = source.read_chunk(out=buffer)
+
+                # measure deadtime
+                now = time.time()
+                loop_deadtime = now - loop_deadtime_prev
+                loop_deadtime_prev = now
+
+                chunks, amplitudes, valid = analyze_buffer(buffer, window_size, noise_threshold, max_val)
+                n_chunks = len(chunks)
+
+                deadtime_total += US_CONVERSION * (loop_deadtime + buffer.size / sampling_frequency) / n_chunks
+                self.data["deadtime_mean"] = deadtime_total / data_points
+
+                valid_amplitudes = amplitudes[valid]
+                batch = None
+
+                if valid_amplitudes.size > 0:
+                    end = min(legit_data_points + valid_amplitudes.size, raw_data.size)
+                    raw_data[legit_data_points:legit_data_points + valid_amplitudes.size] = valid_amplitudes[:end - legit_data_points]
+                    accepted = valid_amplitudes[:end - legit_data_points]
+                    if stream:
+                        self.raw_values_h5.append(accepted)
+                    # raw values are stored uncorrected, everything downstream sees corrected ones
+                    if gain is not None:
+                        accepted = gain.process(accepted, now - t_start, legit_data_points)
+                    batch = hist.add(accepted)
+                    if controller is not None:
+                        controller.add(accepted)
+                    legit_data_points += valid_amplitudes.size
+
+                    # keep most recent pulse trace, a copy as the chunk buffer is reused
+                    last_idx = np.flatnonzero(valid)[-1]
+                    self.data["recent_pulse"] = chunks[last_idx, :].copy()
+
+                if rois is not None:
+                    rois.add(batch, loop_deadtime)
+                if spectrogram is not None:
+                    spectrogram.add(batch, now - t_start)
+
+                if self.interrupt_measurement_called:
+                    break
+
+                # hand a copy to the display at a bounded rate instead of sharing live arrays
+                if now - last_snapshot_time >= snapshot_interval:
+                    last_snapshot_time = now
+                    if rois is not None:
+                        self.roi_series.append(now - t_start, rois)
+                    self.publish_snapshot(hist)
+                    if (fit_pool is not None and now - last_fit_time >= self.settings["fit_interval"]
+                            and (fit_future is None or fit_future.done())):
+                        last_fit_time = now
+                        fit_future = fit_pool.submit(self.fit_snapshot, self.snapshot)
+                    self.set_progress(legit_data_points * 100.0 / self.settings["N"])
+                    if stream:
+                        self.update_h5_stream()
+                    if controller is not None and controller.check(now - t_start):
+                        value, rel = controller.estimate()
+                        print(f"{self.name}: stopping on {controller.stop_reason}, "
+                              f"{controller.quantity} = {value:.6g} +- {100 * rel:.3g} %")
+                        break
+        finally:
+            source.close_stream()
+            if fit_pool is not None:
+                fit_pool.shutdown(wait=True)
+
+        elapsed = time.time() - t_start
+        self.data["lost_samples"] = source.stream_lost
+        print(f"{self.name}: {source.stream_samples / max(elapsed, 1e-9):.4g} samples/s from {source.name}, "
+              f"{source.stream_lost} lost")
+        if spectrogram is not None:
+            spectrogram.finish()
+        if rois is not None:
+            self.roi_series.append(time.time() - t_start, rois)
+            self.save_rois()
+        if controller is not None:
+            self.save_convergence_log()
+        if gain is not None:
+            for name, values in gain.table_arrays().items():
+                self.data[f"gain_{name}"] = values
+        self.publish_snapshot(hist)
         self.data["raw_values"] = raw_data
-
-        if self.settings["save_h5"]:
+        if self.settings["fit_peaks"]:
+            self.save_peak_fits(hist)
+
+        if stream:
+            self.update_h5_stream()
+            h5_path, group_name = self.h5_file.filename, self.h5_meas_group.name
+            self.close_h5_file()
+            # end of run results (peak fits, stop reason, lost samples, ...)
+            save_remaining(h5_path, group_name, self.data)
+        elif self.settings["save_h5"]:
             self.save_h5(data=self.data)
+        if fit_future is not None:
+            fit_future.result()  # raise errors from the fit worker
+
+    def publish_snapshot(self, hist):
+        version = 0 if self.snapshot is None else self.snapshot.version + 1
+        self.snapshot = hist.snapshot(version,
+                                      recent_pulse=self.data.get("recent_pulse"),
+                                      deadtime_mean=self.data.get("deadtime_mean"),
+                                      roi_samples=0 if self.roi_series is None else self.roi_series.n)
+        self.data["y"] = self.snapshot.counts
+
+    def setup_rois(self, edges):
+        self.roi_monitor = self.roi_series = None
+        try:
+            rois = parse_rois(self.settings["rois"])
+        except ValueError as e:
+            print(f"{self.name}: ignoring ROIs, {e}")
+            return
+        if rois:
+            self.roi_monitor = ROIMonitor(rois, edges)
+            self.roi_series = ROITimeSeries(len(rois))
+
+    def setup_controller(self):
+        """PrecisionController for stop_at_precision runs, None otherwise."""
+        S = self.settings
+        if not S["stop_at_precision"]:
+            return None
+        rois = self.roi_monitor
+        window = tuple(rois.limits[0]) if rois is not None else (S["threshold"], S["max_val"])
+        try:
+            return PrecisionController(S["precision_quantity"], S["target_precision"] / 100,
+                                       S["time_budget"], window=window, roi_monitor=rois)
+        except ValueError as e:
+            print(f"{self.name}: stop_at_precision disabled, {e}")
+            return None
+
+    def save_convergence_log(self):
+        for name, values in self.controller.log_arrays().items():
+            self.data[f"convergence_{name}"] = values
+        self.data["stop_reason"] = np.bytes_(self.controller.stop_reason or "N reached")
+
+    def save_rois(self):
+        self.data["roi_names"] = np.array(self.roi_monitor.names, dtype="S")
+        self.data["roi_limits"] = self.roi_monitor.limits
+        for name, values in self.roi_series.arrays().items():
+            self.data[f"roi_{name}"] = values
+
+    def new_peak_fitter(self, edges):
+        bin_width = edges[1] - edges[0]
+        return PeakFitter(max_peaks=self.settings["max_peaks"],
+                          fwhm_bins=max(self.settings["peak_fwhm"] / bin_width, 1.5))
+
+    def save_peak_fits(self, hist):
+        """Final fit of the complete histogram, stored with the run."""
+        try:
+            results = self.new_peak_fitter(hist.edges).fit(hist.counts, hist.edges)
+        except ImportError as e:
+            print(f"{self.name}: {e}")
+            return
+        calibration = self.calibration
+        for name, values in peak_table(results, calibration).items():
+            self.data[f"peak_{name}"] = values
+        if calibration.is_valid:
+            self.data["energy_calibration"] = calibration.coefficients
+
+    def fit_snapshot(self, snapshot):
+        """Warm-started fit of a published histogram, runs in the fit worker.
+
+        Only stores the results and the label text in self.peak_fits,
+        update_display draws them.
+        """
+        fwhm_bins = max(self.settings["peak_fwhm"] / (snapshot.edges[1] - snapshot.edges[0]), 1.5)
+        if (self.peak_fitter.fwhm_bins, self.peak_fitter.max_peaks) != (fwhm_bins, self.settings["max_peaks"]):
+            self.peak_fitter = self.new_peak_fitter(snapshot.edges)
+        try:
+            results = self.peak_fitter.fit(snapshot.counts, snapshot.edges)
+        except ImportError as e:
+            self.peak_fits = ([], str(e))
+            return
+
+        table = peak_table(results, self.calibration)
+        lines = []
+        for i in range(len(table["centroid"])):
+            line = (f"{table['centroid'][i]:.4f} V  FWHM {100 * table['fwhm'][i] / table['centroid'][i]:.2f} %"
+                    f"  net {table['area'][i]:.0f}")
+            if "energy" in table:
+                line += f"  ({table['energy'][i]:.1f} keV)"
+            lines.append(line)
+        self.peak_fits = (results, "\n".join(lines) or "no peaks found")
+
+    def update_peak_display(self):
+        peak_fits = self.peak_fits
+        if peak_fits is self.displayed_peak_fits:
+            return
+        self.displayed_peak_fits = peak_fits
+        results, text = peak_fits or ([], "")
+        while len(self.fit_curves) < len(results):
+            self.fit_curves.append(self.plot.plot(pen=pg.mkPen("r", width=2)))
+        for curve in self.fit_curves[len(results):]:
+            curve.setData([], [])
+        for curve, result in zip(self.fit_curves, results):
+            x = np.linspace(*result.fit_range, 200)
+            curve.setData(x, result.curve(x))
+        self.peaks_label.setText(text)
+
+    def setup_h5_stream(self, window_size, bin_number):
+        """Creates the output file up front and switches it to SWMR mode.
+
+        raw_values grows as pulses are accepted, x/y/recent_pulse/deadtime_mean
+        are overwritten in place. All datasets have to exist before SWMR starts.
+        """
+        M = open_swmr_h5_file(self)
+        self.raw_values_h5 = AppendableDataset(M, "raw_values", dtype=float)
+        self.stream_h5 = {
+            "x": M.create_dataset("x", shape=(bin_number + 1,), dtype=float),
+            "y": M.create_dataset("y", shape=(bin_number,), dtype=np.int64),
+            "recent_pulse": M.create_dataset("recent_pulse", shape=(window_size,), dtype=float),
+            "deadtime_mean": M.create_dataset("deadtime_mean", shape=(), dtype=float),
+        }
+        self.roi_series_h5 = {}
+        if self.roi_monitor is not None:
+            M["roi_names"] = np.array(self.roi_monitor.names, dtype="S")
+            M["roi_limits"] = self.roi_monitor.limits
+            n_rois = len(self.roi_monitor)
+            for name in ROITimeSeries.FIELDS:
+                row_shape = () if name == "time" else (n_rois,)
+                self.roi_series_h5[name] = AppendableDataset(M, f"roi_{name}", row_shape, chunk_rows=256)
+        self.spectrogram_h5 = None
+        if self.spectrogram is not None:
+            # full history on disk, one row per completed slice
+            self.spectrogram_h5 = AppendableDataset(M, "spectrogram", (bin_number,), dtype=np.int64, chunk_rows=64)
+            self.spectrogram_h5.dset.attrs["slice_duration"] = self.spectrogram.slice_duration
+        self.gain_h5 = {}
+        if self.gain is not None:
+            # correction table, correct_events(raw_values, gain_first_event, gain_factor) redoes it
+            for name in GainStabilizer.TABLE_FIELDS:
+                dtype = np.int64 if name in ("first_event", "n_events") else float
+                self.gain_h5[name] = AppendableDataset(M, f"gain_{name}", dtype=dtype, chunk_rows=256)
+        self.convergence_h5 = {}
+        if self.controller is not None:
+            for name in PrecisionController.LOG_FIELDS:
+                self.convergence_h5[name] = AppendableDataset(M, f"convergence_{name}", chunk_rows=256)
+        start_swmr(self.h5_file)
+        print(f"streaming to {self.h5_file.filename}")
+
+    def update_h5_stream(self):
+        for name, dset in self.stream_h5.items():
+            if name in self.data:
+                dset[()] = self.data[name]
+                dset.flush()
+        for name, dset in self.roi_series_h5.items():
+            # only the samples recorded since the last update
+            dset.append(getattr(self.roi_series, name)[dset.n:self.roi_series.n])
+        for name, dset in self.convergence_h5.items():
+            dset.append(self.controller.log_arrays(dset.n)[name])
+        if self.spectrogram_h5 is not None:
+            self.spectrogram_h5.append(self.spectrogram.pop_completed())
+        for name, dset in self.gain_h5.items():
+            dset.append(self.gain.table_arrays(dset.n)[name])
     
     def setup_figure(self):
         self.ui = QtWidgets.QWidget()
@@ -110,17 +410,39 @@ class PulseHeightAnalyze(Measurement):
         self.ui.setLayout(layout)
 
         layout.addWidget(
-            self.settings.New_UI(include=("threshold", "N", "bin_number", "max_val", "save_h5"))
+            self.settings.New_UI(include=("source", "threshold", "N", "bin_number", "max_val", "save_h5", "swmr_stream",
+                                          "fit_peaks", "peak_fwhm", "calibration_file",
+                                          "rois", "stop_at_precision", "precision_quantity",
+                                          "target_precision", "time_budget",
+                                          "gain_stabilization", "reference_peak"))
         )
         layout.addWidget(self.new_start_stop_button())
         self.graphics_widget = pg.GraphicsLayoutWidget(border=(100, 100, 100))
         self.plot = self.graphics_widget.addPlot(title=self.name)
-        self.bar_item = pg.BarGraphItem(x=[], height=[], width=1.0, brush='g')
-        self.plot.addItem(self.bar_item)
+        # one step-mode curve instead of a BarGraphItem with a rectangle per bin
+        self.hist_curve = self.plot.plot(stepMode="center", fillLevel=0, pen="g", brush="g")
+        self.fit_curves = []
 
         self.graphics_widget.nextRow()
         self.recent_plot = self.graphics_widget.addPlot(title="Most Recent Pulse Shape")
         self.recent_curve = self.recent_plot.plot(pen="g")
+
+        self.graphics_widget.nextRow()
+        self.roi_plot = self.graphics_widget.addPlot(title="ROI net count rates")
+        self.roi_plot.setLabel("bottom", "Time", units="s")
+        self.roi_plot.setLabel("left", "Rate", units="1/s")
+        self.roi_plot.addLegend()
+        self.roi_curves = []
+        self.roi_regions = []
+        self.displayed_rois = None
+
+        self.graphics_widget.nextRow()
+        self.spectrogram_plot = self.graphics_widget.addPlot(title="Spectrogram")
+        self.spectrogram_plot.setLabel("bottom", "Time", units="s")
+        self.spectrogram_plot.setLabel("left", "Pulse height", units="V")
+        self.spectrogram_image = pg.ImageItem()
+        self.spectrogram_image.setColorMap(pg.colormap.get("viridis"))
+        self.spectrogram_plot.addItem(self.spectrogram_image)
         layout.addWidget(self.graphics_widget)
 
         # Mean display
@@ -129,19 +451,49 @@ class PulseHeightAnalyze(Measurement):
 
         layout.addWidget(self.mean_label)
 
+        self.peaks_label = QtWidgets.QLabel("")
+        layout.addWidget(self.peaks_label)
+
+        self.roi_label = QtWidgets.QLabel("")
+        layout.addWidget(self.roi_label)
+
+        self.precision_label = QtWidgets.QLabel("")
+        layout.addWidget(self.precision_label)
+
+        self.gain_label = QtWidgets.QLabel("")
+        layout.addWidget(self.gain_label)
+
     def update_display(self):
-        if "x" in self.data and "y" in self.data:
-            x = self.data["x"]
-            y = self.data["y"]
-            x_mid = 0.5 * (x[:-1] + x[1:])
-            bin_width = (np.max(x) - np.min(x)) / self.settings["bin_number"]
-            self.bar_item.setOpts(x=x_mid, height=y, width=bin_width)
+        # fits finish between snapshots
+        self.update_peak_display()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version == self.displayed_version:
+            return
+        self.displayed_version = snapshot.version
+
+        self.hist_curve.setData(x=snapshot.edges, y=snapshot.counts)
+
+        if snapshot.recent_pulse is not None:
+            self.recent_curve.setData(y=snapshot.recent_pulse)
 
-        if "recent_pulse" in self.data:
-            self.recent_curve.setData(y=self.data["recent_pulse"])
+        if self.roi_monitor is not None and snapshot.roi_samples:
+            self.update_roi_display(snapshot.roi_samples)
 
-        if "deadtime_mean" in self.data:
-            mean = self.data["deadtime_mean"]
+        if self.spectrogram is not None:
+            self.update_spectrogram_display(snapshot.edges)
+
+        if self.gain is not None:
+            self.gain_label.setText(f"Gain correction: {self.gain.factor:.5f} "
+                                    f"({self.gain.n_table - 1} reference slices)")
+
+        controller = self.controller
+        if controller is not None and controller.n_log:
+            rel = controller.log["relative_error"][-1]
+            self.precision_label.setText(
+                f"{controller.quantity}: {100 * rel:.3g} % (target {100 * controller.target:g} %)")
+
+        if snapshot.deadtime_mean is not None:
+            mean = snapshot.deadtime_mean
 
             if mean >= 100:
                 color = "red"
@@ -151,3 +503,42 @@ class PulseHeightAnalyze(Measurement):
                 color = "green"
 
             self.mean_label.setText(f'<span style="color:{color}">Mean deadtime: {mean:.2f} us</span>')
+
+    def update_roi_display(self, n):
+        monitor, series = self.roi_monitor, self.roi_series
+        rois = (tuple(monitor.names), monitor.limits.tobytes())
+        if rois != self.displayed_rois:
+            # ROI set changed with a new run: rebuild regions and curves
+            self.displayed_rois = rois
+            for item in self.roi_regions:
+                self.plot.removeItem(item)
+            self.roi_plot.clear()
+            self.roi_plot.legend.clear()
+            self.roi_regions = []
+            self.roi_curves = []
+            for k, (name, (lo, hi)) in enumerate(zip(monitor.names, monitor.limits)):
+                color = pg.intColor(k, hues=max(len(monitor), 3))
+                region = pg.LinearRegionItem((lo, hi), movable=False, brush=pg.mkBrush(color.red(), color.green(), color.blue(), 40))
+                self.plot.addItem(region)
+                self.roi_regions.append(region)
+                self.roi_curves.append(self.roi_plot.plot(pen=color, name=name))
+
+        # samples below n are complete, the arrays are only ever appended to
+        time_axis = series.time[:n]
+        net_rate = series.net_rate[:n]
+        for k, curve in enumerate(self.roi_curves):
+            curve.setData(time_axis, net_rate[:, k])
+        net, rel = series.net[n - 1], series.relative_error[n - 1]
+        self.roi_label.setText("   ".join(
+            f"{name}: net {net[k]:.0f} ({100 * rel[k]:.2f} %)" for k, name in enumerate(monitor.names)))
+
+    def update_spectrogram_display(self, edges):
+        spectrogram = self.spectrogram
+        if self.displayed_spectrogram == (spectrogram, spectrogram.version) or spectrogram.n_slices == 0:
+            return
+        self.displayed_spectrogram = (spectrogram, spectrogram.version)
+        image, t0 = spectrogram.image()
+        # rows are time slices (x axis), columns are amplitude bins (y axis)
+        self.spectrogram_image.setImage(image, autoLevels=True)
+        self.spectrogram_image.setRect(QtCore.QRectF(t0, edges[0], len(image) * spectrogram.slice_duration,
+                                                     edges[-1] - edges[0]))
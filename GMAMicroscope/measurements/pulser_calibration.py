@@ -0,0 +1,208 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyqtgraph as pg
+from qtpy import QtWidgets
+
+from ScopeFoundry import Measurement
+
+from analysis.histogram import IncrementalHistogram
+from analysis.pulse_analysis import analyze_buffer, linear_calibration, peak_stats
+
+
+class PulserCalibration(Measurement):
+    """Steps the ADS wavegen through a list of test pulse amplitudes and records
+    the pulse height peak of each one.
+
+    Every peak's histogram is analysed in a worker thread while the wavegen is
+    already set to the next amplitude and the next peak is being acquired.
+    At the end the centroids/FWHMs of all peaks are evaluated at once and give
+    the channel -> voltage (-> energy) calibration, the integral
+    non-linearity and the resolution curve.
+    """
+
+    name = "pulser_calibration"
+
+    def setup(self):
+        s = self.settings
+        s.New("amp_start", float, initial=0.2, unit="V")
+        s.New("amp_stop", float, initial=4.5, unit="V")
+        s.New("n_points", int, initial=50)
+        s.New("wavegen_channel", int, initial=1, vmin=1, vmax=2)
+        s.New("pulse_freq", float, initial=1e3, unit="Hz")
+        s.New("pulse_width", float, initial=1.0, unit="%", description="pulse width as percentage of the period")
+        s.New("settle_time", float, initial=0.05, unit="s", description="wait after changing the amplitude")
+        # at pulse_freq 1 kHz a buffer of 8000 samples at 20 MHz (0.4 ms) holds
+        # ~0.4 pulses, so the buffer limit allows ~400 events, the target is reached first
+        s.New("events_per_point", int, initial=100)
+        s.New("max_buffers_per_point", int, initial=1000, vmin=1)
+        s.New("buffer_size", int, initial=8000)
+        s.New("pulse_window_size", int, initial=400)
+        s.New("sampling_frequency", float, initial=20e6, unit="Hz")
+        s.New("threshold", float, initial=0.1, unit="V")
+        s.New("max_val", float, initial=5.00, unit="V")
+        s.New("bin_number", int, initial=1024)
+        s.New("energy_per_volt", float, initial=0.0, unit="keV/V",
+              description="energy equivalent of one volt of test pulse, 0 skips the energy calibration")
+        s.New("save_h5", bool, initial=True)
+        self.data = {}
+        self.version = 0
+        self.displayed_version = -1
+
+    def run(self):
+        hw = self.app.hardware["ads"]
+        S = self.settings
+        amplitudes = np.linspace(S["amp_start"], S["amp_stop"], S["n_points"])
+        n_points = len(amplitudes)
+        hist = IncrementalHistogram(S["bin_number"], S["threshold"], S["max_val"])
+
+        self.data = {
+            "amplitudes": amplitudes,
+            "x": hist.edges,
+            "counts": np.zeros((n_points, hist.bin_number), dtype=np.int64),
+            "n_events": np.zeros(n_points, dtype=np.int64),
+            "centroid": np.full(n_points, np.nan),
+            "fwhm": np.full(n_points, np.nan),
+            "point_time": np.zeros(n_points),
+            "n_buffers": np.zeros(n_points, dtype=np.int64),
+            # True where max_buffers_per_point ended the point before events_per_point
+            "buffer_limited": np.zeros(n_points, dtype=bool),
+        }
+        self.version += 1
+
+        hw.open_scope(buffer_size=S["buffer_size"], sample_freq=S["sampling_frequency"])
+        pulser = dict(channel=S["wavegen_channel"], freq_hz=S["pulse_freq"], width_percent=S["pulse_width"])
+        # one worker: peaks are analysed in order while the next one is acquired
+        pool = ThreadPoolExecutor(max_workers=1)
+        futures = []
+        n_done = 0
+        try:
+            for i, amp in enumerate(amplitudes):
+                t0 = time.time()
+                hw.set_pulser(amp, **pulser)
+                time.sleep(S["settle_time"])
+                hw.read_scope()  # may still hold pulses of the previous amplitude
+
+                values, n_buffers = self.collect_point()
+                self.data["n_buffers"][i] = n_buffers
+                self.data["buffer_limited"][i] = (values.size < S["events_per_point"]
+                                                  and n_buffers == S["max_buffers_per_point"])
+                futures.append(pool.submit(self.analyse_point, i, values, hist))
+                self.data["point_time"][i] = time.time() - t0
+                n_done = i + 1
+                self.set_progress(n_done * 100.0 / n_points)
+                if self.interrupt_measurement_called:
+                    break
+        finally:
+            pool.shutdown(wait=True)
+            hw.close_wavegen()
+            hw.close_scope()
+
+        for future in futures:
+            future.result()  # raise errors from the worker
+        n_limited = int(self.data["buffer_limited"][:n_done].sum())
+        if n_limited:
+            print(f"{self.name}: {n_limited} of {n_done} points ended on max_buffers_per_point "
+                  f"before events_per_point was reached")
+        self.calibrate(n_done)
+
+        if S["save_h5"]:
+            self.save_h5(data=self.data)
+
+    def collect_point(self):
+        """Reads buffers until events_per_point pulses were found (or max_buffers_per_point).
+
+        Returns:
+            tuple: (pulse heights, number of buffers read)
+        """
+        S = self.settings
+        hw = self.app.hardware["ads"]
+        values = []
+        n_events = 0
+        for n_buffers in range(1, S["max_buffers_per_point"] + 1):
+            _, amplitudes, valid = analyze_buffer(hw.read_scope(), S["pulse_window_size"],
+                                                  S["threshold"], S["max_val"])
+            values.append(amplitudes[valid])
+            n_events += values[-1].size
+            if n_events >= S["events_per_point"] or self.interrupt_measurement_called:
+                break
+        return np.concatenate(values), n_buffers
+
+    def analyse_point(self, i, values, hist):
+        """Runs in the worker thread: histogram and peak of sweep point i."""
+        counts = hist.batch_counts(values)
+        self.data["counts"][i] = counts
+        self.data["n_events"][i] = values.size
+        self.data["centroid"][i], self.data["fwhm"][i], _ = peak_stats(counts, hist.edges)
+        self.version += 1
+
+    def calibrate(self, n_done):
+        """Evaluates all measured peaks at once and fits the calibration."""
+        d = self.data
+        edges = d["x"]
+        centroid, fwhm, _ = peak_stats(d["counts"][:n_done], edges)
+        d["centroid"][:n_done] = centroid
+        d["fwhm"][:n_done] = fwhm
+        amplitudes = d["amplitudes"]
+
+        # channel (bin index) of each peak
+        bin_width = edges[1] - edges[0]
+        d["channel"] = (d["centroid"] - edges[0]) / bin_width - 0.5
+        with np.errstate(invalid="ignore", divide="ignore"):
+            d["resolution"] = 100 * d["fwhm"] / d["centroid"]
+
+        if np.isfinite(d["centroid"]).sum() < 2:
+            print(f"{self.name}: not enough peaks for a calibration")
+            return
+        # measured pulse height vs injected amplitude: gain, offset and non-linearity
+        d["linearity_fit"], residuals = linear_calibration(amplitudes, d["centroid"])
+        d["inl"] = 100 * residuals / np.nanmax(d["centroid"])
+        # channel -> injected volts
+        d["channel_calibration"], _ = linear_calibration(d["channel"], amplitudes)
+        if self.settings["energy_per_volt"] > 0:
+            d["energy_calibration"] = self.settings["energy_per_volt"] * d["channel_calibration"]
+        self.version += 1
+
+        gain, offset = d["linearity_fit"]
+        print(f"{self.name}: gain {gain:.4f}, offset {offset * 1e3:.2f} mV, "
+              f"max INL {np.nanmax(np.abs(d['inl'])):.3f} %")
+
+    def setup_figure(self):
+        self.ui = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout()
+        self.ui.setLayout(layout)
+        layout.addWidget(
+            self.settings.New_UI(include=("amp_start", "amp_stop", "n_points", "events_per_point",
+                                          "pulse_freq", "threshold", "max_val", "energy_per_volt", "save_h5"))
+        )
+        layout.addWidget(self.new_start_stop_button())
+
+        self.graphics_widget = pg.GraphicsLayoutWidget(border=(100, 100, 100))
+        self.linearity_plot = self.graphics_widget.addPlot(title="Linearity")
+        self.linearity_plot.setLabel("bottom", "Test pulse amplitude", units="V")
+        self.linearity_plot.setLabel("left", "Peak centroid", units="V")
+        self.centroid_curve = self.linearity_plot.plot(pen=None, symbol="o", symbolSize=5, symbolBrush="g")
+        self.fit_curve = self.linearity_plot.plot(pen="w")
+
+        self.graphics_widget.nextRow()
+        self.inl_plot = self.graphics_widget.addPlot(title="Integral non-linearity (%)")
+        self.inl_curve = self.inl_plot.plot(pen="g", symbol="o", symbolSize=4)
+
+        self.graphics_widget.nextRow()
+        self.resolution_plot = self.graphics_widget.addPlot(title="Resolution FWHM (%)")
+        self.resolution_curve = self.resolution_plot.plot(pen="g", symbol="o", symbolSize=4)
+        layout.addWidget(self.graphics_widget)
+
+    def update_display(self):
+        if self.version == self.displayed_version or "centroid" not in self.data:
+            return
+        self.displayed_version = self.version
+        d = self.data
+        done = np.isfinite(d["centroid"])
+        amplitudes = d["amplitudes"][done]
+        self.centroid_curve.setData(amplitudes, d["centroid"][done])
+        self.resolution_curve.setData(amplitudes, 100 * d["fwhm"][done] / d["centroid"][done])
+        if "linearity_fit" in d:
+            self.fit_curve.setData(d["amplitudes"], np.polyval(d["linearity_fit"], d["amplitudes"]))
+            self.inl_curve.setData(amplitudes, d["inl"][done])
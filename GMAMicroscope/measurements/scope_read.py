@@ -1,11 +1,12 @@
-import time
-
 import numpy as np
 import pyqtgraph as pg
 from qtpy import QtCore, QtWidgets
 
 from ScopeFoundry import Measurement, h5_io
 
+from analysis.decimation import LiveTraceView
+from ScopeFoundryHW.acquisition_source import pick_source, source_names
+
 class ScopeRead(Measurement):
     
     name = "read_scope"
@@ -21,40 +22,64 @@ class ScopeRead(Measurement):
         s.New("sampling_freq", float, initial=1e6, unit="Hz")
         s.New("N", int, initial=1001)
         s.New("save_h5", bool, initial=False)
+        s.New("live_window", int, initial=20000, description="samples shown in the live (latest) plot")
+        s.New("overview_points", int, initial=2000, description="min/max blocks in the run overview plot")
+        s.New("source", str, initial="auto", choices=["auto"] + source_names(self.app),
+              description="acquisition source, auto: the fastest connected one")
+        s.New("native_dtype", bool, initial=False,
+              description="store y as the source's raw samples (volts = y * y_scale + y_offset)")
         self.data = {}
+        self.live_view = LiveTraceView()
+        self.displayed = (None, -1)
     
     def run(self):
-        hw = self.app.hardware["ads"]
-        sampling_freq = self.settings["sampling_freq"]
-        buffer_size = self.settings["buffer_size"]
+        source = pick_source(self.app, self.settings["source"])
         N = self.settings["N"]
+        raw = self.settings["native_dtype"]
 
         MS_CONVERSION = 1e3
         US_CONVERSION = 1e6
 
-        hw.open_scope(buffer_size=buffer_size, sample_freq=sampling_freq)
+        # the source may round buffer size and rate to what it supports
+        config = source.open_stream(self.settings["buffer_size"], self.settings["sampling_freq"])
+        buffer_size, sampling_freq = config.buffer_size, config.sample_freq
+        print(f"{self.name}: reading {config} from {source.name}")
 
         total_points = N * buffer_size
-        self.data["y"] = np.zeros(total_points)
+        self.data = {}
+        self.data["y"] = np.zeros(total_points, dtype=config.native_dtype if raw else float)
         self.data["x"] = np.zeros(total_points)
-
-        #loop_offset_time = 0
-        loop_start = time.time()
-        for i in range(int(self.settings["N"])):
-            buffer, loop_deadtime = hw.read_scope(), time.time() - loop_start
-            start = i * buffer_size
-            end = start + buffer_size
-            self.data["y"][start:end] = buffer
-            self.data["x"][start:end] = US_CONVERSION*(loop_deadtime + np.arange(buffer_size)/sampling_freq)
-            #self.data["deadtime_mean"] = MS_CONVERSION * loop_deadtime / (i+1)
-
-            if i%10 == 0:
-                self.set_progress(i * 100.0 / self.settings["N"])
-            #self.update_display()
-            if self.interrupt_measurement_called:
-                break
-
-        hw.close_scope()
+        volts = np.zeros(buffer_size)
+        sample_times = US_CONVERSION * np.arange(buffer_size) / sampling_freq
+
+        # the display only ever sees these fixed size views, not the growing arrays
+        self.live_view = LiveTraceView(self.settings["live_window"], self.settings["overview_points"])
+
+        t_first = None
+        try:
+            for i in range(int(self.settings["N"])):
+                start = i * buffer_size
+                end = start + buffer_size
+                # chunks land directly in the run arrays
+                y, info = source.read_chunk(out=self.data["y"][start:end], raw=raw)
+                if t_first is None:
+                    t_first = info.timestamp
+                self.data["x"][start:end] = US_CONVERSION * (info.timestamp - t_first) + sample_times
+                if raw:
+                    y = config.to_volts(y, out=volts)
+                self.live_view.append(self.data["x"][start:end], y)
+
+                if i%10 == 0:
+                    self.set_progress(i * 100.0 / self.settings["N"])
+                if self.interrupt_measurement_called:
+                    break
+        finally:
+            source.close_stream()
+
+        self.data["lost_samples"] = source.stream_lost
+        if raw:
+            self.data["y_scale"] = config.scale
+            self.data["y_offset"] = config.offset
         if self.settings["save_h5"]:
             # saves data, closes file,
             self.save_h5(data=self.data)
@@ -70,12 +95,15 @@ class ScopeRead(Measurement):
         layout = QtWidgets.QVBoxLayout()
         self.ui.setLayout(layout)
         layout.addWidget(
-            self.settings.New_UI(include=("N", "save_h5"))
+            self.settings.New_UI(include=("source", "N", "save_h5", "live_window"))
         )
         layout.addWidget(self.new_start_stop_button())
         self.graphics_widget = pg.GraphicsLayoutWidget(border=(100, 100, 100))
         self.plot = self.graphics_widget.addPlot(title=self.name)
         self.plot_lines = {"y": self.plot.plot(pen="g")}
+        self.graphics_widget.nextRow()
+        self.overview_plot = self.graphics_widget.addPlot(title="Run overview (min/max)")
+        self.plot_lines["overview"] = self.overview_plot.plot(pen="g")
 
         layout.addWidget(self.graphics_widget)
 
@@ -86,8 +114,14 @@ class ScopeRead(Measurement):
         #layout.addWidget(self.mean_label)
 
     def update_display(self):
-        if "x" in self.data and "y" in self.data:
-            self.plot_lines["y"].setData(x=self.data["x"], y=self.data["y"])
+        view = self.live_view
+        if self.displayed == (view, view.version):
+            return
+        self.displayed = (view, view.version)
+        x, y = view.window()
+        self.plot_lines["y"].setData(x=x, y=y)
+        x, y = view.overview()
+        self.plot_lines["overview"].setData(x=x, y=y)
         #if "deadtime_mean" in self.data:
         #    mean = self.data["deadtime_mean"]
 
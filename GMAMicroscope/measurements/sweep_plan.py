@@ -0,0 +1,465 @@
+import json
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from qtpy import QtGui, QtWidgets
+
+from ScopeFoundry import Measurement
+from ScopeFoundry.sequencer.item_types import new_item
+
+OPERATORS = {
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+}
+
+# steps that may follow the last measurement of an iteration body when the
+# next iteration value is prefetched, none of them starts an acquisition
+PREFETCH_SAFE = ("timeout", "read_from_hardware", "interrupt-if", "wait-until")
+# run_state of a measurement that has left run(); before run_thread_run it has not acquired yet
+PREFETCH_STATES = ("run_thread_end", "run_post_run")
+
+
+def hardware_of(path):
+    """Hardware component name of a 'hw/<name>/<setting>' path, else the path itself."""
+    parts = path.split("/")
+    return parts[1] if parts[0] == "hw" and len(parts) > 2 else path
+
+
+class Loop:
+    """State of one start-iteration / end-iteration pair."""
+
+    __slots__ = ("iter_id", "path", "lq", "values", "idx", "start", "end", "pending")
+
+    def __init__(self, iter_id, path, lq, values, start):
+        self.iter_id = iter_id
+        self.path = path
+        self.lq = lq
+        self.values = [lq.coerce_to_type(v) for v in values]
+        self.idx = -1
+        self.start = start
+        self.end = None
+        self.pending = None  # future of a prefetched write of values[idx + 1]
+
+
+class CompiledPlan:
+    """A sequencer plan compiled once against an app and run with little
+    overhead per step.
+
+    A plan is the list of item dicts that ScopeFoundry's Sequencer saves, e.g.
+    sweep_h_centers.json. Compiling resolves settings, measurements, operators,
+    constant values and loop jumps up front, every step becomes a closure that
+    returns the index of the next step, so execute() is a tight loop.
+
+    Consecutive read_from_hardware steps are merged into one step that reads
+    different hardware components in parallel (reads of one component stay in
+    order). With prefetch, the next value of an iteration is written in the
+    background as soon as the last measurement of the iteration body leaves
+    its run() (i.e. has acquired and saved), overlapping the measurement's
+    shutdown and the rest of the body, and the next start-iteration only waits
+    for that write. This is only done when the steps after that measurement
+    are PREFETCH_SAFE and do not use the iteration setting.
+
+    Every executed step is logged as (step, start time, duration), see
+    timing_table().
+    """
+
+    def __init__(self, host, items, prefetch=True, pool_size=4):
+        self.host = host  # the Measurement executing the plan
+        self.app = host.app
+        self.items = items
+        self.prefetch = prefetch
+        self.pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="plan")
+        self.kinds = []
+        self.labels = []
+        self.funcs = []
+        self.loops = []
+        self.log = []
+        self.t0 = None
+        self.compile()
+
+    def compile(self):
+        groups = self.group_reads(self.items)
+        loops = self.link_loops(groups)
+        prefetch_at = self.prefetch_points(groups, loops) if self.prefetch else {}
+        for pc, (kind, kwargs) in enumerate(groups):
+            func = getattr(self, "compile_" + kind.replace("-", "_"), None)
+            if func is None:
+                func = self.compile_item
+            self.kinds.append(kind)
+            self.labels.append(self.label(kind, kwargs))
+            self.funcs.append(func(pc, kwargs, loops=loops, prefetch=prefetch_at.get(pc)))
+        self.loops = list(loops.values())
+
+    @staticmethod
+    def group_reads(items):
+        """(kind, kwargs) of the plan with runs of read_from_hardware merged
+        into one 'read_from_hardware' entry with a list of settings."""
+        groups = []
+        for item in items:
+            kind = item["type"]
+            kwargs = {k: v for k, v in item.items() if k != "type"}
+            if kind == "read_from_hardware":
+                if groups and groups[-1][0] == "read_from_hardware":
+                    groups[-1][1]["settings"].append(kwargs["setting"])
+                    continue
+                kwargs = {"settings": [kwargs["setting"]]}
+            groups.append((kind, kwargs))
+        return groups
+
+    def link_loops(self, groups):
+        """{start index: Loop}, with Loop.end the index of the matching end-iteration."""
+        loops = {}
+        stack = []
+        for pc, (kind, kwargs) in enumerate(groups):
+            if kind == "start-iteration":
+                loop = Loop(kwargs["iter_id"], kwargs["setting"], self.app.get_lq(kwargs["setting"]),
+                            kwargs["values"], pc)
+                loops[pc] = loop
+                stack.append(loop)
+            elif kind == "end-iteration":
+                if not stack:
+                    raise ValueError(f"step {pc}: end-iteration without start-iteration")
+                stack.pop().end = pc
+        if stack:
+            raise ValueError(f"start-iteration {stack[-1].iter_id} without end-iteration")
+        return loops
+
+    @staticmethod
+    def prefetch_points(groups, loops):
+        """{measurement step index: Loop} where a loop's next value can be prefetched."""
+        points = {}
+        for loop in loops.values():
+            for pc in range(loop.end - 1, loop.start, -1):
+                kind, kwargs = groups[pc]
+                if kind == "measurement":
+                    points[pc] = loop
+                    break
+                paths = kwargs.get("settings", [kwargs.get("setting")])
+                if kind not in PREFETCH_SAFE or loop.path in paths:
+                    break
+        return points
+
+    @staticmethod
+    def label(kind, kwargs):
+        return kind + ": " + " ".join(str(v) for k, v in kwargs.items() if k != "values")
+
+    # compilers, each returns the step closure
+
+    def compile_start_iteration(self, pc, kwargs, loops, **_):
+        loop = loops[pc]
+        iter_values = self.host.iter_values
+        nxt = pc + 1
+
+        def start_iteration():
+            loop.idx += 1
+            value = loop.values[loop.idx]
+            if loop.pending is not None:
+                loop.pending.result()  # written ahead while the last point finished
+                loop.pending = None
+            else:
+                loop.lq.update_value(value)
+            iter_values[loop.iter_id] = value
+            return nxt
+
+        return start_iteration
+
+    def compile_end_iteration(self, pc, kwargs, loops, **_):
+        loop = [l for l in loops.values() if l.end == pc][0]
+        nxt = pc + 1
+
+        def end_iteration():
+            if loop.idx + 1 < len(loop.values):
+                return loop.start
+            loop.idx = -1
+            return nxt
+
+        return end_iteration
+
+    def compile_read_from_hardware(self, pc, kwargs, **_):
+        tasks = {}
+        for path in kwargs["settings"]:
+            tasks.setdefault(hardware_of(path), []).append(self.app.get_lq(path))
+        tasks = list(tasks.values())
+        pool = self.pool
+        nxt = pc + 1
+
+        def read_all(lqs):
+            for lq in lqs:
+                lq.read_from_hardware()
+
+        if len(tasks) == 1:
+            lqs = tasks[0]
+
+            def read_from_hardware():
+                read_all(lqs)
+                return nxt
+
+        else:
+
+            def read_from_hardware():
+                for future in [pool.submit(read_all, lqs) for lqs in tasks]:
+                    future.result()
+                return nxt
+
+        return read_from_hardware
+
+    def compile_interrupt_if(self, pc, kwargs, **_):
+        lq = self.app.get_lq(kwargs["setting"])
+        relate = OPERATORS[kwargs["operator"]]
+        value = lq.coerce_to_type(kwargs["value"])
+        host = self.host
+        nxt = pc + 1
+
+        def interrupt_if():
+            if relate(lq.val, value):
+                host.interrupt()
+            return nxt
+
+        return interrupt_if
+
+    def compile_wait_until(self, pc, kwargs, **_):
+        lq = self.app.get_lq(kwargs["setting"])
+        relate = OPERATORS[kwargs["operator"]]
+        value = lq.coerce_to_type(kwargs["value"])
+        host = self.host
+        nxt = pc + 1
+
+        def wait_until():
+            while not relate(lq.val, value) and not host.interrupt_measurement_called:
+                time.sleep(0.005)
+            return nxt
+
+        return wait_until
+
+    def compile_timeout(self, pc, kwargs, **_):
+        duration = float(kwargs["time"])
+        host = self.host
+        nxt = pc + 1
+
+        def timeout():
+            t_end = time.perf_counter() + duration
+            while not host.interrupt_measurement_called:
+                remaining = t_end - time.perf_counter()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 0.05))
+            return nxt
+
+        return timeout
+
+    def compile_update_setting(self, pc, kwargs, **_):
+        lq = self.app.get_lq(kwargs["setting"])
+        value = kwargs["value"]
+        iter_values = self.host.iter_values
+        nxt = pc + 1
+        if value in self.app.get_setting_paths():
+            source = self.app.get_lq(value)
+
+            def update_setting():
+                lq.update_value(source.val)
+                return nxt
+
+        elif isinstance(value, str) and "__" in value:
+            letter = value[value.find("__") + 2]
+
+            def update_setting():
+                lq.update_value(iter_values[letter])
+                return nxt
+
+        else:
+            value = lq.coerce_to_type(value)
+
+            def update_setting():
+                lq.update_value(value)
+                return nxt
+
+        return update_setting
+
+    def compile_measurement(self, pc, kwargs, prefetch=None, **_):
+        measure = self.app.measurements[kwargs["measurement"]]
+        repetitions = int(kwargs["repetitions"])
+        nxt = pc + 1
+
+        def measurement():
+            for rep in range(repetitions):
+                self.run_measurement(measure, prefetch if rep == repetitions - 1 else None)
+            return nxt
+
+        return measurement
+
+    def compile_item(self, pc, kwargs, **_):
+        # rare steps (pause, function, new_dir, ...) run through ScopeFoundry's own items
+        item = new_item(self.host, self.kinds[pc], **kwargs)
+        nxt = pc + 1
+
+        def visit():
+            item.visit()
+            return nxt
+
+        return visit
+
+    def run_measurement(self, measure, loop=None):
+        """Runs *measure* to completion, prefetching loop's next value once it left run()."""
+        host = self.host
+        measure.interrupt_measurement_called = False
+        measure.start()
+        t0 = time.time()
+        while not measure.is_measuring():
+            time.sleep(0.002)
+            if time.time() - t0 > 1.0:
+                print(f"{host.name}: {measure.name} has not started before timeout")
+                break
+        while measure.is_measuring():
+            if host.interrupt_measurement_called:
+                measure.interrupt()
+            if loop is not None and measure.settings["run_state"] in PREFETCH_STATES:
+                self.prefetch_next(loop)
+                loop = None
+            time.sleep(0.002)
+        if loop is not None:
+            self.prefetch_next(loop)
+        if measure.settings["run_state"] != "stop_success":
+            print(f"{host.name}: {measure.name} ended with {measure.settings['run_state']}")
+
+    def prefetch_next(self, loop):
+        if loop.idx + 1 < len(loop.values) and not self.host.interrupt_measurement_called:
+            loop.pending = self.pool.submit(loop.lq.update_value, loop.values[loop.idx + 1])
+
+    def execute(self):
+        """Runs the plan once from the first step."""
+        for loop in self.loops:
+            self.settle(loop)
+            loop.idx = -1
+        funcs = self.funcs
+        n = len(funcs)
+        host = self.host
+        paused = host.settings.get_lq("paused")
+        log = self.log.append
+        clock = time.perf_counter
+        if self.t0 is None:
+            self.t0 = clock()
+        t0 = self.t0
+
+        pc = 0
+        while pc < n and not host.interrupt_measurement_called:
+            while paused.val and not host.interrupt_measurement_called:
+                time.sleep(0.03)
+            host.current_step = pc
+            t = clock()
+            nxt = funcs[pc]()
+            log((pc, t - t0, clock() - t))
+            pc = nxt
+        host.current_step = None
+
+    @staticmethod
+    def settle(loop):
+        if loop.pending is not None:
+            loop.pending.result()
+            loop.pending = None
+
+    def close(self):
+        for loop in self.loops:
+            self.settle(loop)
+        self.pool.shutdown(wait=True)
+
+    def timing_arrays(self):
+        """Per-visit log and per-step totals.
+
+        Returns:
+            dict: step, start, duration (one entry per executed step) and
+            visits, total, max per plan step; overhead is the run time not
+            spent inside steps.
+        """
+        n = len(self.funcs)
+        log = np.array(self.log, dtype=float).reshape(-1, 3)
+        step = log[:, 0].astype(int)
+        duration = log[:, 2]
+        longest = np.zeros(n)
+        np.maximum.at(longest, step, duration)
+        wall = log[-1, 1] + log[-1, 2] if len(log) else 0.0
+        return {
+            "step": step,
+            "start": log[:, 1],
+            "duration": duration,
+            "visits": np.bincount(step, minlength=n),
+            "total": np.bincount(step, weights=duration, minlength=n),
+            "max": longest,
+            "overhead": wall - duration.sum(),
+        }
+
+    def timing_table(self):
+        T = self.timing_arrays()
+        lines = [f"{'step':>4} {'visits':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9}  item"]
+        for i, label in enumerate(self.labels):
+            mean = T["total"][i] / max(T["visits"][i], 1)
+            lines.append(f"{i:>4} {T['visits'][i]:>6} {T['total'][i]:>9.3f} {mean * 1e3:>9.2f} "
+                         f"{T['max'][i] * 1e3:>9.2f}  {label}")
+        lines.append(f"sequencer overhead {T['overhead'] * 1e3:.2f} ms over {len(T['step'])} steps")
+        return "\n".join(lines)
+
+
+class PlanSequencer(Measurement):
+    """Runs a sequencer plan file (e.g. sweep_h_centers.json) compiled with
+    CompiledPlan and logs how long each step took."""
+
+    name = "plan_sequencer"
+
+    def setup(self):
+        S = self.settings
+        S.new_file("plan_file", initial="sweep_h_centers.json", is_dir=False,
+                   file_filters=("Sequence (*.json)",))
+        S.New("cycles", int, initial=1, vmin=1, description="number of times the plan is executed")
+        S.New("paused", bool, initial=False)
+        S.New("prefetch", bool, initial=True,
+              description="write the next iteration value while the last measurement finishes")
+        S.New("read_threads", int, initial=4, vmin=1, description="parallel hardware reads")
+        S.New("overhead", float, initial=0.0, ro=True, unit="s", si=True,
+              description="run time of the last run spent between steps")
+        S.New("save_h5", bool, initial=True)
+        self.iter_values = {}
+        self.current_step = None
+        self.timing = ""
+
+    def setup_figure(self):
+        self.ui = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout()
+        self.ui.setLayout(layout)
+        layout.addWidget(self.settings.New_UI(exclude=("activation", "run_state", "progress", "profile")))
+        layout.addWidget(self.new_start_stop_button())
+        self.timing_text = QtWidgets.QPlainTextEdit()
+        self.timing_text.setReadOnly(True)
+        self.timing_text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        layout.addWidget(self.timing_text)
+
+    def run(self):
+        S = self.settings
+        with open(S["plan_file"]) as f:
+            items = json.load(f)
+        self.iter_values = {}
+        plan = CompiledPlan(self, items, prefetch=S["prefetch"], pool_size=S["read_threads"])
+        self.plan = plan
+        try:
+            for q in range(S["cycles"]):
+                if self.interrupt_measurement_called:
+                    break
+                plan.execute()
+                self.set_progress(100.0 * (q + 1) / S["cycles"])
+        finally:
+            plan.close()
+            self.timing = plan.timing_table()
+            S["overhead"] = plan.timing_arrays()["overhead"]
+
+        if S["save_h5"]:
+            data = plan.timing_arrays()
+            data["plan"] = json.dumps(items)
+            data["labels"] = np.array(plan.labels, dtype="S")
+            self.save_h5(data=data)
+
+    def update_display(self):
+        if hasattr(self, "timing_text") and self.timing != self.timing_text.toPlainText():
+            self.timing_text.setPlainText(self.timing)